@@ -0,0 +1,253 @@
+import time
+import asyncio
+from collections import Counter
+
+import globals
+from globals import log
+
+from subprocess_functions import poll_output
+import health
+from docker_functions import invalidate_container_state, docker_container_inspect
+
+
+SLOTS = ('blue', 'green')
+
+
+def enabled(name):
+    return globals.config_data['repos'][name].get('deploy_strategy', 'recreate') == 'blue_green'
+
+
+def slot_port(name, slot):
+    repo = globals.config_data['repos'][name]
+    ports = repo.get('blue_green_ports') or [repo['port'] + 10000, repo['port'] + 20000]
+
+    return ports[SLOTS.index(slot)]
+
+
+def state(name):
+    return globals.repo_data[name].setdefault('blue_green', {'active': None, 'versions': {}})
+
+
+def container_name(name):
+    # the container currently serving the repo, used by the dashboard and event watcher
+    if name in globals.config_data.get('repos', {}) and enabled(name) and name in globals.repo_data:
+        active = state(name)['active']
+        if active:
+            return f"{name}-{active}"
+
+    return name
+
+##  proxy
+
+class UpstreamProxy:
+    """TCP proxy on the repo port, new connections go to the current upstream."""
+
+    def __init__(self, name, listen_port):
+        self.name = name
+        self.listen_port = listen_port
+        self.upstream = None
+        self.server = None
+        self.connections = Counter()
+        self.total_connections = 0
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, globals.BLUE_GREEN_LISTEN_HOST, self.listen_port)
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    def switch(self, upstream):
+        self.upstream = upstream
+
+    async def handle(self, reader, writer):
+        upstream = self.upstream
+
+        try:
+            if upstream is None:
+                raise ConnectionRefusedError
+            upstream_reader, upstream_writer = await asyncio.open_connection(*upstream)
+        except OSError:
+            writer.close()
+            return
+
+        self.connections[upstream] += 1
+        self.total_connections += 1
+
+        try:
+            await asyncio.gather(pipe(reader, upstream_writer), pipe(upstream_reader, writer))
+        finally:
+            self.connections[upstream] -= 1
+            writer.close()
+            upstream_writer.close()
+
+    async def drain(self, upstream, timeout):
+        deadline = time.monotonic() + timeout
+
+        while self.connections[upstream] > 0 and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+
+        return self.connections[upstream]
+
+    def stats(self):
+        return {
+            'listen_port': self.listen_port,
+            'upstream': self.upstream,
+            'open_connections': sum(self.connections.values()),
+            'total_connections': self.total_connections,
+        }
+
+
+async def pipe(reader, writer):
+    try:
+        while data := await reader.read(65536):
+            writer.write(data)
+            await writer.drain()
+
+        if writer.can_write_eof():
+            writer.write_eof()
+    except OSError:
+        writer.close()
+
+
+proxies = {}
+
+
+async def ensure_proxy(name):
+    port = globals.config_data['repos'][name]['port']
+    proxy = proxies.get(name)
+
+    if proxy and proxy.listen_port == port:
+        return proxy
+
+    if proxy:
+        await proxy.stop()
+
+    proxy = proxies[name] = UpstreamProxy(name, port)
+
+    active = state(name)['active']
+    if active:
+        proxy.switch((globals.config_data['host_address'], slot_port(name, active)))
+
+    await proxy.start()
+    log(f"Blue/green proxy listening on port {port}.", keyword=name)
+
+    return proxy
+
+
+async def sync_proxies():
+    # start proxies for blue/green repos that already have an active container, stop the rest
+    repos = globals.config_data.get('repos', {})
+
+    for name in list(proxies):
+        if name not in repos or not enabled(name):
+            await proxies.pop(name).stop()
+
+    for name in repos:
+        if enabled(name) and name in globals.repo_data and state(name)['active']:
+            try:
+                await ensure_proxy(name)
+            except OSError as e:
+                log(f"Could not start the blue/green proxy: {e}", keyword=name)
+
+##  deploy / switch
+
+async def run(name, command):
+    def log_callback(line):
+        log(line, keyword=name, print_message=False)
+
+    try:
+        await poll_output(command, callback=log_callback)
+    finally:
+        invalidate_container_state()
+
+
+async def deploy(name, version):
+    repo = globals.config_data['repos'][name]
+    host = globals.config_data['host_address']
+    bg = state(name)
+
+    previous = bg['active']
+    target = 'green' if previous == 'blue' else 'blue'
+    container = f"{name}-{target}"
+    port = slot_port(name, target)
+
+    command = repo['blue_green_command'].format(
+        version_tag_scheme=version,
+        name=name,
+        container=container,
+        port=port,
+        host_address=host
+    )
+
+    log(f"Starting {version} as {container}: {command}", keyword=name)
+    await run(name, f"docker rm -f {container} || true && {command}")
+
+    started = time.monotonic()
+
+    if not await health.wait_healthy(name, port):
+        log(f"{container} did not become ready, traffic stays on {previous or 'nothing'}.", keyword=name)
+        await run(name, f"docker rm -f {container} || true")
+        raise RuntimeError(f"{container} not ready")
+
+    log(f"{container} ready after {time.monotonic() - started:.2f} seconds.", keyword=name)
+
+    if name not in proxies:
+        # the port may still be held by a container from the recreate strategy
+        await run(name, f"docker rm -f {name} || true")
+
+    proxy = await ensure_proxy(name)
+    proxy.switch((host, port))
+
+    bg['active'] = target
+    bg['versions'][target] = version
+    log(f"Switched traffic to {container}.", keyword=name)
+
+    if previous:
+        old_container = f"{name}-{previous}"
+        remaining = await proxy.drain((host, slot_port(name, previous)), globals.BLUE_GREEN_DRAIN_SECONDS)
+
+        if remaining:
+            log(f"{remaining} connections to {old_container} still open after draining.", keyword=name)
+
+        if repo.get('blue_green_standby', True):
+            log(f"Keeping {old_container} as standby for rollback.", keyword=name)
+        else:
+            await run(name, f"docker rm -f {old_container} || true")
+            bg['versions'].pop(previous, None)
+
+
+async def standby_running(name):
+    bg = state(name)
+    if not bg['active']:
+        return False
+
+    standby = 'green' if bg['active'] == 'blue' else 'blue'
+    if standby not in bg['versions']:
+        return False
+
+    _, inspect = await docker_container_inspect(f"{name}-{standby}")
+    return bool(inspect) and inspect[0]['State'].get('Running', False)
+
+
+async def switch_back(name):
+    host = globals.config_data['host_address']
+    bg = state(name)
+
+    standby = 'green' if bg['active'] == 'blue' else 'blue'
+
+    proxy = await ensure_proxy(name)
+    proxy.switch((host, slot_port(name, standby)))
+
+    failed = bg['active']
+    bg['active'] = standby
+    bg['versions'].pop(failed, None)
+    log(f"Switched traffic back to {name}-{standby} ({bg['versions'][standby]}).", keyword=name)
+
+    await run(name, f"docker rm -f {name}-{failed} || true")
+
+
+def stats():
+    return {name: proxy.stats() | {'active': state(name)['active']} for name, proxy in proxies.items()}
@@ -0,0 +1,180 @@
+import os
+import re
+import hashlib
+import subprocess
+
+import globals
+from globals import log
+
+from subprocess_functions import check_output
+from buildkit import command_template
+
+
+ALWAYS_IN_CONTEXT = {'Dockerfile', '.dockerignore'}
+
+##  .dockerignore / glob matching
+
+def compile_pattern(pattern):
+    # docker's filepath.Match plus `**`; a pattern also matches everything below a matched directory
+    regex = ''
+    i = 0
+
+    while i < len(pattern):
+        char = pattern[i]
+
+        if pattern.startswith('**/', i):
+            regex += '(?:.*/)?'
+            i += 3
+            continue
+        if pattern.startswith('**', i):
+            regex += '.*'
+            i += 2
+            continue
+
+        if char == '*':
+            regex += '[^/]*'
+        elif char == '?':
+            regex += '[^/]'
+        elif char == '[' and ']' in pattern[i + 1:]:
+            end = pattern.index(']', i + 1)
+            body = pattern[i + 1:end]
+            # only a leading ! negates the class, elsewhere it is a literal
+            if body.startswith('!'):
+                body = '^' + body[1:]
+            regex += '[' + body + ']'
+            i = end
+        else:
+            regex += re.escape(char)
+
+        i += 1
+
+    return re.compile(regex + '(?:/.*)?')
+
+
+def load_dockerignore(repo_dir):
+    patterns = []
+
+    try:
+        with open(os.path.join(repo_dir, '.dockerignore')) as file:
+            lines = file.read().splitlines()
+    except OSError:
+        return patterns
+
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+
+        negate = line.startswith('!')
+        pattern = os.path.normpath(line.lstrip('!').strip().lstrip('/'))
+        patterns.append((negate, compile_pattern(pattern)))
+
+    return patterns
+
+
+def in_build_context(path, ignore_patterns, include_patterns):
+    if path in ALWAYS_IN_CONTEXT:
+        return True
+
+    if include_patterns and not any(pattern.fullmatch(path) for pattern in include_patterns):
+        return False
+
+    # the last matching .dockerignore pattern decides
+    ignored = False
+    for negate, pattern in ignore_patterns:
+        if pattern.fullmatch(path):
+            ignored = not negate
+
+    return not ignored
+
+##  fingerprints
+
+def context_matchers(name):
+    repo = globals.config_data['repos'][name]
+    repo_dir = os.path.join(globals.REPO_DATA_PATH, name)
+
+    ignore_patterns = load_dockerignore(repo_dir)
+    include_patterns = [compile_pattern(glob.lstrip('/')) for glob in repo.get('build_context_globs') or []]
+
+    return repo_dir, ignore_patterns, include_patterns
+
+
+async def compute_fingerprint(name, commit_hash=None):
+    repo_dir, ignore_patterns, include_patterns = context_matchers(name)
+    build_command = command_template(globals.config_data['repos'][name])
+
+    # blob ids from the tree are already content hashes, no file needs to be read
+    cmd = f"git -C {repo_dir} ls-tree -r --full-tree {commit_hash or 'HEAD'}"
+    output = await check_output(cmd)
+
+    digest = hashlib.sha256(build_command.encode())
+    for line in sorted((output or '').splitlines()):
+        meta, _, path = line.partition('\t')
+        if path and in_build_context(path, ignore_patterns, include_patterns):
+            digest.update(f"{path}\0{meta}\n".encode())
+
+    return digest.hexdigest()
+
+
+async def changed_paths(name, old_hash, new_hash):
+    repo_dir = os.path.join(globals.REPO_DATA_PATH, name)
+    cmd = f"git -C {repo_dir} diff --name-only {old_hash} {new_hash}"
+
+    try:
+        output = await check_output(cmd)
+    except subprocess.CalledProcessError:
+        # e.g. the old commit is not in a shallow clone
+        return None
+
+    return (output or '').splitlines()
+
+
+async def check_build_context(name, new_hash):
+    """Returns the build context fingerprint of new_hash and whether the last built image already matches it."""
+    repo_data = globals.repo_data[name]
+    last = repo_data.get('build_context')
+    build_command = command_template(globals.config_data['repos'][name])
+
+    if last and last.get('version') in repo_data['version_history'] and last.get('build_command') == build_command:
+        changed = await changed_paths(name, last['hash'], new_hash)
+
+        if changed is not None:
+            repo_dir, ignore_patterns, include_patterns = context_matchers(name)
+            relevant = [path for path in changed if in_build_context(path, ignore_patterns, include_patterns)]
+
+            if not relevant:
+                log(f"None of the {len(changed)} changed files are in the build context.", keyword=name)
+                return last['fingerprint'], True
+
+    fingerprint = await compute_fingerprint(name, new_hash)
+    return fingerprint, bool(last) and last.get('fingerprint') == fingerprint and last.get('version') in repo_data['version_history']
+
+
+def record_build_context(name, new_hash, fingerprint, version):
+    globals.repo_data[name]['build_context'] = {
+        'hash': new_hash,
+        'fingerprint': fingerprint,
+        'version': version,
+        'build_command': command_template(globals.config_data['repos'][name]),
+    }
+
+
+def record_build_decision(name, skipped):
+    stats = globals.repo_data[name].setdefault('build_stats', {'built': 0, 'skipped': 0})
+    stats['skipped' if skipped else 'built'] += 1
+
+
+def stats():
+    repos = {
+        name: data.get('build_stats', {'built': 0, 'skipped': 0})
+        for name, data in globals.repo_data.items()
+    }
+    built = sum(repo['built'] for repo in repos.values())
+    skipped = sum(repo['skipped'] for repo in repos.values())
+
+    return {
+        'built': built,
+        'skipped': skipped,
+        'skip_rate': round(skipped / (built + skipped), 3) if built + skipped else None,
+        'repos': repos,
+    }
@@ -0,0 +1,99 @@
+import os
+import re
+import json
+import base64
+from datetime import datetime
+
+import globals
+
+
+def command_template(repo):
+    if repo.get('builder') == 'buildkit':
+        return repo['buildkit_command']
+    return repo['build_command']
+
+
+def cache_args(name):
+    repo = globals.config_data['repos'][name]
+    cache = repo.get('build_cache', 'none')
+
+    if cache == 'local':
+        # local cache export needs a buildx builder with the docker-container driver
+        cache_dir = os.path.join(globals.REPO_DATA_PATH, '.buildkit_cache', name)
+        return f"--cache-from type=local,src={cache_dir} --cache-to type=local,dest={cache_dir},mode=max"
+
+    if cache == 'registry':
+        ref = repo.get('build_cache_ref', '').format(name=name)
+        return f"--cache-from type=registry,ref={ref} --cache-to type=registry,ref={ref},mode=max"
+
+    return ''
+
+
+def builder_args():
+    return f"--builder {globals.BUILDX_BUILDER}" if globals.BUILDX_BUILDER else ''
+
+
+def parse_timestamp(value):
+    if not value:
+        return None
+
+    # RFC 3339 with nanoseconds, python only takes microseconds
+    value = re.sub(r'(\.\d{6})\d+', r'\1', value).replace('Z', '+00:00')
+    return datetime.fromisoformat(value)
+
+
+class BuildKitProgress:
+    """Turns `--progress=rawjson` output into log lines and per-step timings."""
+
+    def __init__(self, log_line):
+        self.log_line = log_line
+        self.vertexes = {}
+
+    def feed(self, line):
+        try:
+            status = json.loads(line)
+        except ValueError:
+            self.log_line(line)
+            return
+
+        for vertex in status.get('vertexes') or []:
+            step = self.vertexes.setdefault(vertex['digest'], {'name': vertex.get('name', '')})
+            already_completed = step.get('completed')
+
+            for key in ('started', 'completed', 'cached', 'error'):
+                if vertex.get(key):
+                    step[key] = vertex[key]
+
+            if step.get('completed') and not already_completed:
+                seconds = self.duration(step)
+                state = 'CACHED' if step.get('cached') else f"{seconds:.1f}s" if seconds is not None else 'done'
+                self.log_line(f"{step['name']} {state}")
+
+            if step.get('error'):
+                self.log_line(f"{step['name']} ERROR: {step['error']}")
+
+        for entry in status.get('logs') or []:
+            data = base64.b64decode(entry.get('data', '')).decode(errors='replace')
+            for log_line in data.splitlines():
+                self.log_line(log_line)
+
+    def duration(self, step):
+        started = parse_timestamp(step.get('started'))
+        completed = parse_timestamp(step.get('completed'))
+
+        if started and completed:
+            return (completed - started).total_seconds()
+        return None
+
+    def steps(self):
+        steps = sorted(self.vertexes.values(), key=lambda step: step.get('started') or '')
+
+        return [
+            {
+                'name': step['name'],
+                'seconds': round(self.duration(step), 3) if self.duration(step) is not None else None,
+                'cached': bool(step.get('cached')),
+                'error': step.get('error'),
+            }
+            for step in steps
+        ]
@@ -0,0 +1,109 @@
+import asyncio
+
+import globals
+
+from functions import repo_check, cancel_superseded_build
+import scheduling
+
+
+class RepoCheckQueue:
+    """Coalesces check requests for one repo into at most one running and one follow-up run."""
+
+    def __init__(self, name):
+        self.name = name
+        self.task = None
+        self.cancel_tasks = set()  # superseded build checks, referenced until done
+        self.running = False
+        self.pending = False
+        self.ignore_hash_checks = False
+        self.sources = set()
+
+        self.requests = 0
+        self.runs = 0
+        self.coalesced = 0
+
+    def stats(self):
+        return {
+            'running': self.running,
+            'pending': self.pending,
+            'requests': self.requests,
+            'runs': self.runs,
+            'coalesced': self.coalesced,
+        }
+
+
+queues = {}
+
+
+def request_check(name, source='webhook', ignore_hash_checks=False):
+    queue = queues.get(name)
+    if queue is None:
+        queue = queues[name] = RepoCheckQueue(name)
+
+    queue.requests += 1
+
+    if source == 'webhook':
+        scheduling.record_webhook(name)
+
+        # a push while building makes the running build pointless if the remote moved past it
+        if queue.running:
+            task = asyncio.create_task(cancel_superseded_build(name))
+            queue.cancel_tasks.add(task)
+            task.add_done_callback(queue.cancel_tasks.discard)
+
+    # a poll adds nothing to a run that is already going to look at the remote
+    if source == 'scheduler' and (queue.running or queue.pending):
+        queue.coalesced += 1
+        return False
+
+    if queue.pending:
+        queue.coalesced += 1
+
+    queue.pending = True
+    queue.ignore_hash_checks |= ignore_hash_checks
+    queue.sources.add(source)
+
+    if queue.task is None or queue.task.done():
+        queue.task = asyncio.create_task(run_queue(queue))
+
+    return True
+
+
+async def run_queue(queue):
+    while queue.pending:
+        # requests arriving within the window are merged into this run
+        await asyncio.sleep(globals.CHECK_DEBOUNCE_SECONDS)
+
+        ignore_hash_checks = queue.ignore_hash_checks
+        refresh_hash = queue.sources != {'scheduler'}
+        sources = ', '.join(sorted(queue.sources))
+
+        queue.pending = False
+        queue.ignore_hash_checks = False
+        queue.sources = set()
+        queue.running = True
+        queue.runs += 1
+
+        globals.log(f"Check requested by {sources}.", keyword=queue.name)
+
+        # global cap on checks per second
+        await scheduling.check_rate.acquire()
+
+        old_hash = globals.repo_data.get(queue.name, {}).get('stages', {}).get('update')
+
+        try:
+            await repo_check(queue.name, ignore_hash_checks, refresh_hash)
+            scheduling.record_check(queue.name, changed=globals.repo_data[queue.name]['stages']['update'] != old_hash)
+        except Exception:
+            # already logged by repo_check
+            pass
+        finally:
+            queue.running = False
+
+
+async def scheduled_repo_check(name):
+    request_check(name, source='scheduler')
+
+
+def stats():
+    return {name: queue.stats() for name, queue in queues.items()}
@@ -1,15 +1,17 @@
+import os
+import asyncio
 from copy import deepcopy
 
 import globals
 
-from functions import repo_check
+from check_queue import scheduled_repo_check
+from git_functions import FETCH_STRATEGY_FLAGS
+from state_store import state_store
+from history_db import history
+import bluegreen
 
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from apscheduler.triggers.interval import IntervalTrigger
-from datetime import datetime
-
-
-scheduler = AsyncIOScheduler()
+import scheduling
+from scheduling import scheduler, job_id
 
 CONFIG_FILE_STRUCT = {
         'repos': {},
@@ -19,18 +21,49 @@ CONFIG_FILE_REPO_STRUCT = {
         'repo_url': '',
         'branch': 'main',
         'interval': 0,
+        'fetch_strategy': 'full',
+        'reference_cache': False,
+        'update_mode': 'pull',
         'version_tag_scheme': '{name}:v{build_number}',
+        'keep_versions': 10,
         'build_command': 'docker build -t {version_tag_scheme} -t {name}:latest /repo_data/{name}',
+        'build_context_globs': [],
+        'builder': 'legacy',
+        'buildkit_command': 'docker buildx build {builder_args} --progress=rawjson --load {cache_args} -t {version_tag_scheme} -t {name}:latest /repo_data/{name}',
+        'build_cache': 'none',
+        'build_cache_ref': 'localhost:5000/{name}:buildcache',
         'deploy_command': 'docker rm -f {name} || true && docker run --name {name} -p {port}:8080 -d {version_tag_scheme}',
+        'deploy_strategy': 'recreate',
+        'blue_green_command': 'docker run --name {container} -p {port}:8080 -d {version_tag_scheme}',
+        'blue_green_ports': [],
+        'blue_green_standby': True,
         'healthcheck': {
+                'type': 'auto',
                 'command': 'curl -f {host_address}:{port} || exit 1',
+                'path': '/',
                 'timeout': 30,
                 'retries': 3,
-                'retry_delay': 5
+                'retry_delay': 5,
+                'success_threshold': 1,
+                'deadline': 60
+            },
+        'stage_timeouts': {
+                'update': 900,
+                'build': 3600,
+                'deploy': 600,
+                'healthcheck': 600
             },
         'port': 8080,
+        'monitor_interval': 30,
+        'monitor_failure_threshold': 3,
+        'monitor_remediation': 'none',
     }
 
+def validate_repo(name, repo):
+    if repo['fetch_strategy'] not in FETCH_STRATEGY_FLAGS:
+        raise ValueError(f"repo {name}: unknown fetch_strategy '{repo['fetch_strategy']}', expected one of {', '.join(FETCH_STRATEGY_FLAGS)}")
+
+
 def load_config_file(file_path):
     file = globals.read_yaml_file(file_path)
 
@@ -40,7 +73,11 @@ def load_config_file(file_path):
     file = CONFIG_FILE_STRUCT | file
 
     for name, repo in file['repos'].items():
-        file['repos'][name] = CONFIG_FILE_REPO_STRUCT | repo
+        # copies, the defaults must not be shared with (and mutated through) a repo
+        file['repos'][name] = deepcopy(CONFIG_FILE_REPO_STRUCT) | repo
+        file['repos'][name]['healthcheck'] = deepcopy(CONFIG_FILE_REPO_STRUCT['healthcheck']) | repo.get('healthcheck', {})
+        file['repos'][name]['stage_timeouts'] = deepcopy(CONFIG_FILE_REPO_STRUCT['stage_timeouts']) | repo.get('stage_timeouts', {})
+        validate_repo(name, file['repos'][name])
 
     return file
 
@@ -50,14 +87,71 @@ def write_and_reload_config_file():
     configuration()
 
 
+def schedule_repo(name, repo, first_run=None):
+    scheduler.add_job(
+        scheduled_repo_check,
+        args=[name],
+        trigger=scheduling.trigger(name, repo),
+        id=job_id(name),
+        replace_existing=True,
+        max_instances=1,
+        next_run_time=first_run
+    )
+
+    print(f"CONFIGURATION: scheduler task configured for {name}, interval {repo['interval']} seconds")
+
+
+def reconcile(old_repos, new_repos):
+    """Touches only the scheduler jobs of repos that were added, removed or got a new interval."""
+    added = [name for name in new_repos if name not in old_repos]
+    removed = [name for name in old_repos if name not in new_repos]
+    changed = [name for name in new_repos if name in old_repos and new_repos[name] != old_repos[name]]
+
+    for name in removed:
+        scheduling.reset(name)
+        if scheduler.get_job(job_id(name)):
+            scheduler.remove_job(job_id(name))
+
+    for name in added + changed:
+        repo = new_repos[name]
+        job = scheduler.get_job(job_id(name))
+
+        if repo['interval'] <= 0:
+            if job:
+                scheduler.remove_job(job_id(name))
+        elif job is None:
+            schedule_repo(name, repo, first_run=scheduling.first_run_time(repo))
+        elif name not in old_repos or old_repos[name]['interval'] != repo['interval']:
+            # keeps the job, the next run is one new interval from now
+            scheduling.reset(name)
+            scheduler.reschedule_job(job_id(name), trigger=scheduling.trigger(name, repo))
+            print(f"CONFIGURATION: scheduler task rescheduled for {name}, interval {repo['interval']} seconds")
+
+    return added, removed, changed
+
+
+applied_repos = {}
+config_file_stat = None
+
+
+def file_stat(file_path):
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+
+    return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+
 def configuration():
-    globals.repo_data = globals.read_json_file(globals.REPO_DATA_FILE_PATH)
-    if not globals.repo_data:
-        globals.repo_data = {}
+    global applied_repos, config_file_stat
 
-    globals.config_data = load_config_file(globals.CONFIG_FILE_PATH)
+    # in memory state is newer than the files once loaded
+    if not state_store.loaded:
+        globals.repo_data = state_store.load()
 
-    scheduler.remove_all_jobs()
+    config_file_stat = file_stat(globals.CONFIG_FILE_PATH)
+    globals.config_data = load_config_file(globals.CONFIG_FILE_PATH)
     
     for name, repo in globals.config_data['repos'].items():
         if name not in globals.repo_data:
@@ -70,20 +164,42 @@ def configuration():
                 'build_number': 0,
                 'version_history': []
             }
-        
-        if repo['interval'] > 0:
-            scheduler.add_job(
-                repo_check,
-                args=[name, False],
-                trigger=IntervalTrigger(seconds=repo['interval']),
-                id=f"repo_check_periodic_task_{name}",
-                replace_existing=True,
-                max_instances=1,
-                next_run_time=datetime.now()
-            )
-
-            print(f"CONFIGURATION: scheduler task configured for {name}, interval {repo['interval']} seconds")
-
-    globals.write_json_file(globals.REPO_DATA_FILE_PATH, globals.repo_data)
-    
-    print("CONFIGURATION: loaded")
\ No newline at end of file
+            state_store.save(name)
+
+        if applied_repos.get(name) != repo:
+            history.record_repo(name, repo['repo_url'], repo['branch'])
+
+    # compared with a copy, the dashboard edits globals.config_data in place before reloading
+    added, removed, changed = reconcile(applied_repos, globals.config_data['repos'])
+    applied_repos = deepcopy(globals.config_data['repos'])
+
+    print(f"CONFIGURATION: loaded, {len(added)} added, {len(removed)} removed, {len(changed)} changed")
+
+
+async def watch_config_file():
+    global config_file_stat
+
+    # hot reload on edits of the config file, by polling its mtime
+    while True:
+        await asyncio.sleep(globals.CONFIG_WATCH_INTERVAL)
+
+        stat = file_stat(globals.CONFIG_FILE_PATH)
+        if stat is None or stat == config_file_stat:
+            continue
+
+        if not globals.read_yaml_file(globals.CONFIG_FILE_PATH):
+            # mid-write or invalid, keep the running configuration
+            print("CONFIGURATION: config file changed but could not be read, keeping the current configuration")
+            config_file_stat = stat
+            continue
+
+        print("CONFIGURATION: config file changed, reloading")
+        running_config = globals.config_data
+        try:
+            configuration()
+            await bluegreen.sync_proxies()
+        except Exception as e:
+            # e.g. `repos:` left empty, the watcher keeps running with the previous configuration
+            print(f"CONFIGURATION: reloading failed, keeping the current configuration - {e}")
+            globals.config_data = running_config
+            config_file_stat = stat
@@ -0,0 +1,395 @@
+import os
+import re
+import stat
+import json
+import asyncio
+from datetime import datetime, timezone
+from urllib.parse import quote, urlencode
+
+import globals
+
+
+class DockerConnectionError(Exception):
+    pass
+
+
+class DockerAPIError(Exception):
+    def __init__(self, status, message):
+        super().__init__(f"Docker API error {status}: {message}")
+        self.status = status
+        self.message = message
+
+
+class DockerAPIClient:
+    """HTTP/1.1 client for the Docker Engine API over a pool of keep-alive unix socket connections."""
+
+    def __init__(self, socket_path, pool_size=8):
+        self.socket_path = socket_path
+        self.pool_size = pool_size
+
+        self._loop = None
+        self._idle = []
+        self._slots = None
+
+    def available(self):
+        try:
+            return stat.S_ISSOCK(os.stat(self.socket_path).st_mode)
+        except OSError:
+            return False
+
+    def _bind_loop(self):
+        # connections and the semaphore belong to the loop that created them
+        loop = asyncio.get_running_loop()
+
+        if loop is not self._loop:
+            self._loop = loop
+            self._idle = []
+            self._slots = asyncio.Semaphore(self.pool_size)
+
+    async def _connect(self):
+        try:
+            return await asyncio.open_unix_connection(self.socket_path, limit=2 ** 20)
+        except OSError as e:
+            raise DockerConnectionError(f"cannot connect to {self.socket_path}: {e}") from e
+
+    def _close(self, connection):
+        reader, writer = connection
+        writer.close()
+
+    async def close(self):
+        idle, self._idle = self._idle, []
+
+        for reader, writer in idle:
+            writer.close()
+            await writer.wait_closed()
+
+    async def request(self, method, path, params=None, body=None):
+        self._bind_loop()
+
+        async with self._slots:
+            reused = bool(self._idle)
+            connection = self._idle.pop() if reused else await self._connect()
+
+            try:
+                status, headers, data = await self._roundtrip(connection, method, path, params, body)
+            except (asyncio.IncompleteReadError, ConnectionError) as e:
+                self._close(connection)
+
+                if not reused:
+                    raise DockerConnectionError(f"{method} {path}: {e}") from e
+
+                # the daemon closed an idle connection, retry once on a fresh one
+                connection = await self._connect()
+                try:
+                    status, headers, data = await self._roundtrip(connection, method, path, params, body)
+                except (asyncio.IncompleteReadError, ConnectionError) as e:
+                    self._close(connection)
+                    raise DockerConnectionError(f"{method} {path}: {e}") from e
+            except BaseException:
+                self._close(connection)
+                raise
+
+            if headers.get('connection', '').lower() == 'close':
+                self._close(connection)
+            else:
+                self._idle.append(connection)
+
+        if status >= 400:
+            raise DockerAPIError(status, _error_message(data))
+
+        return status, headers, data
+
+    async def get_json(self, path, params=None):
+        status, headers, data = await self.request('GET', path, params)
+        return json.loads(data) if data else None
+
+    async def stream(self, method, path, params=None):
+        # long-lived responses (events, followed logs) get a dedicated connection
+        reader, writer = await self._connect()
+
+        try:
+            await self._send(writer, method, path, params, None)
+            status, headers = await read_response_head(reader)
+
+            if status >= 400:
+                data = await read_response_body(reader, method, status, headers)
+                raise DockerAPIError(status, _error_message(data))
+
+            if headers.get('transfer-encoding', '').lower() == 'chunked':
+                while True:
+                    size = int((await reader.readuntil(b"\r\n")).split(b';')[0], 16)
+                    if size == 0:
+                        break
+                    yield await reader.readexactly(size)
+                    await reader.readexactly(2)
+            else:
+                while chunk := await reader.read(65536):
+                    yield chunk
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            raise DockerConnectionError(f"{method} {path}: {e}") from e
+        finally:
+            writer.close()
+
+    async def _send(self, writer, method, path, params, body):
+        if params:
+            path = f"{path}?{urlencode(params)}"
+
+        payload = json.dumps(body).encode() if body is not None else b''
+        head = (
+            f"{method} {path} HTTP/1.1\r\n"
+            "Host: docker\r\n"
+            f"Content-Length: {len(payload)}\r\n"
+        )
+        if body is not None:
+            head += "Content-Type: application/json\r\n"
+
+        writer.write(head.encode() + b"\r\n" + payload)
+        await writer.drain()
+
+    async def _roundtrip(self, connection, method, path, params, body):
+        reader, writer = connection
+
+        await self._send(writer, method, path, params, body)
+        status, headers = await read_response_head(reader)
+        data = await read_response_body(reader, method, status, headers)
+
+        return status, headers, data
+
+
+async def read_response_head(reader):
+    status_line = await reader.readuntil(b"\r\n")
+    status = int(status_line.split()[1])
+
+    headers = {}
+    while True:
+        line = await reader.readuntil(b"\r\n")
+        if line == b"\r\n":
+            break
+        key, _, value = line.decode('latin-1').partition(':')
+        headers[key.strip().lower()] = value.strip()
+
+    return status, headers
+
+
+async def read_response_body(reader, method, status, headers):
+    if method == 'HEAD' or status in (204, 304) or 100 <= status < 200:
+        return b''
+
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        chunks = []
+        while True:
+            size = int((await reader.readuntil(b"\r\n")).split(b';')[0], 16)
+            if size == 0:
+                await reader.readuntil(b"\r\n")
+                break
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+        return b''.join(chunks)
+
+    if 'content-length' in headers:
+        return await reader.readexactly(int(headers['content-length']))
+
+    headers['connection'] = 'close'
+    return await reader.read()
+
+
+def _error_message(data):
+    try:
+        return json.loads(data)['message']
+    except Exception:
+        return data.decode(errors='replace').strip()
+
+
+client = DockerAPIClient(globals.DOCKER_SOCKET_PATH, globals.DOCKER_API_POOL_SIZE)
+
+##  conversion to the docker CLI output format used by docker_functions
+
+def format_timestamp(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y-%m-%d %H:%M:%S +0000 UTC")
+
+
+def human_size(size):
+    for unit in ['B', 'kB', 'MB', 'GB', 'TB']:
+        if size < 1000:
+            break
+        size /= 1000
+    return f"{size:.4g}{unit}"
+
+
+def parse_size(value):
+    # "1.2GB", "512kB", "0B" as printed by the docker CLI
+    match = re.match(r'\s*([\d.]+)\s*([kKMGT]?i?B)?', str(value))
+    if not match:
+        return 0
+
+    number, unit = match.groups()
+    units = {'B': 1, 'KB': 1000, 'MB': 1000 ** 2, 'GB': 1000 ** 3, 'TB': 1000 ** 4,
+             'KIB': 1024, 'MIB': 1024 ** 2, 'GIB': 1024 ** 3, 'TIB': 1024 ** 4}
+
+    return int(float(number) * units.get((unit or 'B').upper(), 1))
+
+
+def format_ports(ports):
+    output = []
+
+    for port in ports or []:
+        if port.get('PublicPort'):
+            output.append(f"{port.get('IP', '')}:{port['PublicPort']}->{port['PrivatePort']}/{port['Type']}")
+        else:
+            output.append(f"{port['PrivatePort']}/{port['Type']}")
+
+    return output
+
+
+def demultiplex(data):
+    # non-tty log streams are framed as [stream, 0, 0, 0, size(4 bytes)] + payload
+    if len(data) < 8 or data[0] not in (0, 1, 2) or data[1:4] != b'\x00\x00\x00':
+        return data
+
+    output = []
+    position = 0
+    while position + 8 <= len(data):
+        size = int.from_bytes(data[position + 4:position + 8], 'big')
+        output.append(data[position + 8:position + 8 + size])
+        position += 8 + size
+
+    return b''.join(output)
+
+##  endpoints
+
+def _quote(value):
+    return quote(str(value), safe='')
+
+
+async def container_inspect(name):
+    return await client.get_json(f"/containers/{_quote(name)}/json")
+
+
+async def container_names(names):
+    filters = json.dumps({'name': [re.escape(name) for name in names]})
+    containers = await client.get_json("/containers/json", {'all': 1, 'filters': filters})
+
+    # the name filter is a regex search, keep exact matches only
+    found = {name.lstrip('/') for container in containers for name in container.get('Names') or []}
+    return [name for name in names if name in found]
+
+
+async def container_list():
+    containers = await client.get_json("/containers/json", {'all': 1})
+    output = []
+
+    for container in containers:
+        output.append({
+            'Id': container['Id'],
+            'Names': ','.join(name.lstrip('/') for name in container.get('Names') or []),
+            'State': container['State'],
+            'CreatedAt': format_timestamp(container['Created']),
+            'Ports': format_ports(container.get('Ports')),
+            'Image': container['Image'],
+        })
+
+    return output
+
+
+async def container_logs(container_id, num_of_lines=100):
+    status, headers, data = await client.request(
+        'GET',
+        f"/containers/{_quote(container_id)}/logs",
+        {'stdout': 1, 'stderr': 1, 'tail': num_of_lines}
+    )
+
+    return demultiplex(data).decode(errors='replace') or None
+
+
+async def container_logs_follow(container_id, num_of_lines=100):
+    container = await container_inspect(container_id)
+    tty = container.get('Config', {}).get('Tty', False)
+
+    buffer = b''
+    async for chunk in client.stream(
+        'GET',
+        f"/containers/{_quote(container_id)}/logs",
+        {'stdout': 1, 'stderr': 1, 'follow': 1, 'tail': num_of_lines}
+    ):
+        if tty:
+            yield chunk
+            continue
+
+        # frames may be split across chunks
+        buffer += chunk
+        while len(buffer) >= 8:
+            size = int.from_bytes(buffer[4:8], 'big')
+            if len(buffer) < 8 + size:
+                break
+            yield buffer[8:8 + size]
+            buffer = buffer[8 + size:]
+
+
+async def container_action(action, container_id):
+    if action == 'rm':
+        await client.request('DELETE', f"/containers/{_quote(container_id)}")
+    else:
+        await client.request('POST', f"/containers/{_quote(container_id)}/{action}")
+
+
+async def image_list():
+    images = await client.get_json("/images/json")
+    output = []
+
+    for image in images:
+        for repo_tag in image.get('RepoTags') or ['<none>:<none>']:
+            repository, _, tag = repo_tag.rpartition(':')
+
+            output.append({
+                'Id': image['Id'],
+                'Repository': repository,
+                'Tag': tag,
+                'CreatedAt': format_timestamp(image['Created']),
+                'Size': human_size(image['Size']),
+            })
+
+    return output
+
+
+async def events(since=None, filters=None):
+    params = {}
+    if since:
+        params['since'] = since
+    if filters:
+        params['filters'] = json.dumps(filters)
+
+    buffer = b''
+    async for chunk in client.stream('GET', "/events", params):
+        buffer += chunk
+        *lines, buffer = buffer.split(b'\n')
+
+        for line in lines:
+            if line.strip():
+                yield json.loads(line)
+
+
+async def disk_usage():
+    df = await client.get_json("/system/df")
+
+    return {
+        'images': df.get('LayersSize', 0),
+        'build_cache': sum(entry.get('Size', 0) for entry in df.get('BuildCache') or []),
+    }
+
+
+async def image_prune():
+    status, headers, data = await client.request('POST', "/images/prune", {'filters': json.dumps({'dangling': ['true']})})
+    return json.loads(data).get('SpaceReclaimed', 0)
+
+
+async def build_prune(keep_storage=None):
+    params = {'keep-storage': keep_storage} if keep_storage else None
+    status, headers, data = await client.request('POST', "/build/prune", params)
+    return json.loads(data).get('SpaceReclaimed', 0)
+
+
+async def image_action(action, image_id):
+    if action == 'rm':
+        await client.request('DELETE', f"/images/{_quote(image_id)}")
+    else:
+        raise DockerAPIError(400, f"unsupported image action {action}")
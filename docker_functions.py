@@ -1,19 +1,72 @@
+import re
 import json
+import shlex
 import asyncio
 
-from subprocess_functions import run_command, check_output, poll_output
+import globals
+import docker_api
+import metrics
+from docker_api import DockerAPIError, DockerConnectionError
+from state_cache import state_cache
 
+from subprocess_functions import run_command, check_output, read_output, poll_output, stream_lines
+
+
+def use_api():
+    if globals.DOCKER_BACKEND == 'cli':
+        return False
+
+    return globals.DOCKER_BACKEND == 'api' or docker_api.client.available()
+
+
+def api_fallback(e):
+    print(f"DOCKER: Engine API unavailable, falling back to CLI - {e}")
+
+##  cached state
+
+def invalidate_container_state():
+    # actions may be addressed by id or by name, drop every container entry
+    state_cache.invalidate_kind('container')
+    state_cache.invalidate(('containers',))
+
+
+def invalidate_image_state():
+    state_cache.invalidate(('images',))
+
+##
 
 async def docker_container_action(action, container_id):
-    cmd = f"docker {action} {container_id}"
-    await asyncio.to_thread(run_command, cmd)
+    try:
+        if use_api():
+            try:
+                return await docker_api.container_action(action, container_id)
+            except DockerConnectionError as e:
+                api_fallback(e)
+
+        cmd = f"docker {action} {container_id}"
+        await run_command(cmd)
+    finally:
+        invalidate_container_state()
         
 
 async def docker_container_inspect(name):
+    return await state_cache.get_or_fetch(('container', name), lambda: _fetch_container_inspect(name))
+
+
+async def _fetch_container_inspect(name):
+    if use_api():
+        try:
+            inspect_output = [await docker_api.container_inspect(name)]
+            return json.dumps(inspect_output, indent=4), inspect_output
+        except DockerAPIError:
+            return None, None
+        except DockerConnectionError as e:
+            api_fallback(e)
+
     cmd = f"docker inspect --type=container {name}"
 
     try:
-        raw_output = await asyncio.to_thread(check_output, cmd)
+        raw_output = await check_output(cmd)
         inspect_output = json.loads(raw_output)
     except Exception as e:
         raw_output = None
@@ -22,16 +75,170 @@ async def docker_container_inspect(name):
     return raw_output, inspect_output
     
 
+async def docker_container_inspect_many(names, concurrency=None):
+    names = list(names)
+    output = {}
+    missing = []
+
+    for name in names:
+        found, value = state_cache.get(('container', name))
+        state_cache.record(found)
+
+        if found:
+            output[name] = value[1]
+        else:
+            missing.append(name)
+
+    keys = [('container', name) for name in missing]
+    token = state_cache.begin_fetch(keys)
+
+    try:
+        fetched = await _fetch_container_inspect_many(missing, concurrency)
+
+        for name, inspect_output in fetched.items():
+            raw_output = json.dumps(inspect_output, indent=4) if inspect_output else None
+            # a docker event during the fetch invalidated the key, the result may predate it
+            state_cache.finish_fetch(('container', name), (raw_output, inspect_output), token)
+            output[name] = inspect_output
+    finally:
+        state_cache.abandon_fetch(keys, token)
+
+    return {name: output[name] for name in names}
+
+
+async def _fetch_container_inspect_many(names, concurrency=None):
+    output = {name: None for name in names}
+
+    if not names:
+        return output
+
+    if use_api():
+        try:
+            existing = await docker_api.container_names(names)
+
+            async def inspect(name):
+                try:
+                    return name, [await docker_api.container_inspect(name)]
+                except DockerAPIError:
+                    return name, None
+
+            results = await gather_bounded(
+                [inspect(name) for name in existing],
+                concurrency or globals.DOCKER_API_POOL_SIZE
+            )
+            output.update(results)
+
+            return output
+        except DockerConnectionError as e:
+            api_fallback(e)
+
+    # a single `docker inspect` for all names, missing containers are only reported on stderr
+    cmd = f"docker inspect --type=container {' '.join(shlex.quote(name) for name in names)}"
+    raw_output = await read_output(cmd)
+
+    for container in json.loads(raw_output) if raw_output else []:
+        name = container['Name'].lstrip('/')
+        if name in output:
+            output[name] = [container]
+
+    return output
+
+
+async def gather_bounded(coroutines, limit):
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(coroutine):
+        async with semaphore:
+            return await coroutine
+
+    return await asyncio.gather(*[run(coroutine) for coroutine in coroutines])
+
+
+async def docker_events(since=None):
+    filters = {'type': ['container', 'image']}
+
+    if use_api():
+        try:
+            async for event in docker_api.events(since, filters):
+                yield event
+            return
+        except DockerConnectionError as e:
+            api_fallback(e)
+
+    cmd = "docker events --format '{{json .}}' --filter type=container --filter type=image"
+    if since:
+        cmd += f" --since {since}"
+
+    print(f"SUBPROCESS: Streaming output from: {cmd}")
+    # runs for the lifetime of the watcher, so only the spawn is counted
+    metrics.subprocess_spawns.inc(metrics.command_family(cmd))
+    process = await asyncio.create_subprocess_shell(
+        cmd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL
+    )
+
+    try:
+        while line := await process.stdout.readline():
+            yield json.loads(line)
+    finally:
+        if process.returncode is None:
+            process.kill()
+        await process.wait()
+
+
 async def docker_container_get_logs(container_id, num_of_lines=100):
+    if use_api():
+        try:
+            return await docker_api.container_logs(container_id, num_of_lines)
+        except DockerConnectionError as e:
+            api_fallback(e)
+
     cmd = f"docker logs -n {num_of_lines} {container_id}"
-    output = await asyncio.to_thread(check_output, cmd)
+    output = await check_output(cmd)
 
     return output
 
 
+class ChunkReader:
+    # exposes an async iterator of byte chunks through the StreamReader.read interface
+    def __init__(self, chunks):
+        self.chunks = chunks.__aiter__()
+
+    async def read(self, n=-1):
+        try:
+            return await self.chunks.__anext__()
+        except StopAsyncIteration:
+            return b''
+
+
+async def docker_container_follow_logs(container_id, num_of_lines=100, batch_callback=None):
+    if use_api():
+        try:
+            return await stream_lines(
+                ChunkReader(docker_api.container_logs_follow(container_id, num_of_lines)),
+                batch_callback=batch_callback
+            )
+        except DockerConnectionError as e:
+            api_fallback(e)
+
+    cmd = f"docker logs --follow -n {num_of_lines} {container_id}"
+    await poll_output(cmd, batch_callback=batch_callback, check=False)
+
+
 async def docker_container_list():
+    return await state_cache.get_or_fetch(('containers',), _fetch_container_list)
+
+
+async def _fetch_container_list():
+    if use_api():
+        try:
+            return await docker_api.container_list()
+        except DockerConnectionError as e:
+            api_fallback(e)
+
     cmd = 'docker ps -a --no-trunc --format "{{.ID}};{{.Names}};{{.State}};{{.CreatedAt}};{{.Ports}};{{.Image}}"'
-    raw_otput = await asyncio.to_thread(check_output, cmd)
+    raw_otput = await check_output(cmd)
 
     string_list = raw_otput.split('\n')
     output = []
@@ -53,13 +260,34 @@ async def docker_container_list():
 
 
 async def docker_image_action(action, image_id):
-    cmd = f"docker image {action} {image_id}"
-    await asyncio.to_thread(run_command, cmd)
+    try:
+        if use_api():
+            try:
+                return await docker_api.image_action(action, image_id)
+            except DockerConnectionError as e:
+                api_fallback(e)
+
+        cmd = f"docker image {action} {image_id}"
+        await run_command(cmd)
+    finally:
+        invalidate_image_state()
 
 
 async def docker_image_list(repo_filter=None):
+    images = await state_cache.get_or_fetch(('images',), _fetch_image_list)
+
+    return [image for image in images if not repo_filter or repo_filter in image['Repository']]
+
+
+async def _fetch_image_list():
+    if use_api():
+        try:
+            return await docker_api.image_list()
+        except DockerConnectionError as e:
+            api_fallback(e)
+
     cmd = 'docker image ls --no-trunc --format "{{.ID}};{{.Repository}};{{.Tag}};{{.CreatedAt}};{{.Size}}"'
-    raw_otput = await asyncio.to_thread(check_output, cmd)
+    raw_otput = await check_output(cmd)
 
     string_list = raw_otput.split('\n')
     output = []
@@ -68,13 +296,79 @@ async def docker_image_list(repo_filter=None):
         if string:
             values = string.split(';')
 
-            if not repo_filter or repo_filter in values[1]:
-                output.append({
-                    'Id': values[0],
-                    'Repository': values[1],
-                    'Tag': values[2],
-                    'CreatedAt': values[3],
-                    'Size': values[4],
-                })
+            output.append({
+                'Id': values[0],
+                'Repository': values[1],
+                'Tag': values[2],
+                'CreatedAt': values[3],
+                'Size': values[4],
+            })
+
+    return output
+
+async def docker_image_remove_many(refs):
+    """Removes images by tag in one go, images still in use are skipped. Returns the refs that were removed."""
+    refs = list(refs)
+    if not refs:
+        return []
+
+    try:
+        if use_api():
+            try:
+                async def remove(ref):
+                    try:
+                        await docker_api.image_action('rm', ref)
+                        return ref
+                    except DockerAPIError as e:
+                        print(f"DOCKER: could not remove {ref} - {e}")
+                        return None
+
+                removed = await gather_bounded([remove(ref) for ref in refs], globals.DOCKER_API_POOL_SIZE)
+                return [ref for ref in removed if ref]
+            except DockerConnectionError as e:
+                api_fallback(e)
+
+        # a single rm for the batch, failures of single images do not stop the others
+        cmd = "docker image rm " + ' '.join(shlex.quote(ref) for ref in refs)
+        output = await read_output(cmd) or ''
+
+        return [ref for ref in refs if f"Untagged: {ref}" in output]
+    finally:
+        invalidate_image_state()
+
+
+async def docker_disk_usage():
+    if use_api():
+        try:
+            return await docker_api.disk_usage()
+        except DockerConnectionError as e:
+            api_fallback(e)
+
+    output = await read_output("docker system df --format '{{json .}}'") or ''
+    usage = {'images': 0, 'build_cache': 0}
+
+    for line in output.splitlines():
+        row = json.loads(line)
+        if row.get('Type') == 'Images':
+            usage['images'] = docker_api.parse_size(row.get('Size'))
+        elif row.get('Type') == 'Build Cache':
+            usage['build_cache'] = docker_api.parse_size(row.get('Size'))
+
+    return usage
+
+
+async def docker_prune(build_cache_keep=None):
+    """Removes dangling images and unused build cache above `build_cache_keep` bytes."""
+    try:
+        if use_api():
+            try:
+                return await docker_api.image_prune() + await docker_api.build_prune(build_cache_keep)
+            except DockerConnectionError as e:
+                api_fallback(e)
+
+        keep = f" --keep-storage {build_cache_keep}" if build_cache_keep else ''
+        output = await read_output(f"docker image prune -f && docker builder prune -f{keep}") or ''
 
-    return output
\ No newline at end of file
+        return sum(docker_api.parse_size(size) for size in re.findall(r'Total reclaimed space:\s*(\S+)', output))
+    finally:
+        invalidate_image_state()
@@ -0,0 +1,111 @@
+import time
+import asyncio
+
+import globals
+
+from state_cache import state_cache
+from bluegreen import container_name
+from docker_functions import docker_events, docker_container_inspect_many, docker_image_list, invalidate_image_state
+
+
+CONTAINER_ACTIONS = {
+    'create', 'start', 'restart', 'die', 'stop', 'kill', 'oom',
+    'pause', 'unpause', 'rename', 'update', 'destroy', 'health_status'
+}
+IMAGE_ACTIONS = {'tag', 'untag', 'delete', 'pull', 'load', 'import', 'prune'}
+
+status = {
+    'connected': False,
+    'events': 0,
+    'resyncs': 0,
+    'last_event': None,
+    'last_error': None,
+}
+
+_dirty_containers = set()
+_refresh_task = None
+
+
+async def resync():
+    # reload everything the dashboard reads, events since `since` are replayed afterwards
+    state_cache.clear()
+
+    await docker_container_inspect_many(container_name(name) for name in globals.config_data.get('repos', {}))
+    await docker_image_list()
+
+    status['resyncs'] += 1
+
+
+async def refresh_containers():
+    # containers marked dirty during a refresh are picked up by the next round, not left stale
+    while _dirty_containers:
+        await asyncio.sleep(globals.DOCKER_EVENTS_BATCH_DELAY)
+
+        names = list(_dirty_containers)
+        _dirty_containers.clear()
+
+        await docker_container_inspect_many(names)
+
+
+def schedule_refresh(name):
+    global _refresh_task
+
+    _dirty_containers.add(name)
+
+    if _refresh_task is None or _refresh_task.done():
+        _refresh_task = asyncio.create_task(refresh_containers())
+
+
+def handle_event(event):
+    event_type = event.get('Type')
+    action = event.get('Action', event.get('status', '')).split(':')[0]
+    actor = event.get('Actor', {})
+
+    status['events'] += 1
+    status['last_event'] = event.get('time')
+
+    if event_type == 'container' and action in CONTAINER_ACTIONS:
+        name = actor.get('Attributes', {}).get('name')
+
+        state_cache.invalidate(('container', actor.get('ID')), ('container', name), ('containers',))
+
+        if action == 'destroy':
+            state_cache.set(('container', name), (None, None))
+        elif name in {container_name(repo) for repo in globals.config_data.get('repos', {})}:
+            # managed containers are refreshed eagerly, in batches
+            schedule_refresh(name)
+
+    elif event_type == 'image' and action in IMAGE_ACTIONS:
+        invalidate_image_state()
+
+
+async def watch_docker_events():
+    retry_delay = 1
+
+    while True:
+        since = int(time.time())
+
+        try:
+            state_cache.set_live(True)
+            await resync()
+            status['connected'] = True
+            print("DOCKER EVENTS: connected")
+
+            async for event in docker_events(since):
+                handle_event(event)
+                retry_delay = 1
+
+            status['last_error'] = 'event stream closed'
+
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            status['last_error'] = str(e)
+
+        finally:
+            status['connected'] = False
+            state_cache.set_live(False)
+
+        print(f"DOCKER EVENTS: disconnected ({status['last_error']}), reconnecting in {retry_delay} seconds")
+        await asyncio.sleep(retry_delay)
+        retry_delay = min(retry_delay * 2, 60)
@@ -1,11 +1,22 @@
+import time
 import asyncio
 import subprocess
+from datetime import datetime
 
 import globals
 from globals import log
 
-from subprocess_functions import run_command, check_output, poll_output
-from git_functions import get_remote_hash, git_clone, git_pull
+from subprocess_functions import run_command, check_output, poll_output, track_usage
+from git_functions import git_clone, git_pull
+from docker_functions import invalidate_container_state, invalidate_image_state
+from pipeline import stage, build_stage, stage_timeout, repo_lock
+from hash_discovery import remote_hashes
+from build_cache import check_build_context, record_build_context, record_build_decision
+import buildkit
+import bluegreen
+import health
+from state_store import state_store
+from history_db import history, timed_stage
 
 #   repo build, deploy, health
 
@@ -13,7 +24,8 @@ async def repo_build(name, new_hash=None):
     repo = globals.config_data['repos'][name]
     repo_data = globals.repo_data[name]
 
-    build_command_template = repo['build_command']
+    builder = repo.get('builder', 'legacy')
+    build_command_template = buildkit.command_template(repo)
     version_tag_scheme = repo['version_tag_scheme']
 
     version = version_tag_scheme.format(
@@ -22,7 +34,9 @@ async def repo_build(name, new_hash=None):
         )
     build_command = build_command_template.format(
         version_tag_scheme = version, 
-        name = name
+        name = name,
+        builder_args = buildkit.builder_args(),
+        cache_args = buildkit.cache_args(name)
         )
     
     log(f"Executing build command: {build_command}", keyword=name)
@@ -30,17 +44,45 @@ async def repo_build(name, new_hash=None):
     def log_callback(line):
         log(line, keyword=name, print_message=False)
 
-    await poll_output(build_command, callback=log_callback)
+    progress = None
+    if builder == 'buildkit':
+        progress = buildkit.BuildKitProgress(log_callback)
+        log_callback = progress.feed
+
+    started_at = datetime.now()
+    started = time.monotonic()
+
+    try:
+        with track_usage() as usage:
+            await poll_output(build_command, callback=log_callback)
+    except (Exception, asyncio.CancelledError) as e:
+        status = 'cancelled' if isinstance(e, asyncio.CancelledError) else 'failed'
+        history.record_build(name, version, new_hash, builder, status, round(time.monotonic() - started, 3), progress.steps() if progress else [])
+        raise
+    finally:
+        invalidate_image_state()
 
     if new_hash:
         repo_data['stages']['build'] = new_hash
 
+    repo_data.setdefault('builds', {})[version] = {
+        'hash': new_hash,
+        'builder': builder,
+        'started': started_at.isoformat(timespec='seconds'),
+        'seconds': round(time.monotonic() - started, 3),
+        'steps': progress.steps() if progress else [],
+        'resources': {'build': usage.to_json()},
+    }
+
+    build = repo_data['builds'][version]
+    history.record_build(name, version, new_hash, builder, 'ok', build['seconds'], build['steps'])
+
     repo_data['version_history'].append(version)
     repo_data['build_number'] += 1
-    globals.write_json_file(globals.REPO_DATA_FILE_PATH, globals.repo_data)
+    state_store.save(name)
 
 
-async def repo_deploy(name, deploy_version=None, new_hash=None):
+async def repo_deploy(name, deploy_version=None, new_hash=None, kind='deploy'):
     repo = globals.config_data['repos'][name]
     repo_data = globals.repo_data[name]
 
@@ -48,130 +90,247 @@ async def repo_deploy(name, deploy_version=None, new_hash=None):
     version_tag_scheme = repo['version_tag_scheme']
     port = repo['port']
 
-    version = deploy_version if deploy_version else version_tag_scheme.format(
-        name=name,
-        build_number=repo_data['build_number']
-    )
-    deploy_command = deploy_command_template.format(
-        version_tag_scheme=version,
-        name=name,
-        port=port,
-        host_address=globals.config_data['host_address']
-    )
+    if deploy_version:
+        version = deploy_version
+    elif repo_data['version_history']:
+        # the most recently built image
+        version = repo_data['version_history'][-1]
+    else:
+        version = version_tag_scheme.format(
+            name=name,
+            build_number=repo_data['build_number']
+        )
+
+    strategy = repo.get('deploy_strategy', 'recreate')
+    started = time.monotonic()
 
-    log(f"Executing deploy command: {deploy_command}", keyword=name)
+    try:
+        if bluegreen.enabled(name):
+            await bluegreen.deploy(name, version)
+        else:
+            deploy_command = deploy_command_template.format(
+                version_tag_scheme=version,
+                name=name,
+                port=port,
+                host_address=globals.config_data['host_address']
+            )
 
-    def log_callback(line):
-        log(line, keyword=name, print_message=False)
+            log(f"Executing deploy command: {deploy_command}", keyword=name)
 
-    await poll_output(deploy_command, callback=log_callback)
+            def log_callback(line):
+                log(line, keyword=name, print_message=False)
 
+            try:
+                await poll_output(deploy_command, callback=log_callback)
+            finally:
+                invalidate_container_state()
+    except Exception:
+        history.record_deploy(name, kind, version, new_hash, strategy, 'failed', round(time.monotonic() - started, 3))
+        raise
+
+    history.record_deploy(name, kind, version, new_hash, strategy, 'ok', round(time.monotonic() - started, 3))
+
+    repo_data['deployed_version'] = version
     if new_hash:
         repo_data['stages']['deploy'] = new_hash
-        globals.write_json_file(globals.REPO_DATA_FILE_PATH, globals.repo_data)
+    state_store.save(name)
     
 
 async def repo_healthcheck(name):
-    repo = globals.config_data['repos'][name]
-    
-    port = repo['port']
-    command_template = repo['healthcheck']['command']
-    timeout = repo['healthcheck']['timeout']
-    retries = repo['healthcheck']['retries']
-    retry_delay = repo['healthcheck']['retry_delay']
-    
-    command = command_template.format(
-        port=port,
-        host_address=globals.config_data['host_address']
-    )
+    log(f"Executing {health.probe_type(name)} healthcheck.", keyword=name)
 
-    log(f"Executing healthcheck: {command}", keyword=name)
+    started = time.monotonic()
+    healthy = await health.wait_healthy(name)
 
-    for attempt in range(retries):
-        await asyncio.sleep(retry_delay)
+    history.record_health('deploy', {name: {'ok': healthy, 'latency': round(time.monotonic() - started, 3), 'status': None}})
 
-        try:
-            process = await asyncio.create_subprocess_shell(
-                command,
-                stdout=asyncio.subprocess.DEVNULL,
-                stderr=asyncio.subprocess.DEVNULL
-            )
-            await asyncio.wait_for(process.wait(), timeout=timeout)
-            
-            return process.returncode == 0
-            
-        except (asyncio.TimeoutError, subprocess.CalledProcessError) as e:
-            log(f"Health check attempt {attempt + 1} failed: {e}", keyword=name)
+    if healthy:
+        log(f"Healthy after {time.monotonic() - started:.2f} seconds.", keyword=name)
+
+    return healthy
 
 
 async def repo_rollback(name):
     repo_data = globals.repo_data[name]
 
-    if len(repo_data['version_history']) > 1:
+    if bluegreen.enabled(name) and await bluegreen.standby_running(name):
+        # the previous version is still running next to the failed one
+        failed_version = bluegreen.state(name)['versions'][bluegreen.state(name)['active']]
+        started = time.monotonic()
+        await bluegreen.switch_back(name)
+
+        version = bluegreen.state(name)['versions'][bluegreen.state(name)['active']]
+        repo_data['deployed_version'] = version
+        history.record_deploy(name, 'rollback', version, None, 'blue_green', 'ok', round(time.monotonic() - started, 3))
+
+        if repo_data['version_history'] and repo_data['version_history'][-1] == failed_version:
+            repo_data['version_history'].pop()
+
+        state_store.save(name)
+
+    elif len(repo_data['version_history']) > 1:
         previous_version = repo_data['version_history'][-2]
         
         repo_data['version_history'].pop()
         
         log(f"Rolling back to version: {previous_version}", keyword=name)
-        await repo_deploy(name, previous_version)
+        await repo_deploy(name, previous_version, kind='rollback')
         
-        globals.write_json_file(globals.REPO_DATA_FILE_PATH, globals.repo_data)
+        state_store.save(name)
 
     else:
         log(f"No previous version to rollback to", keyword=name)
 
+def record_resources(name, version, stage_name, usage):
+    # resources of the stages around a build are kept with the build record of the version
+    build = globals.repo_data[name].get('builds', {}).get(version)
+    if build is not None:
+        build.setdefault('resources', {})[stage_name] = usage.to_json()
+
+## superseded builds
+
+running_builds = {}
+
+
+async def run_build(name, new_hash):
+    # the build runs as its own task, so a newer commit can cancel it without cancelling the check
+    build = asyncio.create_task(repo_build(name, new_hash))
+    running_builds[name] = (new_hash, build)
+
+    try:
+        await build
+    except asyncio.CancelledError:
+        if build.cancelled() and not asyncio.current_task().cancelling():
+            raise RuntimeError("Build superseded by a newer commit.")
+        raise
+    finally:
+        running_builds.pop(name, None)
+
+
+async def cancel_superseded_build(name):
+    # the repo may have been removed by a config reload in the meantime
+    repo = globals.config_data['repos'].get(name)
+    if name not in running_builds or repo is None:
+        return False
+
+    try:
+        new_hash = await remote_hashes.get(repo['repo_url'], repo['branch'], max_age=0)
+    except Exception as e:
+        log(f"Could not check whether the running build is superseded: {e}", keyword=name)
+        return False
+
+    building_hash, build = running_builds.get(name, (None, None))
+
+    if build is None or build.done() or new_hash in (None, building_hash):
+        return False
+
+    log(f"New commit {new_hash} supersedes the running build of {building_hash}, cancelling it.", keyword=name)
+    build.cancel()
+    return True
+
 ## check
 
-async def repo_check(name, ignore_hash_checks=False):
+async def repo_check(name, ignore_hash_checks=False, refresh_hash=True):
+    if repo_lock(name).locked():
+        log(f"Waiting for the running task to finish.", keyword=name)
+
+    async with repo_lock(name):
+        try:
+            await run_repo_check(name, ignore_hash_checks, refresh_hash)
+        except Exception as e:
+            log(f"Task failed: {e}", keyword=name)
+            raise
+
+
+async def run_repo_check(name, ignore_hash_checks=False, refresh_hash=True):
     repo = globals.config_data['repos'][name]
     repo_data = globals.repo_data[name]
 
     url = repo['repo_url']
     branch = repo['branch']
-    healthcheck_template = repo['healthcheck']['command']
 
     log(f"Running git check task.", keyword=name)
     
-    new_hash = await get_remote_hash(url, branch)
+    # polls may reuse a hash fetched for another repo on the same remote moments ago
+    async with stage('network'), timed_stage(name, 'discover'):
+        new_hash = await remote_hashes.get(url, branch, max_age=0 if refresh_hash else None)
     log(f"Hash comparison: \n  old: '{repo_data['stages']['update']}'\n  new: '{new_hash}'", keyword=name)
 
     ## update stage (clone or pull)
 
+    update_usage = None
+
     if not ignore_hash_checks and repo_data['stages']['update'] == new_hash:
         log(f"Skipping updating.", keyword=name)
     
     else:
-        if repo_data['stages']['update'] == None:
-            # never cloned, clone entire repo
-            await git_clone(name)
-        else:
-            # otherwise pull changes
-            await git_pull(name)
+        async with stage('network'), timed_stage(name, 'update'), stage_timeout(name, 'update'):
+            with track_usage() as update_usage:
+                if repo_data['stages']['update'] == None:
+                    # never cloned, clone entire repo
+                    await git_clone(name)
+                else:
+                    # otherwise pull changes
+                    await git_pull(name, new_hash)
         
         repo_data['stages']['update'] = new_hash
-        globals.write_json_file(globals.REPO_DATA_FILE_PATH, globals.repo_data)
+        state_store.save(name)
     
     ## build stage
 
     if not ignore_hash_checks and repo_data['stages']['build'] == new_hash:
         log(f"Skipping building.", keyword=name)
     else:
-        await repo_build(name, new_hash)
+        try:
+            fingerprint, unchanged = await check_build_context(name, new_hash)
+        except Exception as e:
+            log(f"Could not fingerprint the build context: {e}", keyword=name)
+            fingerprint, unchanged = None, False
+
+        if unchanged and not ignore_hash_checks:
+            version = repo_data['build_context']['version']
+            log(f"Build context unchanged, reusing {version}.", keyword=name)
+
+            # the reused image is already running if the previous build was deployed
+            if repo_data['stages']['deploy'] == repo_data['stages']['build']:
+                repo_data['stages']['deploy'] = new_hash
+
+            repo_data['stages']['build'] = new_hash
+            repo_data['build_context']['hash'] = new_hash
+            record_build_decision(name, skipped=True)
+            state_store.save(name)
+        else:
+            async with build_stage(name), timed_stage(name, 'build'), stage_timeout(name, 'build'):
+                await run_build(name, new_hash)
+
+            if update_usage is not None:
+                record_resources(name, repo_data['version_history'][-1], 'update', update_usage)
+
+            if fingerprint:
+                record_build_context(name, new_hash, fingerprint, repo_data['version_history'][-1])
+            record_build_decision(name, skipped=False)
+            state_store.save(name)
 
     ## deploy stage
 
     if not ignore_hash_checks and repo_data['stages']['deploy'] == new_hash:
         log(f"Skipping deployment.", keyword=name)
     else:
-        await repo_deploy(name, new_hash)
+        async with stage('deploy'), timed_stage(name, 'deploy'), stage_timeout(name, 'deploy'):
+            with track_usage() as deploy_usage:
+                await repo_deploy(name, new_hash=new_hash)
+
+        record_resources(name, repo_data['deployed_version'], 'deploy', deploy_usage)
+        state_store.save(name)
 
     ## healthcheck
 
-    if healthcheck_template:
-        healthy = await repo_healthcheck(name)
+    if health.enabled(name):
+        async with stage('deploy'), timed_stage(name, 'healthcheck'), stage_timeout(name, 'healthcheck'):
+            healthy = await repo_healthcheck(name)
 
-        if not healthy:
-            log(f"Health check failed", keyword=name)
-            await repo_rollback(name)
+            if not healthy:
+                log(f"Health check failed", keyword=name)
+                await repo_rollback(name)
     ##
     log(f"Task finished.", keyword=name)
\ No newline at end of file
@@ -1,5 +1,9 @@
 import os
+import re
+import time
+import hashlib
 import asyncio
+from datetime import datetime
 
 import globals
 from globals import log
@@ -7,48 +11,163 @@ from globals import log
 from subprocess_functions import run_command, check_output, poll_output
 
 
+FETCH_STRATEGY_FLAGS = {
+    'full': '',
+    'shallow': '--depth 1',
+    'blobless': '--filter=blob:none',
+    'treeless': '--filter=tree:0',
+}
+
+reference_cache_locks = {}
+
+
 async def git_clone(name: str):
     repo_dir = os.path.join(globals.REPO_DATA_PATH, name)
     
     repo = globals.config_data['repos'][name]
     url = repo['repo_url']
     branch = repo['branch']
+    strategy = repo.get('fetch_strategy', 'full')
 
-    log(f"Cloning into repo {url} {branch}", keyword=name)
+    log(f"Cloning into repo {url} {branch} ({strategy})", keyword=name)
 
     if not os.path.exists(os.path.join(repo_dir, ".git")):
-        cmd = f"git clone --branch {branch} --single-branch {url} {repo_dir}"
+        started = time.monotonic()
+        reference = ''
 
-        def log_callback(line):
-            log(line, keyword=name, print_message=False)
+        if repo.get('reference_cache'):
+            cache_dir = await update_reference_cache(name, url)
+            reference = f"--reference-if-able {cache_dir}"
 
+        cmd = f"git clone --progress --branch {branch} --single-branch {FETCH_STRATEGY_FLAGS[strategy]} {reference} {url} {repo_dir}"
+
+        log_callback, received = progress_logger(name)
         await poll_output(cmd, callback=log_callback)
 
         log("Repo successfully cloned.", keyword=name)
+        await record_fetch_stats(name, 'clone', strategy, started, received)
     else:
         log("Repository already exists.", keyword=name)
         # raise Exception("Repository already exists.")
 
 
-async def git_pull(name: str):
+async def git_pull(name: str, new_hash=None):
     repo_dir = os.path.join(globals.REPO_DATA_PATH, name)
 
+    repo = globals.config_data['repos'][name]
+    branch = repo['branch']
+    strategy = repo.get('fetch_strategy', 'full')
+
     log(f"Pulling repo {repo_dir}", keyword=name)
+    started = time.monotonic()
 
-    cmd = "git pull --rebase"
+    if repo.get('update_mode', 'pull') == 'reset' or strategy == 'shallow':
+        # check out exactly the compared hash, no merge or rebase work
+        depth = '--depth 1' if strategy == 'shallow' else ''
+        cmd = f"git fetch --progress {depth} origin {branch} && git reset --hard {new_hash or 'FETCH_HEAD'}"
+    else:
+        cmd = "git pull --rebase --progress"
 
-    def log_callback(line):
-        log(line, keyword=name, print_message=False)
-        
+    log_callback, received = progress_logger(name)
     await poll_output(cmd, repo_dir, callback=log_callback)
 
-    log("Repo successfully pulled.")
+    log("Repo successfully pulled.", keyword=name)
+    await record_fetch_stats(name, 'pull', strategy, started, received)
+
+
+async def update_reference_cache(name, url):
+    # bare clone of the whole remote, its objects are borrowed by every repo cloned from it
+    cache_dir = os.path.join(globals.REPO_DATA_PATH, '.git_cache', hashlib.sha1(url.encode()).hexdigest()[:16] + '.git')
+
+    if url not in reference_cache_locks:
+        reference_cache_locks[url] = asyncio.Lock()
+
+    async with reference_cache_locks[url]:
+        # never pruned or garbage collected, clones still borrow objects of deleted or rewritten branches
+        if not os.path.exists(cache_dir):
+            cmd = f"git clone --bare {url} {cache_dir} && git -C {cache_dir} config gc.auto 0"
+        else:
+            cmd = f"git -C {cache_dir} config gc.auto 0 && git -C {cache_dir} fetch origin '+refs/heads/*:refs/heads/*'"
+
+        log(f"Updating reference cache {cache_dir}", keyword=name)
+        await poll_output(cmd)
+
+    return cache_dir
+
+
+RECEIVED_PATTERN = re.compile(r'Receiving objects:.*?,\s*([\d.]+)\s*(bytes|KiB|MiB|GiB)')
+UNITS = {'bytes': 1, 'KiB': 2 ** 10, 'MiB': 2 ** 20, 'GiB': 2 ** 30}
+
+
+def progress_logger(name):
+    # progress updates are separated by carriage returns, only the last one is logged
+    received = {'bytes': 0}
+
+    def log_callback(line):
+        matches = RECEIVED_PATTERN.findall(line)
+        if matches:
+            value, unit = matches[-1]
+            received['bytes'] = int(float(value) * UNITS[unit])
+
+        log(line.rsplit('\r', 1)[-1], keyword=name, print_message=False)
+
+    return log_callback, received
+
+
+def directory_size(path):
+    total = 0
+
+    for root, dirs, files in os.walk(path):
+        for file in files:
+            try:
+                total += os.lstat(os.path.join(root, file)).st_blocks * 512
+            except OSError:
+                pass
+
+    return total
+
+
+async def record_fetch_stats(name, operation, strategy, started, received):
+    seconds = time.monotonic() - started
+    disk_bytes = await asyncio.to_thread(directory_size, os.path.join(globals.REPO_DATA_PATH, name))
+
+    log(f"{operation} ({strategy}) took {seconds:.1f}s, received {received['bytes']} bytes, repo uses {disk_bytes} bytes on disk", keyword=name)
+
+    if name in globals.repo_data:
+        history = globals.repo_data[name].setdefault('fetch_stats', [])
+        history.append({
+            'operation': operation,
+            'strategy': strategy,
+            'seconds': round(seconds, 3),
+            'bytes_received': received['bytes'],
+            'disk_bytes': disk_bytes,
+            'time': datetime.now().isoformat(timespec='seconds'),
+        })
+        del history[:-20]
 
 
 async def get_remote_hash(url, branch='main'):
     log(f"Getting {url} {branch} hash")
 
     cmd = f"git ls-remote {url} refs/heads/{branch}"
-    result = await asyncio.to_thread(check_output, cmd)
+    result = await check_output(cmd)
+
+    return result.split()[0] if result else None
+
+
+async def get_remote_hashes(url, branches):
+    log(f"Getting {url} {', '.join(branches)} hashes")
+
+    refs = ' '.join(f"refs/heads/{branch}" for branch in branches)
+    cmd = f"git ls-remote {url} {refs}"
+    result = await check_output(cmd)
+
+    hashes = {branch: None for branch in branches}
+
+    for line in (result or '').splitlines():
+        # stderr is mixed into the output, keep only "<hash>\t<ref>" lines
+        match = re.fullmatch(r'([0-9a-f]{40,64})\s+refs/heads/(\S+)', line.strip())
+        if match and match.group(2) in hashes:
+            hashes[match.group(2)] = match.group(1)
 
-    return result.split()[0] if result else None
\ No newline at end of file
+    return hashes
\ No newline at end of file
@@ -1,30 +1,102 @@
+import os
 from typing import Dict, Any
 import yaml
 import json
 
+from log_store import LogStore
+
 CONFIG_FILE_PATH = "/config/config.yaml"
 REPO_DATA_PATH = "/repo_data"
 REPO_DATA_FILE_PATH = "/repo_data/repo_data.json"
-    
+
+CONFIG_WATCH_INTERVAL = float(os.getenv("CONFIG_WATCH_INTERVAL", 2))
+
+DOCKER_SOCKET_PATH = os.getenv("DOCKER_HOST", "unix:///var/run/docker.sock").removeprefix("unix://")
+DOCKER_BACKEND = os.getenv("DOCKER_BACKEND", "auto")  # auto, api or cli
+DOCKER_API_POOL_SIZE = int(os.getenv("DOCKER_API_POOL_SIZE", 8))
+
+STATE_CACHE_TTL = float(os.getenv("STATE_CACHE_TTL", 5))
+STATE_CACHE_SIZE = int(os.getenv("STATE_CACHE_SIZE", 1024))
+
+STATE_FLUSH_DELAY = float(os.getenv("STATE_FLUSH_DELAY", 0.05))
+STATE_COMPACT_RECORDS = int(os.getenv("STATE_COMPACT_RECORDS", 500))
+STATE_COMPACT_INTERVAL = float(os.getenv("STATE_COMPACT_INTERVAL", 300))
+
+HISTORY_DB = os.getenv("HISTORY_DB", "0") == "1"
+HISTORY_DB_PATH = os.path.join(REPO_DATA_PATH, "history.sqlite3")
+HISTORY_HEALTH_RETENTION = float(os.getenv("HISTORY_HEALTH_RETENTION", 7 * 86400))  # seconds of health rows kept, 0 keeps all
+HISTORY_PRUNE_INTERVAL = float(os.getenv("HISTORY_PRUNE_INTERVAL", 3600))
+
+DOCKER_EVENTS = os.getenv("DOCKER_EVENTS", "1") == "1"
+DOCKER_EVENTS_BATCH_DELAY = float(os.getenv("DOCKER_EVENTS_BATCH_DELAY", 0.2))
+
+COMMAND_TIMEOUT = float(os.getenv("COMMAND_TIMEOUT", 60))  # short commands: ls-remote, inspect, ls-tree
+PROCESS_KILL_GRACE = float(os.getenv("PROCESS_KILL_GRACE", 10))  # between SIGTERM and SIGKILL of a process group
+
+PIPELINE_NETWORK_CONCURRENCY = int(os.getenv("PIPELINE_NETWORK_CONCURRENCY", 8))
+PIPELINE_BUILD_CONCURRENCY = int(os.getenv("PIPELINE_BUILD_CONCURRENCY", 2))
+PIPELINE_DEPLOY_CONCURRENCY = int(os.getenv("PIPELINE_DEPLOY_CONCURRENCY", 4))
+CHECK_DEBOUNCE_SECONDS = float(os.getenv("CHECK_DEBOUNCE_SECONDS", 2))
+SCHEDULE_START_SPREAD = float(os.getenv("SCHEDULE_START_SPREAD", 300))
+SCHEDULE_JITTER = float(os.getenv("SCHEDULE_JITTER", 0.1))
+SCHEDULE_BACKOFF_AFTER = int(os.getenv("SCHEDULE_BACKOFF_AFTER", 10))
+SCHEDULE_MAX_BACKOFF = int(os.getenv("SCHEDULE_MAX_BACKOFF", 8))
+SCHEDULE_WEBHOOK_QUIET = float(os.getenv("SCHEDULE_WEBHOOK_QUIET", 3600))
+SCHEDULE_MAX_CHECKS_PER_SECOND = float(os.getenv("SCHEDULE_MAX_CHECKS_PER_SECOND", 2))
+SCHEDULE_CHECK_BURST = int(os.getenv("SCHEDULE_CHECK_BURST", 5))
+HASH_CACHE_TTL = float(os.getenv("HASH_CACHE_TTL", 10))
+HASH_DISCOVERY_CONCURRENCY = int(os.getenv("HASH_DISCOVERY_CONCURRENCY", 4))
+
+HEALTH_INITIAL_DELAY = float(os.getenv("HEALTH_INITIAL_DELAY", 0.1))
+HEALTH_PROBE_CONCURRENCY = int(os.getenv("HEALTH_PROBE_CONCURRENCY", 16))
+HEALTH_HISTORY_SIZE = int(os.getenv("HEALTH_HISTORY_SIZE", 360))
+HEALTH_REMEDIATION_COOLDOWN = float(os.getenv("HEALTH_REMEDIATION_COOLDOWN", 300))
+
+BLUE_GREEN_LISTEN_HOST = os.getenv("BLUE_GREEN_LISTEN_HOST", "0.0.0.0")
+BLUE_GREEN_DRAIN_SECONDS = float(os.getenv("BLUE_GREEN_DRAIN_SECONDS", 30))
+
+BUILDX_BUILDER = os.getenv("BUILDX_BUILDER", "")  # empty uses the current buildx builder
+
+GC_INTERVAL = float(os.getenv("GC_INTERVAL", 3600))  # 0 disables the background GC
+GC_DISK_BUDGET = os.getenv("GC_DISK_BUDGET", "0")  # size of all repo images, e.g. "20GB", 0 is unlimited
+GC_BUILD_CACHE_KEEP = os.getenv("GC_BUILD_CACHE_KEEP", "5GB")
+
+LOOP_MONITOR = os.getenv("LOOP_MONITOR", "0") == "1"
+LOOP_MONITOR_INTERVAL = float(os.getenv("LOOP_MONITOR_INTERVAL", 0.1))
+LOOP_BLOCK_THRESHOLD = float(os.getenv("LOOP_BLOCK_THRESHOLD", 0.1))  # lag that counts as blocked and gets a stack sample
+LOOP_BLOCK_SAMPLES = int(os.getenv("LOOP_BLOCK_SAMPLES", 50))
+
+LOG_MAX_LINES = int(os.getenv("LOG_MAX_LINES", 10000))
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", 4_000_000))
+LOG_SPILL = os.getenv("LOG_SPILL", "0") == "1"
+LOG_SPILL_PATH = os.path.join(REPO_DATA_PATH, "logs")
+LOG_SEGMENT_BYTES = int(os.getenv("LOG_SEGMENT_BYTES", 8_000_000))
+LOG_SEGMENTS = int(os.getenv("LOG_SEGMENTS", 4))
+
 repo_data = {}
 config_data = {}
 
 ##
 
-log_output = {}
+log_output = LogStore(
+    max_lines=LOG_MAX_LINES,
+    max_bytes=LOG_MAX_BYTES,
+    spill_path=LOG_SPILL_PATH if LOG_SPILL else None,
+    segment_bytes=LOG_SEGMENT_BYTES,
+    max_segments=LOG_SEGMENTS
+)
 
 def log(message, keyword='default', print_message=True):
     if print_message:
         print(message)
 
-    if keyword not in log_output:
-        log_output[keyword] = []
-
-    log_output[keyword].append(message)
+    log_output.get(keyword, create=True).append(message)
 
 def filter_log(keyword, num_of_lines=100):
-    if keyword in log_output:
-        return "\n".join(log_output[keyword][-num_of_lines:])
+    buffer = log_output.get(keyword)
+
+    if buffer is not None:
+        return "\n".join(buffer.tail(num_of_lines))
     else:
         return ''
 
@@ -0,0 +1,86 @@
+import time
+import asyncio
+
+import globals
+
+from git_functions import get_remote_hashes
+
+
+class RemoteHashDiscovery:
+    """Resolves branch hashes with one `git ls-remote` per remote URL, shared by every repo using it."""
+
+    def __init__(self, ttl=10.0, concurrency=4):
+        self.ttl = ttl
+        self.concurrency = concurrency
+
+        self.results = {}
+        self.inflight = {}
+        self._loop = None
+        self._semaphore = None
+
+        self.lookups = 0
+        self.cache_hits = 0
+        self.shared = 0
+        self.ls_remote_calls = 0
+
+    def branches_for(self, url):
+        return {
+            repo['branch']
+            for repo in globals.config_data.get('repos', {}).values()
+            if repo['repo_url'] == url
+        }
+
+    def semaphore(self):
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._semaphore
+
+    async def fetch(self, url, branches):
+        async with self.semaphore():
+            self.ls_remote_calls += 1
+            hashes = await get_remote_hashes(url, sorted(branches))
+
+        self.results[url] = (time.monotonic(), hashes)
+        return hashes
+
+    async def get(self, url, branch, max_age=None):
+        max_age = self.ttl if max_age is None else max_age
+        now = time.monotonic()
+        self.lookups += 1
+
+        fetched_at, hashes = self.results.get(url, (0, {}))
+        if branch in hashes and now - fetched_at <= max_age:
+            self.cache_hits += 1
+            return hashes[branch]
+
+        # join a running ls-remote for this URL if it is recent enough and covers the branch
+        started_at, branches, task = self.inflight.get(url, (0, set(), None))
+        if task is None or task.done() or branch not in branches or now - started_at > max_age:
+            branches = self.branches_for(url) | {branch}
+            task = asyncio.ensure_future(self.fetch(url, branches))
+            self.inflight[url] = (now, branches, task)
+            task.add_done_callback(lambda done: self._clear_inflight(url, done))
+        else:
+            self.shared += 1
+
+        hashes = await asyncio.shield(task)
+        return hashes.get(branch)
+
+    def _clear_inflight(self, url, task):
+        if self.inflight.get(url, (0, set(), None))[2] is task:
+            del self.inflight[url]
+
+    def stats(self):
+        return {
+            'ttl': self.ttl,
+            'urls': len(self.results),
+            'lookups': self.lookups,
+            'cache_hits': self.cache_hits,
+            'shared': self.shared,
+            'ls_remote_calls': self.ls_remote_calls,
+        }
+
+
+remote_hashes = RemoteHashDiscovery(globals.HASH_CACHE_TTL, globals.HASH_DISCOVERY_CONCURRENCY)
@@ -0,0 +1,215 @@
+import time
+import random
+import asyncio
+from collections import deque
+
+import globals
+from globals import log
+
+from docker_api import read_response_head, read_response_body
+from subprocess_functions import run_process
+
+
+DEFAULT_COMMAND = 'curl -f {host_address}:{port} || exit 1'
+
+
+def probe_host():
+    # host_address may be written as a URL for the dashboard links
+    return globals.config_data['host_address'].split('://')[-1].split('/')[0].rsplit(':', 1)[0] or 'localhost'
+
+
+def probe_type(name):
+    healthcheck = globals.config_data['repos'][name]['healthcheck']
+    kind = healthcheck.get('type', 'auto')
+
+    if kind == 'auto':
+        # a customised command keeps running as before, the default curl is done natively
+        command = healthcheck.get('command')
+        if not command:
+            return 'none'
+        return 'http' if command == DEFAULT_COMMAND else 'command'
+
+    return kind
+
+
+def enabled(name):
+    return probe_type(name) != 'none'
+
+##  probes
+
+class HTTPProber:
+    """Keep-alive HTTP/1.1 connections per host and port, shared by every health probe."""
+
+    def __init__(self, max_idle=2):
+        self.max_idle = max_idle
+        self.idle = {}
+        self._loop = None
+
+    def _bind_loop(self):
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self.idle = {}
+
+    async def get(self, host, port, path, timeout):
+        self._bind_loop()
+        idle = self.idle.setdefault((host, port), deque())
+
+        while idle:
+            reader, writer = idle.pop()
+            try:
+                return await asyncio.wait_for(self._roundtrip(host, port, path, reader, writer), timeout)
+            except (OSError, asyncio.IncompleteReadError):
+                # the server closed the idle connection, try the next one
+                writer.close()
+            except asyncio.TimeoutError:
+                writer.close()
+                raise
+
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+        try:
+            return await asyncio.wait_for(self._roundtrip(host, port, path, reader, writer), timeout)
+        except BaseException:
+            writer.close()
+            raise
+
+    async def _roundtrip(self, host, port, path, reader, writer):
+        writer.write(
+            f"GET {path} HTTP/1.1\r\nHost: {host}:{port}\r\nUser-Agent: autodock\r\nAccept: */*\r\n\r\n".encode()
+        )
+        await writer.drain()
+
+        status, headers = await read_response_head(reader)
+        await read_response_body(reader, 'GET', status, headers)
+
+        idle = self.idle.setdefault((host, port), deque())
+        if headers.get('connection', '').lower() == 'close' or len(idle) >= self.max_idle:
+            writer.close()
+        else:
+            idle.append((reader, writer))
+
+        return status
+
+
+http_prober = HTTPProber()
+
+
+async def probe_http(host, port, path, timeout):
+    status = await http_prober.get(host, port, path, timeout)
+    # same as curl -f
+    return 200 <= status < 400, status
+
+
+async def probe_tcp(host, port, timeout):
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    writer.close()
+    return True, None
+
+
+async def probe_command(command, timeout):
+    # in its own process group, a timeout kills whatever the command started as well
+    returncode = await run_process(command, timeout=timeout, check=False)
+    return returncode == 0, returncode
+
+
+async def probe(name, port=None):
+    """Runs one probe of the repo (or of `port` instead of the repo port), never raises."""
+    started = time.monotonic()
+    timed_out = False
+    timeout = None
+
+    try:
+        # the repo may have been removed by a config reload in the meantime
+        repo = globals.config_data['repos'][name]
+        healthcheck = repo['healthcheck']
+        kind = probe_type(name)
+        port = port or repo['port']
+        host = probe_host()
+        timeout = healthcheck['timeout']
+
+        if kind == 'tcp':
+            ok, status = await probe_tcp(host, port, timeout)
+        elif kind == 'command':
+            command = healthcheck['command'].format(port=port, host_address=globals.config_data['host_address'])
+            ok, status = await probe_command(command, timeout)
+        else:
+            ok, status = await probe_http(host, port, healthcheck.get('path', '/'), timeout)
+        error = None
+    except asyncio.TimeoutError:
+        ok, status, error, timed_out = False, None, f"timed out after {timeout} seconds", True
+    except Exception as e:
+        ok, status, error = False, None, str(e) or type(e).__name__
+
+    return {
+        'ok': ok,
+        'status': status,
+        'error': error,
+        'timed_out': timed_out,
+        'latency': round(time.monotonic() - started, 4),
+        'time': time.time(),
+    }
+
+
+async def wait_healthy(name, port=None):
+    """Probes right away and backs off with jitter (up to `retry_delay`) until `success_threshold` probes
+    in a row pass, `retries` probes timed out or the `deadline` passed. Refused connections and failing
+    responses are expected while the service starts and only end the wait at the deadline."""
+    healthcheck = globals.config_data['repos'][name]['healthcheck']
+
+    retries = healthcheck['retries']
+    max_delay = healthcheck['retry_delay']
+    deadline = time.monotonic() + healthcheck.get('deadline', 60)
+    success_threshold = healthcheck.get('success_threshold', 1)
+
+    delay = globals.HEALTH_INITIAL_DELAY
+    successes = 0
+    failures = 0
+    timeouts = 0
+
+    while True:
+        result = await probe(name, port)
+
+        if result['ok']:
+            successes += 1
+            if successes >= success_threshold:
+                return True
+            # confirm quickly
+            delay = globals.HEALTH_INITIAL_DELAY
+        else:
+            successes = 0
+            failures += 1
+            log(f"Health check attempt {failures} failed: {result['error'] or result['status']}", keyword=name)
+
+            if result['timed_out']:
+                timeouts += 1
+                if timeouts >= retries:
+                    return False
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            log(f"Health check deadline passed.", keyword=name)
+            return False
+
+        # the last probe runs at the deadline, not one backoff before it
+        sleep = min(min(delay, max_delay) * random.uniform(0.5, 1.5), remaining)
+
+        await asyncio.sleep(sleep)
+        if not result['ok']:
+            delay *= 2
+
+
+_semaphore = None
+_semaphore_loop = None
+
+
+def probe_semaphore():
+    # background monitoring of many repos keeps at most HEALTH_PROBE_CONCURRENCY probes in flight
+    global _semaphore, _semaphore_loop
+
+    loop = asyncio.get_running_loop()
+    if loop is not _semaphore_loop:
+        _semaphore_loop = loop
+        _semaphore = asyncio.Semaphore(globals.HEALTH_PROBE_CONCURRENCY)
+
+    return _semaphore
+
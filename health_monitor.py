@@ -0,0 +1,199 @@
+import time
+import asyncio
+from collections import deque
+
+import globals
+from globals import log
+
+import health
+from bluegreen import container_name
+from pipeline import repo_lock
+from docker_functions import docker_container_action
+from functions import repo_rollback
+from history_db import history
+
+
+class RepoHealth:
+    """Probe history of one repo, samples are (time, latency or None when failed, http status)."""
+
+    def __init__(self, size):
+        self.samples = deque(maxlen=size)
+        self.next_probe = 0.0
+        self.consecutive_failures = 0
+        self.last_remediation = 0.0
+        self.remediations = 0
+        self.remediating = False
+        self.probing = False
+        # versions already remediated (and rolled back to), not remediated again while deployed
+        self.remediated_versions = set()
+
+    def record(self, result):
+        self.samples.append((
+            round(result['time'], 1),
+            result['latency'] if result['ok'] else None,
+            result['status'],
+        ))
+
+        if result['ok']:
+            self.consecutive_failures = 0
+        else:
+            self.consecutive_failures += 1
+
+    def state(self):
+        if not self.samples:
+            return 'unknown'
+        return 'healthy' if self.samples[-1][1] is not None else 'unhealthy'
+
+    def to_json(self):
+        return {
+            'state': self.state(),
+            'consecutive_failures': self.consecutive_failures,
+            'remediations': self.remediations,
+            'samples': [
+                {'time': sample_time, 'latency': latency, 'status': status}
+                for sample_time, latency, status in self.samples
+            ],
+        }
+
+
+repos = {}
+probes = set()  # running probe tasks, referenced until done
+
+
+def get(name):
+    if name not in repos:
+        repos[name] = RepoHealth(globals.HEALTH_HISTORY_SIZE)
+    return repos[name]
+
+
+def monitored(name):
+    repo = globals.config_data['repos'][name]
+    repo_data = globals.repo_data.get(name, {})
+
+    return repo.get('monitor_interval', 0) > 0 and health.enabled(name) and repo_data.get('stages', {}).get('deploy') is not None
+
+
+def due_repos(now):
+    due = []
+
+    for name in globals.config_data.get('repos', {}):
+        # a deploy or remediation in progress is expected to fail probes
+        if not monitored(name) or repo_lock(name).locked() or get(name).remediating or get(name).probing:
+            continue
+
+        if get(name).next_probe <= now:
+            get(name).next_probe = now + globals.config_data['repos'][name]['monitor_interval']
+            due.append(name)
+
+    return due
+
+
+async def remediate(name):
+    repo = globals.config_data['repos'].get(name)
+    repo_health = get(name)
+    action = repo.get('monitor_remediation', 'none') if repo else 'none'
+    deployed_version = globals.repo_data.get(name, {}).get('deployed_version')
+
+    log(f"Health monitor: {repo_health.consecutive_failures} failed probes in a row.", keyword=name)
+
+    if action == 'none' or time.monotonic() - repo_health.last_remediation < globals.HEALTH_REMEDIATION_COOLDOWN:
+        return
+
+    # an outage the code did not cause (e.g. a database) must not walk back through every version
+    if deployed_version in repo_health.remediated_versions:
+        log(f"Health monitor: {deployed_version} was already remediated, leaving it as it is.", keyword=name)
+        return
+
+    repo_health.remediating = True
+    repo_health.last_remediation = time.monotonic()
+    repo_health.remediations += 1
+
+    try:
+        async with repo_lock(name):
+            if action == 'restart':
+                container = container_name(name)
+                log(f"Health monitor: restarting {container}.", keyword=name)
+                await docker_container_action('restart', container)
+            elif action == 'rollback':
+                log(f"Health monitor: rolling back.", keyword=name)
+                await repo_rollback(name)
+    except Exception as e:
+        log(f"Health monitor: {action} failed: {e}", keyword=name)
+    finally:
+        # a new deploy is remediated again, the failing version and its rollback target are not
+        if repo_health.remediated_versions and deployed_version not in repo_health.remediated_versions:
+            repo_health.remediated_versions.clear()
+        repo_health.remediated_versions.update({deployed_version, globals.repo_data.get(name, {}).get('deployed_version')})
+        repo_health.consecutive_failures = 0
+        repo_health.remediating = False
+
+
+async def probe_repo(name):
+    repo_health = get(name)
+
+    try:
+        # each repo probes on its own, a hanging probe does not hold up the others
+        async with health.probe_semaphore():
+            result = await health.probe(name)
+        if name not in globals.config_data['repos']:
+            return
+
+        history.record_health('monitor', {name: result})
+        repo_health.record(result)
+
+        threshold = globals.config_data['repos'][name].get('monitor_failure_threshold', 3)
+        if repo_health.consecutive_failures >= threshold and not repo_health.remediating:
+            await remediate(name)
+    except Exception as e:
+        log(f"Health monitor: probe failed: {e}", keyword=name)
+    finally:
+        repo_health.probing = False
+
+
+async def supervise():
+    while True:
+        try:
+            for name in due_repos(time.monotonic()):
+                get(name).probing = True
+                task = asyncio.create_task(probe_repo(name))
+                probes.add(task)
+                task.add_done_callback(probes.discard)
+        except Exception as e:
+            print(f"HEALTH: monitor tick failed - {e}")
+
+        await asyncio.sleep(1)
+
+
+def sparkline(name, width=300, height=40):
+    """Polyline points for the latency of the recorded samples, failed probes are drawn at the top."""
+    samples = list(get(name).samples) if name in repos else []
+    if len(samples) < 2:
+        return None
+
+    latencies = [latency for _, latency, _ in samples if latency is not None]
+    peak = max(latencies, default=0) or 1
+
+    step = width / (len(samples) - 1)
+    points = []
+    failures = []
+
+    for i, (_, latency, _) in enumerate(samples):
+        x = round(i * step, 1)
+        if latency is None:
+            failures.append(x)
+            y = 0
+        else:
+            y = round(height - latency / peak * (height - 2), 1)
+        points.append(f"{x},{y}")
+
+    return {
+        'points': ' '.join(points),
+        'failures': failures,
+        'peak_ms': round(peak * 1000, 1),
+        'width': width,
+        'height': height,
+    }
+
+
+def stats():
+    return {name: {'state': repo.state(), 'consecutive_failures': repo.consecutive_failures, 'remediations': repo.remediations} for name, repo in repos.items()}
@@ -0,0 +1,223 @@
+import json
+import time
+import asyncio
+import sqlite3
+from datetime import datetime, timezone, timedelta
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+import globals
+import metrics
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS repos (
+    name TEXT PRIMARY KEY,
+    repo_url TEXT,
+    branch TEXT,
+    created TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS builds (
+    id INTEGER PRIMARY KEY,
+    repo TEXT NOT NULL,
+    time TEXT NOT NULL,
+    version TEXT,
+    hash TEXT,
+    builder TEXT,
+    status TEXT NOT NULL,
+    seconds REAL,
+    steps TEXT
+);
+CREATE TABLE IF NOT EXISTS deploys (
+    id INTEGER PRIMARY KEY,
+    repo TEXT NOT NULL,
+    time TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    version TEXT,
+    hash TEXT,
+    strategy TEXT,
+    status TEXT NOT NULL,
+    seconds REAL
+);
+CREATE TABLE IF NOT EXISTS health (
+    id INTEGER PRIMARY KEY,
+    repo TEXT NOT NULL,
+    time TEXT NOT NULL,
+    source TEXT NOT NULL,
+    ok INTEGER NOT NULL,
+    latency REAL,
+    status INTEGER
+);
+CREATE TABLE IF NOT EXISTS stage_timings (
+    id INTEGER PRIMARY KEY,
+    repo TEXT NOT NULL,
+    time TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    status TEXT NOT NULL,
+    seconds REAL
+);
+CREATE INDEX IF NOT EXISTS builds_repo_id ON builds (repo, id);
+CREATE INDEX IF NOT EXISTS builds_repo_time ON builds (repo, time);
+CREATE INDEX IF NOT EXISTS deploys_repo_id ON deploys (repo, id);
+CREATE INDEX IF NOT EXISTS deploys_repo_time ON deploys (repo, time);
+CREATE INDEX IF NOT EXISTS health_repo_id ON health (repo, id);
+CREATE INDEX IF NOT EXISTS health_repo_time ON health (repo, time);
+CREATE INDEX IF NOT EXISTS health_time ON health (time);
+CREATE INDEX IF NOT EXISTS stage_timings_repo_id ON stage_timings (repo, id);
+CREATE INDEX IF NOT EXISTS stage_timings_repo_time ON stage_timings (repo, time);
+"""
+
+TABLES = ('builds', 'deploys', 'health', 'stage_timings')
+
+
+def now():
+    return datetime.now(timezone.utc).isoformat(timespec='seconds')
+
+
+class HistoryDB:
+    """Build, deploy, health and stage history in SQLite. The connection lives on one dedicated thread,
+    writes are queued to it without waiting, reads are awaited."""
+
+    enabled = True
+
+    def __init__(self, path):
+        self.path = path
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='history-db')
+        self.connection = None
+
+        self.writes = 0
+        self.failed_writes = 0
+        self.last_prune = None  # the first health write prunes
+
+    def _connect(self):
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.path)
+            self.connection.row_factory = sqlite3.Row
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.executescript(SCHEMA)
+
+        return self.connection
+
+    def _write(self, sql, rows):
+        connection = self._connect()
+        with connection:
+            connection.executemany(sql, rows)
+
+    def _query(self, sql, params):
+        return [dict(row) for row in self._connect().execute(sql, params)]
+
+    def write(self, sql, rows):
+        self.writes += 1
+        future = self.executor.submit(self._write, sql, rows)
+        future.add_done_callback(self._log_failure)
+
+    def _log_failure(self, future):
+        if future.exception():
+            self.failed_writes += 1
+            print(f"HISTORY: write failed - {future.exception()}")
+
+    async def query(self, sql, params=()):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self._query, sql, params)
+
+    ##  write through
+
+    def record_repo(self, name, repo_url, branch):
+        self.write(
+            "INSERT INTO repos (name, repo_url, branch, created) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (name) DO UPDATE SET repo_url = excluded.repo_url, branch = excluded.branch",
+            [(name, repo_url, branch, now())]
+        )
+
+    def record_build(self, name, version, commit_hash, builder, status, seconds, steps=None):
+        self.write(
+            "INSERT INTO builds (repo, time, version, hash, builder, status, seconds, steps) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [(name, now(), version, commit_hash, builder, status, seconds, json.dumps(steps or []))]
+        )
+
+    def record_deploy(self, name, kind, version, commit_hash, strategy, status, seconds):
+        self.write(
+            "INSERT INTO deploys (repo, time, kind, version, hash, strategy, status, seconds) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [(name, now(), kind, version, commit_hash, strategy, status, seconds)]
+        )
+
+    def record_health(self, source, results):
+        # results: {name: probe result}
+        self.write(
+            "INSERT INTO health (repo, time, source, ok, latency, status) VALUES (?, ?, ?, ?, ?, ?)",
+            [(name, now(), source, int(result['ok']), result['latency'], result['status']) for name, result in results.items()]
+        )
+        self.prune_health()
+
+    def prune_health(self):
+        # the monitor writes a row per repo and interval, old rows are deleted on the writer thread
+        if not globals.HISTORY_HEALTH_RETENTION:
+            return
+        if self.last_prune is not None and time.monotonic() - self.last_prune < globals.HISTORY_PRUNE_INTERVAL:
+            return
+
+        self.last_prune = time.monotonic()
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=globals.HISTORY_HEALTH_RETENTION)
+        self.write("DELETE FROM health WHERE time < ?", [(cutoff.isoformat(timespec='seconds'),)])
+
+    def record_stage(self, name, stage, status, seconds):
+        self.write(
+            "INSERT INTO stage_timings (repo, time, stage, status, seconds) VALUES (?, ?, ?, ?, ?)",
+            [(name, now(), stage, status, seconds)]
+        )
+
+    ##  queries
+
+    async def page(self, table, name, before=None, limit=50, since=None):
+        """Newest first; pass the last id of a page as `before` for the next one."""
+        if table not in TABLES:
+            raise ValueError(f"unknown history table {table}")
+
+        sql = f"SELECT * FROM {table} WHERE repo = ?"
+        params = [name]
+
+        if before is not None:
+            sql += " AND id < ?"
+            params.append(before)
+        if since is not None:
+            sql += " AND time >= ?"
+            params.append(since)
+
+        sql += " ORDER BY id DESC LIMIT ?"
+        params.append(limit)
+
+        return await self.query(sql, params)
+
+    def close(self):
+        def close_connection():
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+        self.executor.submit(close_connection)
+        self.executor.shutdown(wait=True)
+
+
+class DisabledHistory:
+    enabled = False
+
+    def __getattr__(self, attribute):
+        # every record_* call is a no-op
+        return lambda *args, **kwargs: None
+
+
+history = HistoryDB(globals.HISTORY_DB_PATH) if globals.HISTORY_DB else DisabledHistory()
+
+
+@asynccontextmanager
+async def timed_stage(name, stage):
+    started = time.monotonic()
+    status = 'failed'
+
+    try:
+        yield
+        status = 'ok'
+    finally:
+        seconds = time.monotonic() - started
+        metrics.stage_seconds.observe(seconds, stage, status)
+        history.record_stage(name, stage, status, round(seconds, 3))
@@ -0,0 +1,194 @@
+import re
+import time
+import asyncio
+
+import globals
+
+import bluegreen
+from docker_api import parse_size
+from docker_functions import docker_image_list, docker_image_remove_many, docker_disk_usage, docker_prune, docker_container_inspect
+from pipeline import repo_lock
+from state_store import state_store
+
+
+status = {
+    'runs': 0,
+    'running': False,
+    'last_run': None,
+}
+
+_lock = None
+_lock_loop = None
+
+
+def gc_lock():
+    global _lock, _lock_loop
+
+    loop = asyncio.get_running_loop()
+    if loop is not _lock_loop:
+        _lock_loop = loop
+        _lock = asyncio.Lock()
+
+    return _lock
+
+
+def version_pattern(name):
+    """Matches the image refs of the repo's builds, None if its tag scheme has no {build_number}."""
+    repo = globals.config_data['repos'][name]
+    scheme = re.escape(repo['version_tag_scheme']).replace(r'\{name\}', re.escape(name))
+
+    if r'\{build_number\}' not in scheme:
+        return None
+
+    scheme = scheme.replace(r'\{build_number\}', r'(?P<build_number>\d+)', 1)
+    return re.compile(scheme.replace(r'\{build_number\}', r'(?P=build_number)') + '$')
+
+
+def repo_versions(name, images):
+    """(order, ref, image) of the repo's versions, newest first."""
+    pattern = version_pattern(name)
+    versions = []
+
+    if pattern is None:
+        # without build numbers in the tags only the versions autodock recorded are known to be the repo's
+        history = globals.repo_data.get(name, {}).get('version_history', [])
+        for image in images:
+            ref = f"{image['Repository']}:{image['Tag']}"
+            if ref in history:
+                versions.append((history.index(ref), ref, image))
+    else:
+        for image in images:
+            ref = f"{image['Repository']}:{image['Tag']}"
+            match = pattern.match(ref)
+            if match:
+                versions.append((int(match.group('build_number')), ref, image))
+
+    versions.sort(key=lambda version: version[0], reverse=True)
+    return versions
+
+
+async def protected_versions(name):
+    repo_data = globals.repo_data.get(name, {})
+    history = repo_data.get('version_history', [])
+
+    protected = set(history[-2:])  # the current build and the rollback target
+    protected.add(repo_data.get('deployed_version'))
+    protected.add((repo_data.get('build_context') or {}).get('version'))
+    protected.update(repo_data.get('blue_green', {}).get('versions', {}).values())
+
+    # whatever the container actually runs, also for deploys from before deployed_version was tracked
+    _, inspect = await docker_container_inspect(bluegreen.container_name(name))
+    if inspect:
+        protected.add(inspect[0].get('Config', {}).get('Image'))
+
+    protected.discard(None)
+    return protected
+
+
+async def plan(images):
+    """Returns the image refs to remove: versions beyond each repo's keep_versions, then the oldest
+    remaining versions until the global disk budget fits. Protected versions are never returned."""
+    sizes = {image['Id']: parse_size(image['Size']) for image in images}
+    refs_by_id = {}
+    for image in images:
+        refs_by_id.setdefault(image['Id'], set()).add(f"{image['Repository']}:{image['Tag']}")
+
+    candidates = []
+    removals = []
+
+    for name, repo in globals.config_data['repos'].items():
+        # a repo in the middle of a pipeline may be deploying one of its older versions
+        if repo_lock(name).locked():
+            continue
+
+        protected = await protected_versions(name)
+        versions = repo_versions(name, images)
+        keep = repo.get('keep_versions', 0)
+
+        for position, (order, ref, image) in enumerate(versions):
+            if ref in protected:
+                continue
+            if keep and position >= keep:
+                removals.append(ref)
+            else:
+                candidates.append((image['CreatedAt'], ref, image['Id']))
+
+    budget = parse_size(globals.GC_DISK_BUDGET)
+    if budget:
+        remaining = {ref for refs in refs_by_id.values() for ref in refs} - set(removals)
+        used = sum(size for image_id, size in sizes.items() if refs_by_id[image_id] & remaining)
+
+        # oldest first across all repos
+        for created, ref, image_id in sorted(candidates):
+            if used <= budget:
+                break
+
+            removals.append(ref)
+            remaining.discard(ref)
+            if not refs_by_id[image_id] & remaining:
+                used -= sizes[image_id]
+
+    return removals
+
+
+def forget_versions(removed):
+    removed = set(removed)
+
+    for name, repo_data in globals.repo_data.items():
+        history = repo_data.get('version_history', [])
+        kept = [version for version in history if version not in removed]
+        builds = repo_data.get('builds', {})
+        # also the records of versions dropped from the history by a rollback
+        forgotten = set(builds) - set(kept)
+
+        if len(kept) != len(history) or forgotten:
+            repo_data['version_history'] = kept
+            for version in forgotten:
+                del builds[version]
+            state_store.save(name)
+
+
+async def collect():
+    async with gc_lock():
+        status['running'] = True
+        started = time.monotonic()
+
+        try:
+            before = await docker_disk_usage()
+
+            images = await docker_image_list()
+            removals = await plan(images)
+            removed = await docker_image_remove_many(removals)
+            forget_versions(removed)
+
+            reclaimed = await docker_prune(parse_size(globals.GC_BUILD_CACHE_KEEP) or None)
+
+            after = await docker_disk_usage()
+        finally:
+            status['running'] = False
+
+        freed = (before['images'] + before['build_cache']) - (after['images'] + after['build_cache'])
+
+        status['runs'] += 1
+        status['last_run'] = {
+            'time': time.time(),
+            'duration_seconds': round(time.monotonic() - started, 3),
+            'planned': len(removals),
+            'removed': removed,
+            'prune_reclaimed_bytes': reclaimed,
+            'freed_bytes': max(freed, 0),
+            'disk_usage': after,
+        }
+
+        print(f"GC: removed {len(removed)} images, freed {freed} bytes in {status['last_run']['duration_seconds']} seconds")
+        return status['last_run']
+
+
+async def run_periodically():
+    while True:
+        await asyncio.sleep(globals.GC_INTERVAL)
+
+        try:
+            await collect()
+        except Exception as e:
+            print(f"GC: failed - {e}")
@@ -0,0 +1,80 @@
+import asyncio
+
+import globals
+from log_store import LogBuffer
+
+from docker_functions import docker_container_follow_logs
+
+
+FOLLOW_TAIL_LINES = 1000
+IDLE_GRACE_SECONDS = 30
+
+
+class ContainerLogFollower:
+    """One `docker logs --follow` stream per container, shared by every subscriber."""
+
+    def __init__(self, container_id):
+        self.container_id = container_id
+        self.buffer = LogBuffer(FOLLOW_TAIL_LINES, globals.LOG_MAX_BYTES)
+        self.subscribers = 0
+        self.task = None
+        self.stop_handle = None
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        def batch_callback(lines):
+            for line in lines:
+                self.buffer.append(line)
+
+        try:
+            await docker_container_follow_logs(self.container_id, FOLLOW_TAIL_LINES, batch_callback)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.buffer.append(f"Log stream failed: {e}")
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+        if followers.get(self.container_id) is self:
+            del followers[self.container_id]
+
+
+followers = {}
+
+
+def subscribe(container_id):
+    follower = followers.get(container_id)
+
+    # a finished stream nobody is reading is started over with a fresh buffer
+    if follower is None or (follower.subscribers <= 0 and follower.task and follower.task.done()):
+        if follower and follower.stop_handle:
+            follower.stop_handle.cancel()
+        follower = followers[container_id] = ContainerLogFollower(container_id)
+
+    if follower.stop_handle:
+        follower.stop_handle.cancel()
+        follower.stop_handle = None
+
+    follower.subscribers += 1
+    follower.start()
+
+    return follower
+
+
+def unsubscribe(follower):
+    follower.subscribers -= 1
+
+    # keep the stream around briefly so page reloads reuse it
+    if follower.subscribers <= 0:
+        follower.stop_handle = asyncio.get_running_loop().call_later(IDLE_GRACE_SECONDS, follower.stop)
+
+
+def stats():
+    return {
+        container_id: {'subscribers': follower.subscribers, 'lines': len(follower.buffer), 'next_seq': follower.buffer.next_seq}
+        for container_id, follower in followers.items()
+    }
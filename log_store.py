@@ -0,0 +1,228 @@
+import os
+import re
+import asyncio
+import threading
+from collections import deque
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+
+
+def byte_size(line):
+    # as stored in the spill file, with its newline
+    return len(line.encode('utf-8', errors='replace')) + 1
+
+
+# one thread writes every spill file, in the order the lines were logged
+spill_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='log-spill')
+
+
+class SpillFile:
+    """Append-only log history split into numbered segment files, oldest segments are deleted.
+    Lines are queued and written in batches on the spill thread, the caller never touches the disk."""
+
+    def __init__(self, directory, segment_bytes, max_segments):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_segments = max_segments
+
+        os.makedirs(directory, exist_ok=True)
+
+        segments = self.segments()
+        self.index = segments[-1] if segments else 1
+        self.file = None
+        self.size = 0
+
+        self.pending = []
+        self.lock = threading.Lock()
+
+    def segments(self):
+        return sorted(int(name[:-4]) for name in os.listdir(self.directory) if re.fullmatch(r'\d+\.log', name))
+
+    def path(self, index):
+        return os.path.join(self.directory, f"{index:06d}.log")
+
+    def write(self, line):
+        with self.lock:
+            self.pending.append(line)
+            if len(self.pending) > 1:
+                return  # a flush is already queued and picks this line up
+
+        spill_executor.submit(self.flush).add_done_callback(self._log_failure)
+
+    def _log_failure(self, future):
+        if future.exception():
+            print(f"LOG: spill write failed - {future.exception()}")
+
+    def flush(self):
+        with self.lock:
+            lines, self.pending = self.pending, []
+
+        if self.file is None:
+            self.file = open(self.path(self.index), 'a', encoding='utf-8', errors='replace')
+            self.size = os.path.getsize(self.path(self.index))
+
+        for line in lines:
+            if self.size >= self.segment_bytes:
+                self.rotate()
+
+            self.file.write(line + '\n')
+            self.size += byte_size(line)
+
+        self.file.flush()
+
+    def rotate(self):
+        self.file.close()
+        self.index += 1
+        self.file = open(self.path(self.index), 'a', encoding='utf-8', errors='replace')
+        self.size = 0
+
+        for index in self.segments()[:-self.max_segments]:
+            os.remove(self.path(index))
+
+    def read_tail(self, num_of_lines, max_bytes):
+        # newest segments first, reads at most max_bytes from their ends
+        segments = []
+        count = 0
+
+        for index in reversed(self.segments()):
+            with open(self.path(index), 'rb') as file:
+                size = file.seek(0, os.SEEK_END)
+                file.seek(max(size - max_bytes, 0))
+                data = file.read()
+
+            lines = data.decode('utf-8', errors='replace').splitlines()
+            if size > max_bytes:
+                lines = lines[1:]  # starts mid-line
+
+            segments.append(lines)
+            count += len(lines)
+            max_bytes -= len(data)
+            if count >= num_of_lines or max_bytes <= 0:
+                break
+
+        lines = [line for segment in reversed(segments) for line in segment]
+        return lines[-num_of_lines:] if num_of_lines else []
+
+    def close(self):
+        spill_executor.submit(self._close).result()
+
+    def _close(self):
+        self.flush()
+        if self.file:
+            self.file.close()
+            self.file = None
+
+
+class LogBuffer:
+    """Ring buffer of log lines capped by line count and total size in bytes, lines are numbered by a sequence."""
+
+    def __init__(self, max_lines, max_bytes, spill=None):
+        self.max_lines = max_lines
+        self.max_bytes = max_bytes
+        self.spill = spill
+
+        self.lines = deque()
+        self.size = 0
+        self.next_seq = 0
+        self._changed = None
+
+        if spill:
+            for line in spill.read_tail(max_lines, max_bytes):
+                self._append(line)
+
+    @property
+    def first_seq(self):
+        return self.next_seq - len(self.lines)
+
+    def _append(self, line):
+        self.lines.append(line)
+        self.size += byte_size(line)
+        self.next_seq += 1
+
+        while len(self.lines) > self.max_lines or (self.size > self.max_bytes and len(self.lines) > 1):
+            self.size -= byte_size(self.lines.popleft())
+
+        if self._changed is not None:
+            self._changed.set()
+            self._changed = None
+
+    def append(self, line):
+        self._append(line)
+
+        if self.spill:
+            self.spill.write(line)
+
+    def tail(self, num_of_lines):
+        # walks only the last num_of_lines entries
+        lines = list(islice(reversed(self.lines), max(num_of_lines, 0)))
+        lines.reverse()
+        return lines
+
+    def since(self, cursor):
+        # lines from sequence number `cursor` on (or the oldest still kept) and the next cursor
+        return self.tail(self.next_seq - max(cursor, self.first_seq)), self.next_seq
+
+    async def wait(self, cursor, timeout=None):
+        while self.next_seq <= cursor:
+            if self._changed is None:
+                self._changed = asyncio.Event()
+            await asyncio.wait_for(self._changed.wait(), timeout)
+
+    def __len__(self):
+        return len(self.lines)
+
+
+class LogStore:
+    def __init__(self, max_lines=10000, max_bytes=4_000_000, spill_path=None, segment_bytes=8_000_000, max_segments=4):
+        self.max_lines = max_lines
+        self.max_bytes = max_bytes
+        self.spill_path = spill_path
+        self.segment_bytes = segment_bytes
+        self.max_segments = max_segments
+
+        self.buffers = {}
+
+    def get(self, keyword, create=False):
+        buffer = self.buffers.get(keyword)
+
+        if buffer is None and (create or self._has_spill(keyword)):
+            buffer = self.buffers.setdefault(keyword, self._create(keyword))
+
+        return buffer
+
+    def _create(self, keyword):
+        spill = None
+        if self.spill_path:
+            spill = SpillFile(self._spill_directory(keyword), self.segment_bytes, self.max_segments)
+
+        return LogBuffer(self.max_lines, self.max_bytes, spill)
+
+    def preload(self):
+        """Reads the spilled history of every keyword, run in a thread at startup so that the reads
+        are not done on the event loop the first time a keyword logs."""
+        if not self.spill_path or not os.path.isdir(self.spill_path):
+            return
+
+        for directory in os.listdir(self.spill_path):
+            if directory not in self.buffers:
+                self.buffers.setdefault(directory, self._create(directory))
+
+    def close(self):
+        for buffer in list(self.buffers.values()):
+            if buffer.spill:
+                buffer.spill.close()
+
+    def _spill_directory(self, keyword):
+        return os.path.join(self.spill_path, re.sub(r'[^\w.-]', '_', keyword))
+
+    def _has_spill(self, keyword):
+        return bool(self.spill_path) and os.path.isdir(self._spill_directory(keyword))
+
+    def __contains__(self, keyword):
+        return self.get(keyword) is not None
+
+    def stats(self):
+        return {
+            keyword: {'lines': len(buffer), 'bytes': buffer.size, 'next_seq': buffer.next_seq}
+            for keyword, buffer in self.buffers.items()
+        }
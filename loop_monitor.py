@@ -0,0 +1,129 @@
+import os
+import sys
+import time
+import asyncio
+import threading
+import traceback
+from collections import deque
+
+import globals
+from globals import log
+
+import metrics
+
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def top_frame(stack):
+    """The innermost frame in autodock's own code, a block deep inside json or yaml is blamed on its caller."""
+    if not stack:
+        return 'unknown (blocked between watchdog samples)'
+
+    frames = [entry.strip().splitlines()[0] for entry in stack]
+    for frame in reversed(frames):
+        if frame.startswith(f'File "{APP_DIR}'):
+            return frame.removeprefix(f'File "{APP_DIR}/').replace('"', '', 1)
+
+    return frames[-1]
+
+
+class LoopMonitor:
+    """A heartbeat task measures how late the event loop runs it. A watchdog thread notices when the
+    heartbeat is overdue by more than the threshold and samples the stack of the loop thread while it
+    is still blocked, so the sample shows the blocking call itself."""
+
+    def __init__(self, interval, threshold, samples):
+        self.interval = interval
+        self.threshold = threshold
+
+        self.loop_thread = None
+        self.beat = None
+        self.stack = None  # sample of the current stall, taken by the watchdog
+        self.running = False
+
+        self.beats = 0
+        self.total_lag = 0.0
+        self.max_lag = 0.0
+        self.blocks = deque(maxlen=samples)
+        self.hotspots = {}  # innermost frame: {count, total_seconds}
+
+    def start(self):
+        self.loop_thread = threading.get_ident()
+        self.beat = time.monotonic()
+        self.running = True
+
+        threading.Thread(target=self.watchdog, name='loop-monitor', daemon=True).start()
+        return asyncio.create_task(self.heartbeat())
+
+    def stop(self):
+        self.running = False
+
+    async def heartbeat(self):
+        try:
+            while True:
+                expected = time.monotonic() + self.interval
+                await asyncio.sleep(self.interval)
+
+                now = time.monotonic()
+                self.beat = now
+                self.record(max(now - expected, 0))
+        finally:
+            self.running = False
+
+    def watchdog(self):
+        while self.running:
+            time.sleep(self.threshold / 2)
+
+            overdue = time.monotonic() - self.beat - self.interval
+            if overdue >= self.threshold and self.stack is None:
+                frame = sys._current_frames().get(self.loop_thread)
+                if frame is not None:
+                    self.stack = traceback.format_stack(frame)
+
+    def record(self, lag):
+        self.beats += 1
+        self.total_lag += lag
+        self.max_lag = max(self.max_lag, lag)
+        metrics.loop_lag.observe(lag)
+
+        if lag < self.threshold:
+            self.stack = None
+            return
+
+        stack, self.stack = self.stack, None
+        top = top_frame(stack)
+
+        self.blocks.append({
+            'time': time.time(),
+            'lag_seconds': round(lag, 3),
+            'top': top,
+            'stack': [line.rstrip() for line in stack or []],
+        })
+
+        hotspot = self.hotspots.setdefault(top, {'count': 0, 'total_seconds': 0.0})
+        hotspot['count'] += 1
+        hotspot['total_seconds'] += lag
+
+        log(f"LOOP: event loop blocked for {lag * 1000:.0f} ms at {top}", keyword='loop_monitor')
+
+    def stats(self):
+        hotspots = sorted(self.hotspots.items(), key=lambda item: item[1]['total_seconds'], reverse=True)
+
+        return {
+            'enabled': self.running,
+            'interval_seconds': self.interval,
+            'threshold_seconds': self.threshold,
+            'beats': self.beats,
+            'avg_lag_seconds': round(self.total_lag / self.beats, 4) if self.beats else 0,
+            'max_lag_seconds': round(self.max_lag, 3),
+            'blocks': len(self.blocks),
+            'hotspots': [
+                {'top': top, 'count': hotspot['count'], 'total_seconds': round(hotspot['total_seconds'], 3)}
+                for top, hotspot in hotspots[:20]
+            ],
+            'recent_blocks': list(self.blocks)[::-1],
+        }
+
+
+loop_monitor = LoopMonitor(globals.LOOP_MONITOR_INTERVAL, globals.LOOP_BLOCK_THRESHOLD, globals.LOOP_BLOCK_SAMPLES)
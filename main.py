@@ -1,10 +1,10 @@
 import os
-from typing import Annotated
 from copy import deepcopy
+from typing import Annotated
 import asyncio
 
 from fastapi import FastAPI, Request, Form, Response, status
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, StreamingResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
@@ -14,8 +14,26 @@ from globals import log, filter_log
 
 from functions import repo_build, repo_deploy, repo_healthcheck, repo_check
 from git_functions import git_clone, git_pull, get_remote_hash
-from docker_functions import docker_container_action, docker_container_inspect, docker_container_get_logs, docker_container_list, docker_image_action, docker_image_list
-from config import CONFIG_FILE_REPO_STRUCT, scheduler, write_and_reload_config_file, configuration
+from docker_functions import docker_container_action, docker_container_inspect, docker_container_inspect_many, docker_container_get_logs, docker_container_list, docker_image_action, docker_image_list
+from state_cache import state_cache
+from state_store import state_store
+from history_db import history
+from loop_monitor import loop_monitor
+import history_db
+import event_watcher
+import log_followers
+import pipeline
+import check_queue
+import scheduling
+import image_gc
+import metrics
+from check_queue import request_check
+from hash_discovery import remote_hashes
+import build_cache
+import bluegreen
+import health_monitor
+from pipeline import stage, build_stage, repo_lock
+from config import CONFIG_FILE_REPO_STRUCT, scheduler, write_and_reload_config_file, configuration, watch_config_file
 
 
 app = FastAPI()
@@ -23,11 +41,38 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 
 trusted_host = os.getenv("TRUSTED_HOST", "*")
 app.add_middleware(TrustedHostMiddleware, allowed_hosts=[trusted_host])
+app.add_middleware(metrics.RequestMetricsMiddleware)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    loop_monitor.stop()
+    await state_store.close()
+
+    if history.enabled:
+        await asyncio.to_thread(history.close)
+
+    await asyncio.to_thread(globals.log_output.close)
 
 @app.on_event("startup")
 async def startup_event():
+    if globals.LOOP_MONITOR:
+        app.state.loop_monitor = loop_monitor.start()
+
+    await asyncio.to_thread(globals.log_output.preload)
+
     configuration()
     scheduler.start()
+    await bluegreen.sync_proxies()
+
+    app.state.health_monitor = asyncio.create_task(health_monitor.supervise())
+    app.state.config_watcher = asyncio.create_task(watch_config_file())
+    app.state.webhook_watcher = asyncio.create_task(scheduling.watch_webhooks())
+
+    if globals.GC_INTERVAL > 0:
+        app.state.image_gc = asyncio.create_task(image_gc.run_periodically())
+
+    if globals.DOCKER_EVENTS:
+        app.state.event_watcher = asyncio.create_task(event_watcher.watch_docker_events())
 
 
 ##  api endpoints
@@ -45,9 +90,7 @@ async def webhook_repo_check(name, response: Response):
         response.status_code = status.HTTP_400_BAD_REQUEST
         return {'message': 'Repository not found'}
     
-    asyncio.create_task(
-        repo_check(name)
-    )
+    request_check(name, source='webhook')
     return {'message': 'Webhook received'}
 
 #   repo
@@ -57,7 +100,8 @@ async def api_repo_clone(payload: dict, response: Response):
     name = payload['name']
 
     try:
-        await git_clone(name)
+        async with repo_lock(name), stage('network'):
+            await git_clone(name)
         return {'message': 'OK'}
     except Exception as e:
         response.status_code = status.HTTP_400_BAD_REQUEST
@@ -66,14 +110,16 @@ async def api_repo_clone(payload: dict, response: Response):
 @app.post("/api/repo/pull")
 async def api_repo_pull(payload: dict):
     name = payload['name']
-    await git_pull(name)
+    async with repo_lock(name), stage('network'):
+        await git_pull(name)
 
     return {'message': 'OK'}
 
 @app.post("/api/repo/build")
 async def api_repo_build(payload: dict):
     name = payload['name']
-    await repo_build(name)
+    async with repo_lock(name), build_stage(name):
+        await repo_build(name)
 
     return {'message': 'OK'}
 
@@ -81,7 +127,8 @@ async def api_repo_build(payload: dict):
 async def api_repo_deploy(payload: dict):
     name = payload['name']
     tag = payload.get('tag', None)
-    await repo_deploy(name, deploy_version=tag)
+    async with repo_lock(name), stage('deploy'):
+        await repo_deploy(name, deploy_version=tag)
 
     return {'message': 'OK'}
 
@@ -93,6 +140,42 @@ async def api_repo_get_logs(payload: dict):
 
     return output
 
+@app.get("/api/repo/stream_logs")
+async def api_repo_stream_logs(request: Request, name: str, line_num: int = 100):
+    if name not in globals.config_data['repos']:
+        return Response(status_code=status.HTTP_404_NOT_FOUND)
+
+    buffer = globals.log_output.get(name, create=True)
+    return sse_log_response(request, buffer, line_num)
+
+@app.get("/api/repo/health/{name}")
+async def api_repo_health(name, response: Response):
+    if name not in globals.config_data['repos']:
+        response.status_code = status.HTTP_404_NOT_FOUND
+        return {'message': 'Repository not found'}
+
+    return health_monitor.get(name).to_json()
+
+@app.get("/api/repo/history/{name}")
+async def api_repo_history(name, response: Response, kind: str = 'builds', before: int = None, since: str = None, limit: int = 50):
+    if not history.enabled:
+        response.status_code = status.HTTP_404_NOT_FOUND
+        return {'message': 'History database is disabled'}
+
+    limit = min(limit, 500)
+
+    try:
+        rows = await history.page(kind, name, before=before, since=since, limit=limit)
+    except ValueError as e:
+        response.status_code = status.HTTP_400_BAD_REQUEST
+        return {'message': str(e)}
+
+    return {'rows': rows, 'next': rows[-1]['id'] if len(rows) == limit else None}
+
+@app.post("/api/gc")
+async def api_gc():
+    return await image_gc.collect()
+
 #   container
 
 @app.post("/api/container/action/{action}")
@@ -127,6 +210,59 @@ async def api_container_get_logs(payload: dict):
     output = await docker_container_get_logs(container_id, num_of_lines)
     return output
 
+@app.get("/api/container/stream_logs")
+async def api_container_stream_logs(request: Request, id: str, line_num: int = 100):
+    follower = log_followers.subscribe(id)
+
+    return sse_log_response(request, follower.buffer, line_num, on_close=lambda: log_followers.unsubscribe(follower))
+
+#   log streaming
+
+def sse_event(cursor, lines):
+    # one data field per line, a multi-line log message would otherwise end its field at the first newline
+    data = "".join("data: " + part + "\n" for line in lines for part in line.replace("\r", "").split("\n"))
+    return f"id: {cursor}\n{data}\n"
+
+def sse_log_response(request, buffer, num_of_lines, on_close=None):
+    # resumed connections send the last seen cursor as Last-Event-ID
+    last_event_id = request.headers.get('last-event-id')
+    cursor = int(last_event_id) if last_event_id and last_event_id.isdigit() else None
+
+    async def events():
+        nonlocal cursor
+
+        try:
+            resumed = cursor is not None and cursor <= buffer.next_seq
+            if resumed:
+                lines, cursor = buffer.since(cursor)
+            else:
+                lines, cursor = buffer.tail(num_of_lines), buffer.next_seq
+
+            while True:
+                if not resumed:
+                    # a follower that just started may deliver its whole backlog at once
+                    lines = lines[-num_of_lines:]
+                    resumed = bool(lines)
+
+                if lines:
+                    yield sse_event(cursor, lines)
+
+                try:
+                    await buffer.wait(cursor, timeout=15)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+
+                lines, cursor = buffer.since(cursor)
+        finally:
+            if on_close:
+                on_close()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 #   images
 
 @app.post("/api/image/action/{action}")
@@ -147,17 +283,70 @@ async def api_image_action(action, payload: dict, response: Response):
         response.status_code = status.HTTP_400_BAD_REQUEST
         return {'message': e}
 
+#   internal
+
+@app.get("/internal/cache")
+async def internal_cache():
+    return state_cache.stats()
+
+@app.get("/internal/pipeline")
+async def internal_pipeline():
+    return pipeline.stats() | {'checks': check_queue.stats(), 'remote_hashes': remote_hashes.stats(), 'schedule': scheduling.stats()}
+
+@app.get("/internal/state")
+async def internal_state():
+    return state_store.stats()
+
+@app.get("/internal/build_cache")
+async def internal_build_cache():
+    return build_cache.stats()
+
+@app.get("/internal/logs")
+async def internal_logs():
+    return globals.log_output.stats()
+
+@app.get("/internal/log_followers")
+async def internal_log_followers():
+    return log_followers.stats()
+
+@app.get("/internal/events")
+async def internal_events():
+    return event_watcher.status
+
+@app.get("/internal/health")
+async def internal_health():
+    return health_monitor.stats()
+
+@app.get("/internal/gc")
+async def internal_gc():
+    return image_gc.status
+
+@app.get("/internal/blue_green")
+async def internal_blue_green():
+    return bluegreen.stats()
+
+@app.get("/internal/loop")
+async def internal_loop():
+    return loop_monitor.stats()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 ## dashboard
 
 templates = Jinja2Templates(directory="templates")
 
 @app.get("/", response_class=HTMLResponse)
 async def dash_index(request: Request):
-    content = deepcopy(globals.config_data['repos'])
-    
-    for name, repo in globals.config_data['repos'].items():
-        raw_output, inspect_output = await docker_container_inspect(name)
-        content[name]['inspect'] = inspect_output
+    repos = globals.config_data['repos']
+    containers = {name: bluegreen.container_name(name) for name in repos}
+    inspect_outputs = await docker_container_inspect_many(containers.values())
+
+    content = {
+        name: repo | {'inspect': inspect_outputs[containers[name]]}
+        for name, repo in repos.items()
+    }
 
     return templates.TemplateResponse(
         request=request, name="index.html", 
@@ -170,7 +359,7 @@ async def dash_index(request: Request):
 @app.get("/repo/{name}", response_class=HTMLResponse)
 async def dash_repo_details(name, request: Request):
     repo = globals.config_data['repos'].get(name, None)
-    raw_container_output, container = await docker_container_inspect(name)
+    raw_container_output, container = await docker_container_inspect(bluegreen.container_name(name))
     images = await docker_image_list(name)
 
     return templates.TemplateResponse(
@@ -180,10 +369,32 @@ async def dash_repo_details(name, request: Request):
             "repo": repo,
             "container": container,
             "images": images,
+            "health": health_monitor.get(name).state() if name in health_monitor.repos else 'unknown',
+            "sparkline": health_monitor.sparkline(name),
             "HOST_ADDRESS": globals.config_data['host_address']
             }
     )
 
+@app.get("/repo/{name}/history", response_class=HTMLResponse)
+async def dash_repo_history(name, request: Request, kind: str = 'builds', before: int = None):
+    if kind not in history_db.TABLES:
+        kind = 'builds'
+
+    rows = await history.page(kind, name, before=before) if history.enabled else []
+
+    return templates.TemplateResponse(
+        request=request, name="history.html",
+        context={
+            "name": name,
+            "kind": kind,
+            "kinds": history_db.TABLES,
+            "enabled": history.enabled,
+            "rows": rows,
+            "before": before,
+            "next": rows[-1]['id'] if len(rows) == 50 else None,
+            }
+    )
+
 @app.get("/repo/edit/{name}", response_class=HTMLResponse)
 async def dash_repo_save(name, request: Request):
     if name != 'new_repo_config':
@@ -214,7 +425,8 @@ async def dash_repo_save(
 
     name = name.strip()
 
-    content = CONFIG_FILE_REPO_STRUCT
+    # settings without a form field are kept, the defaults are copied and not mutated
+    content = deepcopy(globals.config_data['repos'].get(name, CONFIG_FILE_REPO_STRUCT))
     content['repo_url'] = repo_url
     content['branch'] = branch
     content['interval'] = interval
@@ -226,6 +438,7 @@ async def dash_repo_save(
 
     globals.config_data['repos'][name] = content
     write_and_reload_config_file()
+    await bluegreen.sync_proxies()
 
     return RedirectResponse(url=f"/repo/{name}", status_code=status.HTTP_302_FOUND)
 
@@ -233,6 +446,7 @@ async def dash_repo_save(
 async def dash_repo_delete(name):
     globals.config_data['repos'].pop(name, None)
     write_and_reload_config_file()
+    await bluegreen.sync_proxies()
 
     return RedirectResponse(url="/", status_code=status.HTTP_302_FOUND)
 
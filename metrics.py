@@ -0,0 +1,200 @@
+import os
+import time
+import bisect
+import threading
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+
+def format_labels(names, values, extra=()):
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{value}"' for name, value in extra]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_value(value):
+    return repr(float(value)) if value != float('inf') else '+Inf'
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+        # all observations come from the event loop today, the lock keeps a thread observing safe
+        self.lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in sorted(self.values.items()):
+            yield f"{self.name}{format_labels(self.labels, labels)} {format_value(value)}"
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.values = {}  # labels: [bucket counts..., +Inf count, sum]
+        self.lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+
+        with self.lock:
+            counts = self.values.get(labels)
+            if counts is None:
+                counts = self.values[labels] = [0] * (len(self.buckets) + 2)
+            counts[index] += 1
+            counts[-1] += value
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+
+        for labels, counts in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield f"{self.name}_bucket{format_labels(self.labels, labels, [('le', format_value(bound))])} {cumulative}"
+
+            yield f"{self.name}_sum{format_labels(self.labels, labels)} {format_value(counts[-1])}"
+            yield f"{self.name}_count{format_labels(self.labels, labels)} {cumulative}"
+
+
+registry = []
+
+
+def counter(name, help, labels=()):
+    metric = Counter(name, help, labels)
+    registry.append(metric)
+    return metric
+
+
+def histogram(name, help, labels=(), buckets=DEFAULT_BUCKETS):
+    metric = Histogram(name, help, labels, buckets)
+    registry.append(metric)
+    return metric
+
+
+def render():
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+##  metrics
+
+stage_seconds = histogram(
+    'autodock_stage_duration_seconds', "Duration of repo_check stages.", ('stage', 'status')
+)
+subprocess_spawns = counter(
+    'autodock_subprocess_spawns_total', "Subprocesses started, by command family.", ('family',)
+)
+subprocess_seconds = histogram(
+    'autodock_subprocess_duration_seconds', "Subprocess run time, by command family.", ('family', 'status')
+)
+scheduler_lag = histogram(
+    'autodock_scheduler_lag_seconds', "Delay between the planned and the actual start of scheduled jobs.", (),
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+)
+http_request_seconds = histogram(
+    'autodock_http_request_duration_seconds', "Request latency of the web app, by route.", ('method', 'route', 'status'),
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+)
+loop_lag = histogram(
+    'autodock_event_loop_lag_seconds', "How late the loop monitor heartbeat ran, only with LOOP_MONITOR=1.", (),
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+)
+
+##  helpers
+
+FAMILY_PROGRAMS = ('git', 'docker')
+
+
+def command_family(cmd):
+    """'git -C /repo ls-remote ...' -> 'git ls-remote', other programs are reported by name only."""
+    tokens = cmd.split()
+    if not tokens:
+        return 'unknown'
+
+    program = os.path.basename(tokens[0])
+    if program not in FAMILY_PROGRAMS:
+        return program
+
+    skip = False
+    for token in tokens[1:]:
+        if skip:
+            skip = False
+        elif token in ('-C', '-c', '--context', '-H', '--host'):
+            skip = True  # option with a separate value
+        elif not token.startswith('-'):
+            return f"{program} {token}"
+
+    return program
+
+
+class timed_subprocess:
+    """Counts the spawn of `cmd` and observes its run time, as a sync or async context manager."""
+
+    def __init__(self, cmd):
+        self.family = command_family(cmd)
+
+    def __enter__(self):
+        subprocess_spawns.inc(self.family)
+        self.started = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        subprocess_seconds.observe(time.monotonic() - self.started, self.family, 'failed' if exc_type else 'ok')
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        self.__exit__(exc_type, exc, traceback)
+
+
+class RequestMetricsMiddleware:
+    """ASGI middleware observing the time until the response headers are sent, labeled with the route
+    template instead of the path so that /repo/{name} stays one series. Streamed responses (log
+    followers) are therefore measured to their first byte, not to their end."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        started = time.monotonic()
+        observed = False
+
+        def observe(status):
+            route = scope.get('route')
+            http_request_seconds.observe(time.monotonic() - started, scope['method'], getattr(route, 'path', 'unmatched'), status)
+
+        async def timed_send(message):
+            nonlocal observed
+            if message['type'] == 'http.response.start' and not observed:
+                observed = True
+                observe(str(message['status']))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, timed_send)
+        finally:
+            if not observed:
+                observe('500')  # raised through to the server error handler
@@ -0,0 +1,104 @@
+import time
+import asyncio
+from contextlib import asynccontextmanager
+
+import globals
+
+
+class StagePool:
+    """Concurrency limit for one kind of pipeline stage, waiters are served in arrival order."""
+
+    def __init__(self, name, limit):
+        self.name = name
+        self.limit = limit
+        self.semaphore = asyncio.Semaphore(limit)
+
+        self.waiting = 0
+        self.running = 0
+        self.completed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.last_wait = 0.0
+
+    @asynccontextmanager
+    async def slot(self):
+        started = time.monotonic()
+        self.waiting += 1
+
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.waiting -= 1
+
+        wait = time.monotonic() - started
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        self.last_wait = wait
+        self.running += 1
+
+        try:
+            yield
+        finally:
+            self.running -= 1
+            self.completed += 1
+            self.semaphore.release()
+
+    def stats(self):
+        return {
+            'limit': self.limit,
+            'queue_depth': self.waiting,
+            'running': self.running,
+            'completed': self.completed,
+            'avg_wait_seconds': round(self.total_wait / self.completed, 3) if self.completed else 0,
+            'max_wait_seconds': round(self.max_wait, 3),
+            'last_wait_seconds': round(self.last_wait, 3),
+        }
+
+
+pools = {
+    'network': StagePool('network', globals.PIPELINE_NETWORK_CONCURRENCY),
+    # one builder limit for legacy and buildkit builds, both compete for the same cpu and disk
+    'build': StagePool('build', globals.PIPELINE_BUILD_CONCURRENCY),
+    'deploy': StagePool('deploy', globals.PIPELINE_DEPLOY_CONCURRENCY),
+}
+
+repo_locks = {}
+
+
+def stage(pool_name):
+    return pools[pool_name].slot()
+
+
+def build_stage(name):
+    return stage('build')
+
+
+@asynccontextmanager
+async def stage_timeout(name, stage_name):
+    # cancels the stage, run_process kills the process group of whatever it was running
+    seconds = globals.config_data['repos'][name].get('stage_timeouts', {}).get(stage_name) or None
+
+    timeout = asyncio.timeout(seconds)
+
+    try:
+        async with timeout:
+            yield
+    except TimeoutError:
+        if timeout.expired():
+            raise TimeoutError(f"{stage_name} stage timed out after {seconds} seconds")
+        raise
+
+
+def repo_lock(name):
+    # one pipeline (or manual stage) per repo at a time
+    if name not in repo_locks:
+        repo_locks[name] = asyncio.Lock()
+
+    return repo_locks[name]
+
+
+def stats():
+    return {
+        'pools': {name: pool.stats() for name, pool in pools.items()},
+        'busy_repos': [name for name, lock in repo_locks.items() if lock.locked()],
+    }
@@ -0,0 +1,177 @@
+import time
+import random
+import asyncio
+from datetime import datetime, timedelta
+
+import globals
+import metrics
+
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.triggers.interval import IntervalTrigger
+from apscheduler.events import EVENT_JOB_SUBMITTED
+
+
+scheduler = AsyncIOScheduler()
+
+
+def job_id(name):
+    return f"repo_check_periodic_task_{name}"
+
+
+def record_lag(event):
+    # submitted means the job was handed to the loop, the coroutine itself may still wait for it
+    now = datetime.now(event.scheduled_run_times[-1].tzinfo)
+    for run_time in event.scheduled_run_times:
+        metrics.scheduler_lag.observe(max((now - run_time).total_seconds(), 0))
+
+
+scheduler.add_listener(record_lag, EVENT_JOB_SUBMITTED)
+
+##  rate limit
+
+class TokenBucket:
+    """Allows `rate` acquisitions per second on average with bursts of up to `burst`."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+        self.acquired = 0
+        self.delayed = 0
+        self.total_delay = 0.0
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        self.acquired += 1
+
+        if self.rate <= 0:
+            return
+
+        self.refill()
+        # reserve a token now, waiters are served in the order they arrived
+        self.tokens -= 1
+
+        if self.tokens < 0:
+            delay = -self.tokens / self.rate
+            self.delayed += 1
+            self.total_delay += delay
+            await asyncio.sleep(delay)
+
+    def stats(self):
+        self.refill()
+        return {
+            'rate': self.rate,
+            'burst': self.burst,
+            'tokens': round(self.tokens, 2),
+            'acquired': self.acquired,
+            'delayed': self.delayed,
+            'total_delay_seconds': round(self.total_delay, 3),
+        }
+
+
+check_rate = TokenBucket(globals.SCHEDULE_MAX_CHECKS_PER_SECOND, globals.SCHEDULE_CHECK_BURST)
+
+##  adaptive intervals
+
+class RepoSchedule:
+    def __init__(self):
+        self.factor = 1
+        self.unchanged = 0
+        self.last_change = None
+        self.last_webhook = None
+
+
+schedules = {}
+
+
+def get(name):
+    if name not in schedules:
+        schedules[name] = RepoSchedule()
+    return schedules[name]
+
+
+def trigger(name, repo):
+    interval = repo['interval'] * get(name).factor
+    # jitter keeps repos with the same interval from staying in phase
+    return IntervalTrigger(seconds=interval, jitter=max(1, int(interval * globals.SCHEDULE_JITTER)))
+
+
+def first_run_time(repo):
+    # spread the first checks instead of running every repo at startup
+    spread = min(repo['interval'], globals.SCHEDULE_START_SPREAD)
+    return datetime.now() + timedelta(seconds=random.uniform(0, spread))
+
+
+def wanted_factor(schedule):
+    if schedule.last_webhook and time.monotonic() - schedule.last_webhook < globals.SCHEDULE_WEBHOOK_QUIET:
+        # webhooks report changes, polling is only a fallback
+        return globals.SCHEDULE_MAX_BACKOFF
+
+    return min(2 ** (schedule.unchanged // globals.SCHEDULE_BACKOFF_AFTER), globals.SCHEDULE_MAX_BACKOFF)
+
+
+def apply(name):
+    repo = globals.config_data['repos'].get(name)
+    schedule = get(name)
+    factor = wanted_factor(schedule)
+
+    if repo is None or repo['interval'] <= 0 or factor == schedule.factor or not scheduler.get_job(job_id(name)):
+        return
+
+    schedule.factor = factor
+    scheduler.reschedule_job(job_id(name), trigger=trigger(name, repo))
+
+    globals.log(f"Polling every {repo['interval'] * factor} seconds.", keyword=name)
+
+
+def record_check(name, changed):
+    schedule = get(name)
+
+    if changed:
+        schedule.unchanged = 0
+        schedule.last_change = time.monotonic()
+    else:
+        schedule.unchanged += 1
+
+    apply(name)
+
+
+def record_webhook(name):
+    get(name).last_webhook = time.monotonic()
+    apply(name)
+
+
+async def watch_webhooks():
+    # tighten the polling of repos whose webhooks went quiet
+    while True:
+        await asyncio.sleep(60)
+
+        for name, schedule in list(schedules.items()):
+            if schedule.last_webhook and time.monotonic() - schedule.last_webhook >= globals.SCHEDULE_WEBHOOK_QUIET:
+                schedule.last_webhook = None
+                schedule.unchanged = 0
+                apply(name)
+
+
+def reset(name):
+    schedules.pop(name, None)
+
+
+def stats():
+    return {
+        'check_rate': check_rate.stats(),
+        'repos': {
+            name: {
+                'factor': schedule.factor,
+                'unchanged_checks': schedule.unchanged,
+                'webhook_active': schedule.last_webhook is not None,
+            }
+            for name, schedule in schedules.items()
+        },
+    }
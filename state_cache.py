@@ -0,0 +1,153 @@
+import time
+import asyncio
+from collections import OrderedDict
+
+import globals
+
+
+DEFAULT_TTL = object()  # the cache ttl, or no expiry while live
+
+
+class StateCache:
+    """LRU cache with a TTL for docker state, keyed by (kind, name) tuples."""
+
+    def __init__(self, ttl=5.0, max_size=1024):
+        self.ttl = ttl
+        self.max_size = max_size
+
+        self._entries = OrderedDict()
+        self._pending = {}
+        self._fetches = {}  # key: token of a batch fetch in flight, see begin_fetch
+
+        # while live, entries are kept current by docker events and never expire
+        self.live = False
+
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        entry = self._entries.get(key)
+
+        if entry is None:
+            return False, None
+
+        expires_at, value = entry
+        if expires_at is not None and expires_at < time.monotonic():
+            del self._entries[key]
+            return False, None
+
+        self._entries.move_to_end(key)
+        return True, value
+
+    def set(self, key, value, ttl=DEFAULT_TTL):
+        # ttl None never expires, 0 does not cache at all
+        if ttl is DEFAULT_TTL:
+            ttl = None if self.live else self.ttl
+
+        if ttl is not None and ttl <= 0:
+            self._entries.pop(key, None)
+            return
+
+        self._entries[key] = (time.monotonic() + ttl if ttl is not None else None, value)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def get_or_fetch(self, key, fetch):
+        found, value = self.get(key)
+        if found:
+            self.hits += 1
+            return value
+
+        # concurrent misses for the same key share a single fetch
+        task = self._pending.get(key)
+        if task is not None:
+            self.shared += 1
+            return await asyncio.shield(task)
+
+        self.misses += 1
+        task = asyncio.ensure_future(fetch())
+        self._pending[key] = task
+
+        try:
+            value = await asyncio.shield(task)
+        finally:
+            # only store the result if the key was not invalidated mid-fetch
+            if self._pending.get(key) is task:
+                del self._pending[key]
+                if task.done() and not task.cancelled() and task.exception() is None:
+                    self.set(key, task.result())
+
+        return value
+
+    def begin_fetch(self, keys):
+        """For fetches of many keys at once, the results are stored with finish_fetch unless the
+        key was invalidated (or fetched again) in the meantime."""
+        token = object()
+        for key in keys:
+            self._fetches[key] = token
+        return token
+
+    def finish_fetch(self, key, value, token):
+        if self._fetches.get(key) is not token:
+            return False
+
+        del self._fetches[key]
+        self.set(key, value)
+        return True
+
+    def abandon_fetch(self, keys, token):
+        for key in keys:
+            if self._fetches.get(key) is token:
+                del self._fetches[key]
+
+    def record(self, hit):
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def invalidate(self, *keys):
+        for key in keys:
+            self._entries.pop(key, None)
+            self._pending.pop(key, None)
+            self._fetches.pop(key, None)
+            self.invalidations += 1
+
+    def invalidate_kind(self, kind):
+        keys = [key for key in list(self._entries) + list(self._pending) + list(self._fetches) if key[0] == kind]
+        self.invalidate(*set(keys))
+
+    def set_live(self, live):
+        if self.live and not live:
+            self.clear()
+        self.live = live
+
+    def clear(self):
+        self._entries.clear()
+        self._pending.clear()
+        self._fetches.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'ttl': self.ttl,
+            'live': self.live,
+            'hits': self.hits,
+            'misses': self.misses,
+            'shared': self.shared,
+            'hit_ratio': round(self.hits / lookups, 3) if lookups else None,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+        }
+
+
+state_cache = StateCache(globals.STATE_CACHE_TTL, globals.STATE_CACHE_SIZE)
@@ -0,0 +1,266 @@
+import os
+import re
+import json
+import time
+import asyncio
+
+import globals
+
+
+class StateStore:
+    """repo_data persistence: every save appends the repo's state to a journal, a background
+    compaction rewrites the snapshot atomically and drops the journals it covers.
+
+    Files: the snapshot (the old repo_data.json format, plus the last journal generation it covers)
+    and `<snapshot>.journal.<generation>` with one `{"repo": name, "data": {...}}` line per saved repo."""
+
+    def __init__(self, path, flush_delay=0.05, compact_records=500, compact_interval=300):
+        self.path = path
+        self.flush_delay = flush_delay
+        self.compact_records = compact_records
+        self.compact_interval = compact_interval
+
+        self.loaded = False
+        self.generation = 0
+        self.dirty = set()
+        self.journal_records = 0
+        self.journal_started = time.monotonic()
+
+        self._flush_task = None
+        self._compact_task = None
+        self._lock = None
+        self._loop = None
+
+        self.saves = 0
+        self.flushes = 0
+        self.records_written = 0
+        self.compactions = 0
+        self.last_flush_seconds = 0.0
+        self.last_compaction_seconds = 0.0
+
+    def journal_path(self, generation):
+        return f"{self.path}.journal.{generation}"
+
+    def journal_generations(self):
+        directory, base = os.path.split(self.path)
+        pattern = re.compile(re.escape(base) + r'\.journal\.(\d+)$')
+
+        try:
+            files = os.listdir(directory or '.')
+        except OSError:
+            return []
+
+        return sorted(int(match.group(1)) for match in map(pattern.match, files) if match)
+
+    def lock(self):
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    ##  load
+
+    def load(self):
+        data = globals.read_json_file(self.path) or {}
+        covered = data.pop(COVERED_GENERATION, -1)
+        generations = self.journal_generations()
+
+        # journals the snapshot already covers are left over by a crash during compaction
+        replayed = 0
+        for generation in generations:
+            if generation > covered:
+                replayed += replay_journal(self.journal_path(generation), data)
+
+        if replayed:
+            print(f"STATE: replayed {replayed} journal records")
+
+        self.generation = max(generations + [covered]) + 1
+        self.loaded = True
+
+        # start from a clean snapshot
+        if generations:
+            write_snapshot(self.path, encode_snapshot(data, self.generation - 1))
+            remove_files([self.journal_path(generation) for generation in generations])
+
+        return data
+
+    ##  save
+
+    def save(self, name):
+        self.saves += 1
+        self.dirty.add(name)
+
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            # no event loop (startup, tools), write through
+            self.write_records(self.take_records())
+            return
+
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self.flush(delay=self.flush_delay))
+
+    def take_records(self):
+        records = []
+
+        for name in sorted(self.dirty):
+            if name in globals.repo_data:
+                records.append(json.dumps({'repo': name, 'data': globals.repo_data[name]}, separators=(',', ':')))
+
+        self.dirty.clear()
+        return records
+
+    def write_records(self, records):
+        if not records:
+            return
+
+        append_journal(self.journal_path(self.generation), records)
+
+        self.journal_records += len(records)
+        self.records_written += len(records)
+
+    async def flush(self, delay=0):
+        # saves within `delay` are written together
+        if delay:
+            await asyncio.sleep(delay)
+
+        async with self.lock():
+            # serialised on the loop so the records match the state at this moment
+            records = self.take_records()
+            if not records:
+                return
+
+            started = time.perf_counter()
+            await asyncio.to_thread(append_journal, self.journal_path(self.generation), records)
+            self.last_flush_seconds = time.perf_counter() - started
+
+            self.journal_records += len(records)
+            self.records_written += len(records)
+            self.flushes += 1
+
+        if self.journal_records >= self.compact_records or time.monotonic() - self.journal_started >= self.compact_interval:
+            if self._compact_task is None or self._compact_task.done():
+                self._compact_task = asyncio.create_task(self.compact())
+
+    ##  compaction
+
+    async def compact(self):
+        async with self.lock():
+            started = time.perf_counter()
+
+            # everything saved so far is in the snapshot, later saves go to the next journal
+            snapshot = encode_snapshot(globals.repo_data, self.generation)
+            covered = [self.journal_path(generation) for generation in self.journal_generations() if generation <= self.generation]
+
+            self.dirty.clear()
+            self.generation += 1
+            self.journal_records = 0
+            self.journal_started = time.monotonic()
+
+            await asyncio.to_thread(write_snapshot, self.path, snapshot)
+            await asyncio.to_thread(remove_files, covered)
+
+            self.compactions += 1
+            self.last_compaction_seconds = time.perf_counter() - started
+
+    async def close(self):
+        if self._flush_task and not self._flush_task.done():
+            self._flush_task.cancel()
+
+        await self.flush()
+        await self.compact()
+
+    def stats(self):
+        return {
+            'generation': self.generation,
+            'dirty': len(self.dirty),
+            'journal_records': self.journal_records,
+            'saves': self.saves,
+            'flushes': self.flushes,
+            'records_written': self.records_written,
+            'compactions': self.compactions,
+            'last_flush_ms': round(self.last_flush_seconds * 1000, 3),
+            'last_compaction_ms': round(self.last_compaction_seconds * 1000, 3),
+        }
+
+##  files
+
+# snapshot key of the last journal generation the snapshot includes
+COVERED_GENERATION = '__journal_generation__'
+
+
+def encode_snapshot(data, covered_generation):
+    # without indent json uses its C encoder, this part runs on the loop
+    return json.dumps(data | {COVERED_GENERATION: covered_generation}, separators=(',', ':'))
+
+
+def write_snapshot(path, content):
+    temp_path = f"{path}.tmp"
+
+    with open(temp_path, 'w') as file:
+        file.write(content)
+        file.flush()
+        os.fsync(file.fileno())
+
+    os.replace(temp_path, path)
+    fsync_directory(path)
+
+
+def append_journal(path, records):
+    with open(path, 'a') as file:
+        file.write('\n'.join(records) + '\n')
+        file.flush()
+        os.fsync(file.fileno())
+
+
+def replay_journal(path, data):
+    replayed = 0
+
+    try:
+        with open(path) as file:
+            lines = file.read().splitlines()
+    except OSError:
+        return 0
+
+    for line in lines:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            # a record torn by a crash, nothing after it was acknowledged
+            break
+
+        data[record['repo']] = record['data']
+        replayed += 1
+
+    return replayed
+
+
+def remove_files(paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def fsync_directory(path):
+    try:
+        fd = os.open(os.path.dirname(path) or '.', os.O_RDONLY)
+    except OSError:
+        return
+
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+state_store = StateStore(
+    globals.REPO_DATA_FILE_PATH,
+    flush_delay=globals.STATE_FLUSH_DELAY,
+    compact_records=globals.STATE_COMPACT_RECORDS,
+    compact_interval=globals.STATE_COMPACT_INTERVAL
+)
@@ -49,20 +49,39 @@ function humanizeDate(dateString) {
     }
 }
 
-async function fill_log_output(url, context, box_selector){
+function fill_log_output(url, context, box_selector){
+    // streams new lines over server-sent events and appends them to the box
     const element = document.querySelector(box_selector);
-    const isNearBottom = element.scrollHeight - element.scrollTop - element.clientHeight < 50;
+    const max_lines = parseInt(context['line_num']) || 100;
+    let total_lines = 0;
 
-    try {
-        const result = await apiCall(url, context);
-        element.textContent = result;
-    } catch (error) {
-        element.textContent = 'Error: ' + error.message;
+    if (element.logSource) {
+        element.logSource.close();
     }
+    element.textContent = '';
 
-    if (isNearBottom) {
-        element.scrollTop = element.scrollHeight;
-    }
+    const source = new EventSource(url + '?' + new URLSearchParams(context));
+    element.logSource = source;
+
+    source.onmessage = function(event) {
+        const isNearBottom = element.scrollHeight - element.scrollTop - element.clientHeight < 50;
+
+        const node = document.createTextNode(event.data + '\n');
+        node.lineCount = event.data.split('\n').length;
+        element.appendChild(node);
+        total_lines += node.lineCount;
+
+        while (element.firstChild && total_lines - element.firstChild.lineCount >= max_lines) {
+            total_lines -= element.firstChild.lineCount;
+            element.removeChild(element.firstChild);
+        }
+
+        if (isNearBottom) {
+            element.scrollTop = element.scrollHeight;
+        }
+    };
+
+    return source;
 }
 
 // 
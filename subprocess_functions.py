@@ -1,45 +1,199 @@
 import os, subprocess
+import time
+import codecs
+import signal
+import inspect
 import asyncio
+import contextvars
+from contextlib import contextmanager
 
-def run_command(cmd, cwd='/'):
+import globals
+from metrics import timed_subprocess
+
+##  resource accounting
+
+class ProcessUsage:
+    """Resources of the processes run within track_usage(), cpu and memory as reported by wait4."""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.ended = None
+        self.processes = 0
+        self.process_seconds = 0.0
+        self.user_cpu = 0.0
+        self.system_cpu = 0.0
+        self.max_rss = 0
+
+    def add(self, seconds, rusage):
+        self.processes += 1
+        self.process_seconds += seconds
+        if rusage:
+            self.user_cpu += rusage.ru_utime
+            self.system_cpu += rusage.ru_stime
+            self.max_rss = max(self.max_rss, rusage.ru_maxrss * 1024)
+
+    def to_json(self):
+        return {
+            'wall_seconds': round((self.ended or time.monotonic()) - self.started, 3),
+            'processes': self.processes,
+            'process_seconds': round(self.process_seconds, 3),
+            'user_cpu_seconds': round(self.user_cpu, 3),
+            'system_cpu_seconds': round(self.system_cpu, 3),
+            'max_rss_bytes': self.max_rss,
+        }
+
+process_usage = contextvars.ContextVar('process_usage', default=None)
+
+@contextmanager
+def track_usage():
+    # tasks created inside inherit the context, and with it this collector
+    usage = ProcessUsage()
+    token = process_usage.set(usage)
+    try:
+        yield usage
+    finally:
+        usage.ended = time.monotonic()
+        process_usage.reset(token)
+
+##  supervised processes
+
+async def wait_process(pid):
+    # reaps the process itself, unlike asyncio's child watcher this keeps its rusage
+    loop = asyncio.get_running_loop()
+
+    try:
+        pidfd = os.pidfd_open(pid)
+    except (AttributeError, OSError):
+        return await loop.run_in_executor(None, os.wait4, pid, 0)
+
+    exited = loop.create_future()
+    loop.add_reader(pidfd, lambda: exited.done() or exited.set_result(None))
+    try:
+        await exited
+    finally:
+        loop.remove_reader(pidfd)
+        os.close(pidfd)
+
+    return os.wait4(pid, 0)
+
+async def kill_process_group(pid):
+    # the shell and everything it started share the process group
+    for sig, grace in ((signal.SIGTERM, globals.PROCESS_KILL_GRACE), (signal.SIGKILL, None)):
+        try:
+            os.killpg(pid, sig)
+        except ProcessLookupError:
+            pass
+
+        try:
+            return await asyncio.wait_for(asyncio.shield(reaper(pid)), grace)
+        except asyncio.TimeoutError:
+            print(f"SUBPROCESS: process group {pid} ignored SIGTERM, killing")
+
+reapers = {}
+
+def reaper(pid):
+    # one wait per pid, shared by the normal exit path and the kill path
+    if pid not in reapers:
+        reapers[pid] = asyncio.ensure_future(wait_process(pid))
+        reapers[pid].add_done_callback(lambda _: reapers.pop(pid, None))
+    return reapers[pid]
+
+async def run_process(cmd, cwd='/', callback=None, batch_callback=None, timeout=None, check=True, merge_stderr=True):
+    """Runs cmd in its own process group, streaming its output. On timeout or cancellation the whole
+    group is terminated (SIGKILL after PROCESS_KILL_GRACE). Returns the exit code."""
+    loop = asyncio.get_running_loop()
+
+    async with timed_subprocess(cmd):
+        started = time.monotonic()
+        process = subprocess.Popen(
+            cmd,
+            shell=True,
+            cwd=cwd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT if merge_stderr else subprocess.DEVNULL,
+            start_new_session=True
+        )
+
+        reader = asyncio.StreamReader()
+        transport, _ = await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), process.stdout)
+
+        try:
+            async with asyncio.timeout(timeout):
+                await stream_lines(reader, callback, batch_callback)
+                _, status, rusage = await asyncio.shield(reaper(process.pid))
+        except BaseException:
+            _, status, rusage = await kill_process_group(process.pid) or (None, None, None)
+            raise
+        finally:
+            transport.close()
+            # reaped here, the Popen object must not wait for it again
+            process.returncode = os.waitstatus_to_exitcode(status) if status is not None else -signal.SIGKILL
+
+            usage = process_usage.get()
+            if usage:
+                usage.add(time.monotonic() - started, rusage)
+
+        if check and process.returncode != 0:
+            raise subprocess.CalledProcessError(process.returncode, cmd)
+
+    return process.returncode
+
+async def run_command(cmd, cwd='/', timeout=None):
     print(f"SUBPROCESS: Running: {cmd}")
-    result = subprocess.run(cmd, shell=True, cwd=cwd, check=True, text=True)
-    if result.returncode != 0:
-        raise Exception(f"SUBPROCESS: {cmd} failed: {result.stderr}")
+    await run_process(cmd, cwd, callback=print, timeout=timeout or globals.COMMAND_TIMEOUT)
 
-def check_output(cmd, cwd='/'):
+async def check_output(cmd, cwd='/', timeout=None):
     print(f"SUBPROCESS: Checking output from: {cmd}")
-    result = subprocess.check_output(cmd, shell=True, cwd=cwd, text=True, timeout=60, stderr=subprocess.STDOUT)
-    
+    try:
+        lines = []
+        await run_process(cmd, cwd, batch_callback=lines.extend, timeout=timeout or globals.COMMAND_TIMEOUT)
+    except subprocess.CalledProcessError as e:
+        e.output = '\n'.join(lines)
+        raise
+
+    result = '\n'.join(lines)
+    return result if result else None
+
+async def read_output(cmd, cwd='/', timeout=None):
+    print(f"SUBPROCESS: Reading output from: {cmd}")
+    lines = []
+    await run_process(cmd, cwd, batch_callback=lines.extend, timeout=timeout or globals.COMMAND_TIMEOUT, check=False, merge_stderr=False)
+
+    result = '\n'.join(lines)
+
     return result if result else None
 
-async def poll_output(cmd, cwd='/', callback=None):
+async def poll_output(cmd, cwd='/', callback=None, batch_callback=None, check=True, timeout=None):
     print(f"SUBPROCESS: Polling output from: {cmd}")
-    
-    process = await asyncio.create_subprocess_shell(
-        cmd,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.STDOUT,
-        cwd=cwd
-    )
-    
-    try:
-        while True:
-            try:
-                line = await asyncio.wait_for(process.stdout.readline(), timeout=0.1)
-            except asyncio.TimeoutError:
-                if process.returncode is not None:
-                    break
-                continue
-                
-            if not line:
-                break
-                
-            line = line.decode().strip()
+
+    return await run_process(cmd, cwd, callback, batch_callback, timeout=timeout, check=check)
+
+async def stream_lines(stream, callback=None, batch_callback=None, chunk_size=65536):
+    # lines are delivered once per chunk read; an async batch_callback is awaited before
+    # reading further, so a slow consumer fills the pipe and pauses the process
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    partial = ''
+
+    while True:
+        chunk = await stream.read(chunk_size)
+        text = partial + decoder.decode(chunk, final=not chunk)
+
+        lines = text.split('\n')
+        partial = lines.pop()
+
+        if not chunk and partial:
+            lines.append(partial)
+
+        lines = [line.rstrip() for line in lines]
+
+        if lines:
+            if batch_callback:
+                result = batch_callback(lines)
+                if inspect.isawaitable(result):
+                    await result
             if callback:
-                callback(line)
-                
-    except Exception as e:
-        print(f"Error reading output: {e}")
-    finally:
-        await process.wait()
\ No newline at end of file
+                for line in lines:
+                    callback(line)
+
+        if not chunk:
+            break
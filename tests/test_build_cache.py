@@ -0,0 +1,102 @@
+import os
+import sys
+import asyncio
+from copy import deepcopy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import globals
+import build_cache
+from build_cache import compile_pattern
+from config import CONFIG_FILE_REPO_STRUCT
+
+
+def test_only_a_leading_bang_negates_a_character_class():
+    assert compile_pattern('file[!a].txt').fullmatch('fileb.txt')
+    assert not compile_pattern('file[!a].txt').fullmatch('filea.txt')
+
+    assert compile_pattern('file[a!].txt').fullmatch('file!.txt')
+    assert not compile_pattern('file[a!].txt').fullmatch('file^.txt')
+
+
+def configure(tmp_path, monkeypatch, dockerignore=None, build_context_globs=()):
+    monkeypatch.setattr(globals, 'REPO_DATA_PATH', str(tmp_path))
+    (tmp_path / 'app').mkdir()
+    if dockerignore is not None:
+        (tmp_path / 'app' / '.dockerignore').write_text(dockerignore)
+
+    repo = deepcopy(CONFIG_FILE_REPO_STRUCT)
+    repo['build_context_globs'] = list(build_context_globs)
+    globals.config_data = {'repos': {'app': repo}}
+
+
+def test_dockerignore_patterns_and_exceptions(tmp_path, monkeypatch):
+    configure(tmp_path, monkeypatch, "# docs\n**/*.md\n!README.md\n/tests\nbuild/*.log\n")
+    repo_dir, ignore_patterns, include_patterns = build_cache.context_matchers('app')
+
+    def included(path):
+        return build_cache.in_build_context(path, ignore_patterns, include_patterns)
+
+    assert not included('docs/guide.md')
+    assert not included('CHANGELOG.md')
+    assert included('README.md')
+    assert not included('tests/test_app.py')
+    assert included('src/tests.py')
+    assert not included('build/output.log')
+    assert included('build/nested/output.log')
+
+
+def test_include_globs_limit_the_context_but_keep_the_dockerfile(tmp_path, monkeypatch):
+    configure(tmp_path, monkeypatch, "", build_context_globs=['src/**', 'requirements.txt'])
+    repo_dir, ignore_patterns, include_patterns = build_cache.context_matchers('app')
+
+    def included(path):
+        return build_cache.in_build_context(path, ignore_patterns, include_patterns)
+
+    assert included('src/app/main.py')
+    assert included('requirements.txt')
+    assert included('Dockerfile')
+    assert not included('docs/index.html')
+
+
+def tree(**files):
+    return '\n'.join(f"100644 blob {blob}\t{path}" for path, blob in files.items())
+
+
+def test_fingerprint_changes_only_with_files_in_the_context(tmp_path, monkeypatch):
+    configure(tmp_path, monkeypatch, "*.md\n")
+    trees = {
+        'one': tree(Dockerfile='d1', **{'main.py': 'm1', 'README.md': 'r1'}),
+        'docs': tree(Dockerfile='d1', **{'main.py': 'm1', 'README.md': 'r2'}),
+        'code': tree(Dockerfile='d1', **{'main.py': 'm2', 'README.md': 'r2'}),
+    }
+
+    async def check_output(cmd, cwd='/', timeout=None):
+        return trees[cmd.split()[-1]]
+
+    monkeypatch.setattr(build_cache, 'check_output', check_output)
+
+    async def fingerprints():
+        return [await build_cache.compute_fingerprint('app', commit) for commit in trees]
+
+    one, docs, code = asyncio.run(fingerprints())
+
+    assert one == docs != code
+
+
+def test_a_docs_only_diff_reuses_the_last_build(tmp_path, monkeypatch):
+    configure(tmp_path, monkeypatch, "docs/\n")
+    globals.repo_data = {'app': {'version_history': ['app:v1'], 'build_context': None}}
+    build_cache.record_build_context('app', 'old', 'fingerprint', 'app:v1')
+
+    async def changed_paths(name, old_hash, new_hash):
+        return ['docs/index.md'] if new_hash == 'docs' else ['docs/index.md', 'main.py']
+
+    async def compute_fingerprint(name, commit_hash=None):
+        return f"fingerprint of {commit_hash}"
+
+    monkeypatch.setattr(build_cache, 'changed_paths', changed_paths)
+    monkeypatch.setattr(build_cache, 'compute_fingerprint', compute_fingerprint)
+
+    assert asyncio.run(build_cache.check_build_context('app', 'docs')) == ('fingerprint', True)
+    assert asyncio.run(build_cache.check_build_context('app', 'code')) == ('fingerprint of code', False)
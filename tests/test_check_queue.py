@@ -0,0 +1,110 @@
+import os
+import sys
+import asyncio
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import globals
+import check_queue
+import functions
+
+
+def test_webhook_for_a_removed_repo_does_not_fail_the_cancel_check(monkeypatch):
+    monkeypatch.setattr(check_queue.scheduling, 'record_webhook', lambda name: None)
+    monkeypatch.setattr(check_queue, 'run_queue', lambda queue: asyncio.sleep(0))
+    globals.config_data = {'repos': {}}
+
+    async def run():
+        functions.running_builds['app'] = ('abc', asyncio.get_running_loop().create_future())
+        queue = check_queue.queues['app'] = check_queue.RepoCheckQueue('app')
+        queue.running = True
+
+        check_queue.request_check('app', source='webhook')
+        tasks = set(queue.cancel_tasks)
+        assert tasks
+
+        assert await asyncio.gather(*tasks) == [False]
+        assert not queue.cancel_tasks
+
+    try:
+        asyncio.run(run())
+    finally:
+        functions.running_builds.pop('app', None)
+        check_queue.queues.pop('app', None)
+
+
+def run_checks(monkeypatch, requests, check_seconds=0.05):
+    """Calls `requests(calls)` in a loop where repo checks take `check_seconds`, returns the checks run."""
+    monkeypatch.setattr(globals, 'CHECK_DEBOUNCE_SECONDS', 0.02)
+    monkeypatch.setattr(check_queue.scheduling, 'record_webhook', lambda name: None)
+    monkeypatch.setattr(check_queue.scheduling, 'record_check', lambda name, changed: None)
+    monkeypatch.setattr(check_queue.scheduling, 'check_rate', check_queue.scheduling.TokenBucket(0, 1))
+    globals.repo_data = {'app': {'stages': {'update': None}}}
+    globals.config_data = {'repos': {'app': {}}}
+    calls = []
+
+    async def repo_check(name, ignore_hash_checks=False, refresh_hash=True):
+        calls.append({'ignore_hash_checks': ignore_hash_checks, 'refresh_hash': refresh_hash})
+        await asyncio.sleep(check_seconds)
+
+    monkeypatch.setattr(check_queue, 'repo_check', repo_check)
+
+    async def run():
+        await requests()
+        while check_queue.queues['app'].task and not check_queue.queues['app'].task.done():
+            await asyncio.sleep(0.01)
+
+    try:
+        asyncio.run(run())
+        return calls, check_queue.queues['app']
+    finally:
+        check_queue.queues.pop('app', None)
+
+
+def test_a_burst_of_webhooks_runs_one_check(monkeypatch):
+    async def requests():
+        for _ in range(5):
+            check_queue.request_check('app', source='webhook')
+
+    calls, queue = run_checks(monkeypatch, requests)
+
+    assert len(calls) == 1
+    assert (queue.requests, queue.runs, queue.coalesced) == (5, 1, 4)
+
+
+def test_webhooks_during_a_run_are_merged_into_one_follow_up(monkeypatch):
+    async def requests():
+        check_queue.request_check('app', source='webhook')
+        await asyncio.sleep(0.04)  # the first check is running
+        check_queue.request_check('app', source='webhook')
+        check_queue.request_check('app', source='manual', ignore_hash_checks=True)
+
+    calls, queue = run_checks(monkeypatch, requests)
+
+    assert calls == [
+        {'ignore_hash_checks': False, 'refresh_hash': True},
+        {'ignore_hash_checks': True, 'refresh_hash': True},
+    ]
+
+
+def test_polls_are_dropped_while_a_check_is_queued_or_running(monkeypatch):
+    accepted = []
+
+    async def requests():
+        accepted.append(check_queue.request_check('app', source='scheduler'))
+        accepted.append(check_queue.request_check('app', source='scheduler'))
+        accepted.append(check_queue.request_check('app', source='webhook'))
+
+    calls, queue = run_checks(monkeypatch, requests)
+
+    assert accepted == [True, False, True]
+    assert calls == [{'ignore_hash_checks': False, 'refresh_hash': True}]
+
+
+def test_a_poll_alone_uses_the_shared_remote_hash(monkeypatch):
+    async def requests():
+        check_queue.request_check('app', source='scheduler')
+
+    calls, queue = run_checks(monkeypatch, requests)
+
+    assert calls == [{'ignore_hash_checks': False, 'refresh_hash': False}]
@@ -0,0 +1,39 @@
+import os
+import sys
+import asyncio
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import globals
+import config
+
+
+def test_watcher_keeps_the_running_config_when_reloading_fails(tmp_path, monkeypatch):
+    config_file = tmp_path / 'config.yaml'
+    config_file.write_text("repos:\n")
+    monkeypatch.setattr(globals, 'CONFIG_FILE_PATH', str(config_file))
+    monkeypatch.setattr(globals, 'CONFIG_WATCH_INTERVAL', 0.01)
+    monkeypatch.setattr(config, 'config_file_stat', None)
+
+    running_config = {'host_address': 'localhost', 'repos': {}}
+    globals.config_data = running_config
+
+    async def run():
+        watcher = asyncio.create_task(config.watch_config_file())
+        await asyncio.sleep(0.2)
+        assert not watcher.done()
+        watcher.cancel()
+
+    asyncio.run(run())
+    assert globals.config_data is running_config
+    assert config.config_file_stat == config.file_stat(str(config_file))
+
+
+def test_unknown_fetch_strategy_is_reported_when_the_config_loads(tmp_path):
+    config_file = tmp_path / 'config.yaml'
+    config_file.write_text("repos:\n  app:\n    repo_url: https://example.com/app.git\n    fetch_strategy: partial\n")
+
+    with pytest.raises(ValueError, match="repo app: unknown fetch_strategy 'partial'"):
+        config.load_config_file(str(config_file))
@@ -0,0 +1,109 @@
+import os
+import sys
+import asyncio
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'tools'))
+
+import globals
+import docker_api
+import docker_functions
+from docker_api import DockerAPIClient, DockerAPIError
+from state_cache import state_cache
+from fake_docker_socket import FakeDockerDaemon
+
+
+@pytest.fixture
+def daemon(tmp_path, monkeypatch):
+    """Runs `test(daemon)` with docker_api talking to a fake daemon on a unix socket."""
+    socket_path = str(tmp_path / 'docker.sock')
+    monkeypatch.setattr(globals, 'DOCKER_BACKEND', 'api')
+    monkeypatch.setattr(docker_api, 'client', DockerAPIClient(socket_path, pool_size=2))
+    state_cache.clear()
+
+    fake = FakeDockerDaemon()
+    fake.add_image('app:v1')
+    fake.add_image('app:v2', size=2_500_000)
+    fake.add_container('app', image='app:v2', host_port=9000)
+    fake.add_container('worker', image='app:v1', status='exited')
+
+    def run(test):
+        async def main():
+            await fake.start(socket_path)
+            try:
+                return await test(fake)
+            finally:
+                await docker_api.client.close()
+                await fake.stop()
+
+        return asyncio.run(main())
+
+    return run
+
+
+def test_inspect_many_returns_none_for_missing_containers(daemon):
+    async def test(fake):
+        return await docker_functions.docker_container_inspect_many(['app', 'gone', 'worker'])
+
+    output = daemon(test)
+
+    assert output['app'][0]['Config']['Image'] == 'app:v2'
+    assert output['worker'][0]['State']['Status'] == 'exited'
+    assert output['gone'] is None
+    assert state_cache.get(('container', 'app'))[0]
+
+
+def test_container_list_uses_the_cli_format(daemon):
+    async def test(fake):
+        return await docker_functions.docker_container_list()
+
+    containers = {container['Names']: container for container in daemon(test)}
+
+    assert set(containers) == {'app', 'worker'}
+    assert containers['app']['State'] == 'running'
+    assert containers['app']['Ports'] == ['0.0.0.0:9000->8080/tcp']
+    assert containers['app']['CreatedAt'].endswith('+0000 UTC')
+
+
+def test_logs_are_demultiplexed_and_tailed(daemon):
+    async def test(fake):
+        container_id = fake.find_container('app')['Id']
+        for i in range(5):
+            fake.write_log(container_id, f"line {i}")
+
+        return await docker_functions.docker_container_get_logs('app', num_of_lines=2)
+
+    assert daemon(test) == "line 3\nline 4\n"
+
+
+def test_actions_change_the_container_and_invalidate_the_cache(daemon):
+    async def test(fake):
+        await docker_functions.docker_container_inspect('app')
+        await docker_functions.docker_container_action('stop', 'app')
+        _, stopped = await docker_functions.docker_container_inspect('app')
+
+        with pytest.raises(DockerAPIError) as error:
+            await docker_api.container_action('rm', 'worker-gone')
+
+        await docker_functions.docker_container_action('rm', 'app')
+        return stopped, error.value.status, fake.find_container('app')
+
+    stopped, status, removed = daemon(test)
+
+    assert stopped[0]['State']['Status'] == 'exited'
+    assert status == 404
+    assert removed is None
+
+
+def test_image_list_and_disk_usage(daemon):
+    async def test(fake):
+        return await docker_api.image_list(), await docker_api.disk_usage()
+
+    images, usage = daemon(test)
+
+    assert sorted(f"{image['Repository']}:{image['Tag']}" for image in images) == ['app:v1', 'app:v2']
+    assert '2.5MB' in {image['Size'] for image in images}
+    assert usage == {'images': 102_500_000, 'build_cache': 0}
@@ -0,0 +1,52 @@
+import os
+import sys
+import asyncio
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import globals
+import docker_functions
+import event_watcher
+from state_cache import state_cache
+
+
+def test_die_event_during_a_refresh_is_not_overwritten_by_its_result(monkeypatch):
+    monkeypatch.setattr(globals, 'DOCKER_EVENTS_BATCH_DELAY', 0)
+    globals.config_data = {'repos': {'app': {'deploy_strategy': 'recreate'}}}
+    globals.repo_data = {}
+    state_cache.clear()
+    state_cache.set_live(True)
+
+    fetching = None
+    states = []
+
+    async def fetch(names, concurrency=None):
+        # the first fetch reads the container before the die event arrives
+        state = 'running' if not states else 'exited'
+        states.append(state)
+        if state == 'running':
+            fetching.set()
+            await asyncio.sleep(0.05)
+        return {name: [{'State': {'Status': state}}] for name in names}
+
+    monkeypatch.setattr(docker_functions, '_fetch_container_inspect_many', fetch)
+
+    async def run():
+        nonlocal fetching
+        fetching = asyncio.Event()
+
+        event_watcher.handle_event({'Type': 'container', 'Action': 'start', 'Actor': {'ID': 'id', 'Attributes': {'name': 'app'}}})
+        await fetching.wait()
+        event_watcher.handle_event({'Type': 'container', 'Action': 'die', 'Actor': {'ID': 'id', 'Attributes': {'name': 'app'}}})
+
+        await event_watcher._refresh_task
+        return state_cache.get(('container', 'app'))
+
+    try:
+        found, value = asyncio.run(run())
+    finally:
+        state_cache.set_live(False)
+
+    assert states == ['running', 'exited']
+    assert found and value[1][0]['State']['Status'] == 'exited'
+    assert not event_watcher._dirty_containers
@@ -0,0 +1,76 @@
+import os
+import sys
+import asyncio
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import globals
+import git_functions
+import hash_discovery
+from hash_discovery import RemoteHashDiscovery
+
+
+def configure(repos):
+    globals.config_data = {'repos': {
+        name: {'repo_url': url, 'branch': branch} for name, (url, branch) in repos.items()
+    }}
+
+
+def fake_ls_remote(monkeypatch, calls, seconds=0.02):
+    async def get_remote_hashes(url, branches):
+        calls.append((url, tuple(branches)))
+        await asyncio.sleep(seconds)
+        return {branch: f"{url}@{branch}#{len(calls)}" for branch in branches}
+
+    monkeypatch.setattr(hash_discovery, 'get_remote_hashes', get_remote_hashes)
+
+
+def test_repos_of_one_remote_share_a_single_ls_remote(monkeypatch):
+    configure({'api': ('git@host:app', 'main'), 'api-next': ('git@host:app', 'next'), 'web': ('git@host:web', 'main')})
+    calls = []
+    fake_ls_remote(monkeypatch, calls)
+    discovery = RemoteHashDiscovery(ttl=10)
+
+    async def run():
+        return await asyncio.gather(
+            discovery.get('git@host:app', 'main'),
+            discovery.get('git@host:app', 'next'),
+            discovery.get('git@host:web', 'main'),
+        )
+
+    hashes = asyncio.run(run())
+
+    assert hashes == ['git@host:app@main#2', 'git@host:app@next#2', 'git@host:web@main#2']
+    assert sorted(calls) == [('git@host:app', ('main', 'next')), ('git@host:web', ('main',))]
+    assert discovery.shared == 1
+
+
+def test_results_are_cached_for_the_ttl_unless_a_fresh_hash_is_required(monkeypatch):
+    configure({'api': ('git@host:app', 'main')})
+    calls = []
+    fake_ls_remote(monkeypatch, calls, seconds=0)
+    discovery = RemoteHashDiscovery(ttl=10)
+
+    async def run():
+        first = await discovery.get('git@host:app', 'main')
+        cached = await discovery.get('git@host:app', 'main')
+        fresh = await discovery.get('git@host:app', 'main', max_age=0)
+        return first, cached, fresh
+
+    first, cached, fresh = asyncio.run(run())
+
+    assert first == cached != fresh
+    assert len(calls) == 2
+    assert discovery.cache_hits == 1
+
+
+def test_ls_remote_output_is_parsed_per_branch(monkeypatch):
+    async def check_output(cmd, cwd='/', timeout=None):
+        assert cmd == "git ls-remote git@host:app refs/heads/main refs/heads/gone"
+        return "warning: redirecting to https://host/app.git/\n" + "a" * 40 + "\trefs/heads/main"
+
+    monkeypatch.setattr(git_functions, 'check_output', check_output)
+
+    hashes = asyncio.run(git_functions.get_remote_hashes('git@host:app', ['main', 'gone']))
+
+    assert hashes == {'main': 'a' * 40, 'gone': None}
@@ -0,0 +1,121 @@
+import os
+import sys
+import time
+import socket
+import asyncio
+from copy import deepcopy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import globals
+import health
+from config import CONFIG_FILE_REPO_STRUCT
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def configure(port, **healthcheck):
+    repo = deepcopy(CONFIG_FILE_REPO_STRUCT)
+    repo['port'] = port
+    repo['healthcheck'] |= healthcheck
+    globals.config_data = {'host_address': '127.0.0.1', 'repos': {'app': repo}}
+
+
+async def respond_ok(reader, writer):
+    await reader.readuntil(b'\r\n\r\n')
+    writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok")
+    await writer.drain()
+    writer.close()
+
+
+def test_waits_for_a_service_that_starts_listening_late():
+    port = free_port()
+    configure(port, retry_delay=1, deadline=10)
+
+    async def run():
+        async def start_late():
+            await asyncio.sleep(2)
+            return await asyncio.start_server(respond_ok, '127.0.0.1', port)
+
+        starting = asyncio.create_task(start_late())
+        started = time.monotonic()
+        healthy = await health.wait_healthy('app')
+        server = await starting
+        server.close()
+        return healthy, time.monotonic() - started
+
+    healthy, seconds = asyncio.run(run())
+
+    assert healthy
+    assert 2 <= seconds < 5
+
+
+def test_refused_connections_wait_for_the_deadline():
+    configure(free_port(), retry_delay=0.5, deadline=2)
+
+    started = time.monotonic()
+    healthy = asyncio.run(health.wait_healthy('app'))
+
+    assert not healthy
+    assert time.monotonic() - started >= 2
+
+
+def test_probe_of_a_removed_repo_does_not_raise():
+    configure(free_port())
+
+    result = asyncio.run(health.probe('gone'))
+
+    assert not result['ok']
+    assert result['error']
+
+
+def test_probe_with_braces_in_the_command_does_not_raise():
+    configure(free_port(), type='command', command="sh -c 'test {}' || exit 1")
+
+    result = asyncio.run(health.probe('app'))
+
+    assert not result['ok']
+    assert result['error']
+
+
+def test_rollback_remediates_once_per_deployed_version(monkeypatch):
+    import health_monitor
+
+    configure(free_port())
+    globals.config_data['repos']['app']['monitor_remediation'] = 'rollback'
+    globals.repo_data['app'] = {'deployed_version': 'v3'}
+    monkeypatch.setattr(globals, 'HEALTH_REMEDIATION_COOLDOWN', 0)
+    health_monitor.repos.clear()
+    rollbacks = []
+
+    async def rollback(name):
+        rollbacks.append(globals.repo_data[name]['deployed_version'])
+        globals.repo_data[name]['deployed_version'] = 'v2'
+
+    monkeypatch.setattr(health_monitor, 'repo_rollback', rollback)
+
+    async def run():
+        for _ in range(3):
+            await health_monitor.remediate('app')
+
+        # a new deploy is remediated again
+        globals.repo_data['app']['deployed_version'] = 'v4'
+        await health_monitor.remediate('app')
+
+    asyncio.run(run())
+    assert rollbacks == ['v3', 'v4']
+
+
+def test_command_probe_timeout_kills_the_processes_it_started(monkeypatch):
+    monkeypatch.setattr(globals, 'PROCESS_KILL_GRACE', 1)
+    configure(free_port(), type='command', timeout=0.5, command="sleep 31.337 & sleep 31.337; exit 0")
+
+    result = asyncio.run(health.probe('app'))
+    time.sleep(0.2)
+
+    assert result['timed_out']
+    assert os.system("pgrep -f 'sleep 31[.]337' > /dev/null") != 0
@@ -0,0 +1,27 @@
+import os
+import sys
+import asyncio
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import globals
+from history_db import HistoryDB
+
+
+def test_health_rows_older_than_the_retention_are_pruned(tmp_path, monkeypatch):
+    monkeypatch.setattr(globals, 'HISTORY_HEALTH_RETENTION', 3600)
+    history = HistoryDB(str(tmp_path / 'history.sqlite3'))
+    result = {'ok': True, 'latency': 0.01, 'status': 200}
+
+    history.write(
+        "INSERT INTO health (repo, time, source, ok, latency, status) VALUES (?, ?, ?, ?, ?, ?)",
+        [('app', '2000-01-01T00:00:00+00:00', 'monitor', 1, 0.01, 200)]
+    )
+    history.record_health('monitor', {'app': result})
+    history.record_health('monitor', {'app': result})
+
+    rows = asyncio.run(history.page('health', 'app'))
+    history.close()
+
+    assert len(rows) == 2
+    assert all(row['time'] > '2000-01-01T00:00:00+00:00' for row in rows)
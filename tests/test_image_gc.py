@@ -0,0 +1,49 @@
+import os
+import sys
+import asyncio
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import globals
+import image_gc
+
+
+def test_forgetting_versions_drops_their_build_records(monkeypatch):
+    monkeypatch.setattr(image_gc.state_store, 'save', lambda name: None)
+    globals.repo_data = {'app': {
+        'version_history': ['app:v1', 'app:v2', 'app:v3'],
+        # app:v4 was rolled back and popped from the history
+        'builds': {'app:v1': {}, 'app:v2': {}, 'app:v3': {}, 'app:v4': {}},
+    }}
+
+    image_gc.forget_versions(['app:v1'])
+
+    assert globals.repo_data['app']['version_history'] == ['app:v2', 'app:v3']
+    assert set(globals.repo_data['app']['builds']) == {'app:v2', 'app:v3'}
+
+
+def image(ref, created='2026-01-01 00:00:00 +0000 UTC'):
+    repository, _, tag = ref.rpartition(':')
+    return {'Id': f"sha256:{ref}", 'Repository': repository, 'Tag': tag, 'CreatedAt': created, 'Size': '10MB'}
+
+
+def test_tag_scheme_without_build_number_keeps_to_the_version_history(monkeypatch):
+    async def inspect(name):
+        return None, None
+
+    monkeypatch.setattr(image_gc, 'docker_container_inspect', inspect)
+    monkeypatch.setattr(globals, 'GC_DISK_BUDGET', '0')
+    globals.config_data = {'repos': {
+        'app': {'version_tag_scheme': '{name}:release', 'keep_versions': 1},
+        'web': {'version_tag_scheme': '{name}:v{build_number}', 'keep_versions': 1},
+    }}
+    globals.repo_data = {
+        'app': {'version_history': ['app:release']},
+        'web': {'version_history': ['web:v1', 'web:v2', 'web:v3']},
+    }
+    images = [image(ref) for ref in ('app:release', 'app:other', 'web:v1', 'web:v2', 'web:v3')]
+
+    removals = asyncio.run(image_gc.plan(images))
+
+    # the two newest web versions are protected as the current build and the rollback target
+    assert removals == ['web:v1']
@@ -0,0 +1,60 @@
+import os
+import sys
+import asyncio
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from log_store import LogStore, LogBuffer
+
+
+def test_limits_count_bytes_not_characters(tmp_path):
+    store = LogStore(max_lines=100, max_bytes=40, spill_path=str(tmp_path), segment_bytes=30, max_segments=3)
+    buffer = store.get('app', create=True)
+
+    for i in range(10):
+        buffer.append('é' * 5 + str(i))  # 11 bytes and a newline
+    store.close()
+
+    assert list(buffer.lines) == ['ééééé7', 'ééééé8', 'ééééé9']
+    assert buffer.size == 36
+
+    segments = sorted(os.listdir(tmp_path / 'app'))
+    assert len(segments) == 3
+    assert all(os.path.getsize(tmp_path / 'app' / segment) <= 36 for segment in segments)
+
+    reloaded = LogStore(max_lines=100, max_bytes=40, spill_path=str(tmp_path))
+    reloaded.preload()
+    assert list(reloaded.buffers['app'].lines) == ['ééééé7', 'ééééé8', 'ééééé9']
+
+
+def test_cursor_returns_only_new_lines_and_skips_evicted_ones():
+    buffer = LogBuffer(max_lines=3, max_bytes=1000)
+
+    for line in ('a', 'b'):
+        buffer.append(line)
+    lines, cursor = buffer.since(0)
+    assert (lines, cursor) == (['a', 'b'], 2)
+
+    buffer.append('c')
+    assert buffer.since(cursor) == (['c'], 3)
+
+    # a client that fell behind resumes at the oldest line still kept
+    for line in ('d', 'e'):
+        buffer.append(line)
+    assert buffer.since(1) == (['c', 'd', 'e'], 5)
+    assert buffer.since(5) == ([], 5)
+
+
+def test_wait_returns_once_a_line_arrives_after_the_cursor():
+    buffer = LogBuffer(max_lines=10, max_bytes=1000)
+
+    async def run():
+        waiter = asyncio.create_task(buffer.wait(0, timeout=1))
+        await asyncio.sleep(0.01)
+        assert not waiter.done()
+
+        buffer.append('line')
+        await waiter
+        return buffer.since(0)
+
+    assert asyncio.run(run()) == (['line'], 1)
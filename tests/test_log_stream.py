@@ -0,0 +1,41 @@
+import os
+import sys
+import asyncio
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+
+def test_multi_line_log_messages_keep_every_line_in_the_event(monkeypatch):
+    monkeypatch.chdir(ROOT)  # the app mounts ./static
+    from main import sse_event
+
+    event = sse_event(7, ["Hash comparison: \n  old: 'a'\n  new: 'b'", "done\r"])
+
+    assert event == "id: 7\ndata: Hash comparison: \ndata:   old: 'a'\ndata:   new: 'b'\ndata: done\n\n"
+
+
+class Request:
+    def __init__(self, headers):
+        self.headers = headers
+
+
+def test_a_resumed_stream_starts_after_the_last_event_id(monkeypatch):
+    monkeypatch.chdir(ROOT)
+    from main import sse_log_response
+    from log_store import LogBuffer
+
+    buffer = LogBuffer(max_lines=100, max_bytes=10000)
+    for i in range(5):
+        buffer.append(f"line {i}")
+
+    async def first_event(headers):
+        response = sse_log_response(Request(headers), buffer, num_of_lines=2)
+        events = response.body_iterator
+        try:
+            return await events.__anext__()
+        finally:
+            await events.aclose()
+
+    assert asyncio.run(first_event({})) == "id: 5\ndata: line 3\ndata: line 4\n\n"
+    assert asyncio.run(first_event({'last-event-id': '1'})) == "id: 5\ndata: line 1\ndata: line 2\ndata: line 3\ndata: line 4\n\n"
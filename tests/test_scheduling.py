@@ -0,0 +1,82 @@
+import os
+import sys
+import time
+import asyncio
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import globals
+import scheduling
+
+
+class FakeScheduler:
+    def __init__(self):
+        self.triggers = {}
+
+    def get_job(self, job_id):
+        return True
+
+    def reschedule_job(self, job_id, trigger):
+        self.triggers[job_id] = trigger
+
+
+def configure(monkeypatch, interval=60):
+    monkeypatch.setattr(globals, 'SCHEDULE_BACKOFF_AFTER', 2)
+    monkeypatch.setattr(globals, 'SCHEDULE_MAX_BACKOFF', 4)
+    monkeypatch.setattr(globals, 'SCHEDULE_WEBHOOK_QUIET', 3600)
+    monkeypatch.setattr(scheduling, 'scheduler', FakeScheduler())
+    monkeypatch.setattr(scheduling, 'schedules', {})
+    globals.config_data = {'repos': {'app': {'interval': interval}}}
+    return scheduling.scheduler
+
+
+def test_unchanged_repos_back_off_and_a_change_tightens_again(monkeypatch):
+    scheduler = configure(monkeypatch)
+    factors = []
+
+    for changed in (False, False, False, False, False, False, True):
+        scheduling.record_check('app', changed)
+        factors.append(scheduling.get('app').factor)
+
+    assert factors == [1, 2, 2, 4, 4, 4, 1]
+    assert scheduler.triggers[scheduling.job_id('app')].interval == timedelta(seconds=60)
+
+
+def test_webhooks_back_off_polling_until_they_go_quiet(monkeypatch):
+    scheduler = configure(monkeypatch)
+
+    scheduling.record_webhook('app')
+    assert scheduling.get('app').factor == 4
+    assert scheduler.triggers[scheduling.job_id('app')].interval == timedelta(seconds=240)
+
+    scheduling.get('app').last_webhook = time.monotonic() - 3600
+    assert scheduling.wanted_factor(scheduling.get('app')) == 1
+
+
+def test_first_runs_are_spread_and_runs_jittered(monkeypatch):
+    configure(monkeypatch, interval=600)
+    monkeypatch.setattr(globals, 'SCHEDULE_START_SPREAD', 300)
+    monkeypatch.setattr(globals, 'SCHEDULE_JITTER', 0.1)
+
+    now = datetime.now()
+    first_runs = [scheduling.first_run_time({'interval': 600}) for _ in range(50)]
+
+    assert all(now <= first_run <= now + timedelta(seconds=301) for first_run in first_runs)
+    assert len(set(first_runs)) > 1
+    assert scheduling.trigger('app', {'interval': 600}).jitter == 60
+
+
+def test_token_bucket_delays_checks_beyond_the_burst():
+    bucket = scheduling.TokenBucket(rate=20, burst=2)
+
+    async def run():
+        started = time.monotonic()
+        for _ in range(4):
+            await bucket.acquire()
+        return time.monotonic() - started
+
+    elapsed = asyncio.run(run())
+
+    assert bucket.delayed == 2
+    assert 0.08 <= elapsed < 0.5
@@ -0,0 +1,26 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from state_cache import StateCache
+
+
+def test_ttl_zero_does_not_cache_and_none_never_expires():
+    cache = StateCache(ttl=0)
+
+    cache.set('a', 1)
+    cache.set('b', 2, ttl=0)
+    cache.set('c', 3, ttl=None)
+
+    assert cache.get('a') == (False, None)
+    assert cache.get('b') == (False, None)
+    assert cache.get('c') == (True, 3)
+
+
+def test_entries_do_not_expire_while_live():
+    cache = StateCache(ttl=0)
+    cache.set_live(True)
+
+    cache.set('a', 1)
+    assert cache.get('a') == (True, 1)
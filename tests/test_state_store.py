@@ -0,0 +1,48 @@
+import os
+import sys
+import json
+import asyncio
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import globals
+from state_store import StateStore, append_journal
+
+
+def test_journals_left_by_a_crash_during_compaction_are_not_replayed(tmp_path):
+    path = str(tmp_path / 'repo_data.json')
+    store = StateStore(path)
+    globals.repo_data = {'app': {'build_number': 1}}
+
+    async def run():
+        store.save('app')
+        await store.flush()
+        old_journal = open(store.journal_path(store.generation)).read()
+
+        globals.repo_data['app']['build_number'] = 2
+        await store.compact()
+
+        # crashed after the snapshot replaced the old one, before the journal was removed
+        with open(store.journal_path(0), 'w') as file:
+            file.write(old_journal)
+
+    asyncio.run(run())
+
+    reloaded = StateStore(path)
+    data = reloaded.load()
+
+    assert data == {'app': {'build_number': 2}}
+    assert reloaded.generation == 1
+    assert not os.path.exists(reloaded.journal_path(0))
+
+
+def test_journals_written_after_a_reload_are_replayed(tmp_path):
+    path = str(tmp_path / 'repo_data.json')
+    with open(path, 'w') as file:
+        json.dump({'app': {'build_number': 2}, '__journal_generation__': 4}, file)
+
+    store = StateStore(path)
+    store.load()
+    append_journal(store.journal_path(store.generation), [json.dumps({'repo': 'app', 'data': {'build_number': 3}})])
+
+    assert StateStore(path).load() == {'app': {'build_number': 3}}
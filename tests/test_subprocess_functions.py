@@ -0,0 +1,57 @@
+import os
+import sys
+import asyncio
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from subprocess_functions import stream_lines, poll_output
+
+
+class Chunks:
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+
+    async def read(self, n=-1):
+        return self.chunks.pop(0) if self.chunks else b''
+
+
+def test_lines_and_characters_split_across_chunks_are_joined():
+    lines = []
+    batches = []
+
+    async def run():
+        # 'é' is two bytes, split between the second and the third chunk
+        stream = Chunks([b'first\nsec', b'ond\r\ncaf\xc3', b'\xa9\nno newline at the end'])
+        await stream_lines(stream, callback=lines.append, batch_callback=batches.append)
+
+    asyncio.run(run())
+
+    assert lines == ['first', 'second', 'café', 'no newline at the end']
+    assert batches == [['first'], ['second'], ['café'], ['no newline at the end']]
+
+
+def test_an_async_batch_callback_is_awaited_before_reading_on():
+    events = []
+
+    class Recording(Chunks):
+        async def read(self, n=-1):
+            events.append('read')
+            return await super().read(n)
+
+    async def consume(lines):
+        await asyncio.sleep(0)
+        events.append(f"consumed {len(lines)}")
+
+    asyncio.run(stream_lines(Recording([b'a\nb\n', b'c\n']), batch_callback=consume))
+
+    assert events == ['read', 'consumed 2', 'read', 'consumed 1', 'read']
+
+
+def test_poll_output_streams_process_output_in_batches():
+    lines = []
+
+    async def run():
+        return await poll_output("printf 'one\\ntwo\\n'; sleep 0.1; printf 'three\\n'", batch_callback=lines.extend)
+
+    assert asyncio.run(run()) == 0
+    assert lines == ['one', 'two', 'three']
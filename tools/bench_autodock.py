@@ -0,0 +1,476 @@
+"""
+End to end overhead of autodock against fake git and docker, by number of repos.
+
+    python tools/bench_autodock.py [--repos 1,10,100,500] [--scenarios repo_check,configuration,webhook,dashboard]
+                                   [--latency 0] [--output-lines 20] [--fail-rate 0] [--docker-backend api]
+                                   [--output results.json] [--baseline previous.json] [--tolerance 0.1]
+
+Every scenario and repo count runs in a fresh worker process with its own config file, repo_data directory
+and fake state. The worker talks to tools/fake_cli.py as `git` and `docker` on PATH; with --docker-backend
+api the docker state queries go to tools/fake_docker_socket.py, started in another process and seeded with
+one container and image per repo.
+
+  configuration - config.configuration() on a cold start, then reloads with a tenth of the intervals changed
+  repo_check    - repo_check of every repo at once: cold (clone, build, deploy), unchanged (ls-remote only),
+                  then after a new commit on every remote (pull, build, deploy)
+  webhook       - POST /webhook/{name} for every repo, then the time until the check queue drained
+  dashboard     - the dashboard and internal routes after one round of checks
+
+Requests go straight to the ASGI app, so the numbers are autodock's own and not the HTTP server's. Peak RSS
+is that of the worker, subprocesses are counted by the fakes. With --baseline, throughput and latencies are
+compared with a previous --output file and changes beyond --tolerance are reported, the exit status is 1
+when one of them is a regression.
+
+Every fake call starts a Python interpreter, which dominates the check latencies at --latency 0. Compare
+runs with each other, not with real git and docker.
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+from collections import Counter
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(TOOLS_DIR)
+
+SCENARIOS = ('configuration', 'repo_check', 'webhook', 'dashboard')
+RESULT_PREFIX = 'BENCH_RESULT '
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def summarize(latencies, wall_seconds):
+    if not latencies:
+        return {'count': 0}
+
+    return {
+        'count': len(latencies),
+        'throughput_per_second': round(len(latencies) / wall_seconds, 2) if wall_seconds else None,
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'max_ms': round(max(latencies) * 1000, 3),
+    }
+
+
+def repo_names(count):
+    return [f"repo-{i}" for i in range(count)]
+
+##  worker, runs one scenario inside autodock
+
+def write_config(path, count, interval_shift=0):
+    import yaml
+
+    repos = {}
+    for i, name in enumerate(repo_names(count)):
+        repos[name] = {
+            'repo_url': f"https://git.example.invalid/{name}.git",
+            'branch': 'main',
+            'interval': 600 + (interval_shift if i % 10 == 0 else 0),
+            'port': 20000 + i,
+            'build_command': 'docker build -t {version_tag_scheme} -t {name}:latest .',
+            'healthcheck': {'type': 'none'},
+            'monitor_interval': 0,
+        }
+
+    with open(path, 'w') as file:
+        yaml.safe_dump({'host_address': 'localhost', 'repos': repos}, file)
+
+
+async def asgi_request(app, method, path):
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+        'method': method, 'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': b'',
+        'root_path': '', 'headers': [(b'host', b'bench')], 'client': ('127.0.0.1', 1), 'server': ('bench', 80),
+    }
+    response = {'status': None, 'bytes': 0}
+    sent = False
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await asyncio.Event().wait()
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            response['status'] = message['status']
+        elif message['type'] == 'http.response.body':
+            response['bytes'] += len(message.get('body', b''))
+
+    await app(scope, receive, send)
+    return response
+
+
+async def timed(coroutine):
+    started = time.perf_counter()
+    result = await coroutine
+    return time.perf_counter() - started, result
+
+
+async def run_round(coroutines):
+    started = time.perf_counter()
+    results = await asyncio.gather(*(timed(coroutine) for coroutine in coroutines), return_exceptions=True)
+    wall = time.perf_counter() - started
+
+    latencies = [result[0] for result in results if not isinstance(result, BaseException)]
+    summary = summarize(latencies, wall)
+    summary['failed'] = len(results) - len(latencies)
+    return summary
+
+
+def bump_remotes():
+    path = os.path.join(os.environ['FAKE_CLI_DIR'], 'generation')
+    try:
+        with open(path) as file:
+            generation = int(file.read() or 0)
+    except FileNotFoundError:
+        generation = 0
+
+    with open(path, 'w') as file:
+        file.write(str(generation + 1))
+
+
+async def scenario_configuration(count, args):
+    import globals
+    from config import configuration, scheduler
+
+    scheduler.start(paused=True)
+    phases = {}
+
+    started = time.perf_counter()
+    configuration()
+    phases['cold'] = summarize([time.perf_counter() - started], time.perf_counter() - started)
+
+    latencies = []
+    for shift in range(1, args.repetitions + 1):
+        write_config(globals.CONFIG_FILE_PATH, count, interval_shift=shift)
+        started = time.perf_counter()
+        configuration()
+        latencies.append(time.perf_counter() - started)
+    phases['reload'] = summarize(latencies, sum(latencies))
+
+    phases['scheduled_jobs'] = len(scheduler.get_jobs())
+    return phases
+
+
+async def scenario_repo_check(count, args):
+    from config import configuration, scheduler
+    from functions import repo_check
+
+    scheduler.start(paused=True)
+    configuration()
+
+    phases = {}
+    phases['cold'] = await run_round(repo_check(name) for name in repo_names(count))
+    phases['unchanged'] = await run_round(repo_check(name) for name in repo_names(count))
+
+    bump_remotes()
+    phases['new_commit'] = await run_round(repo_check(name) for name in repo_names(count))
+    return phases
+
+
+async def scenario_webhook(count, args):
+    import main
+    import check_queue
+    from config import configuration, scheduler
+
+    scheduler.start(paused=True)
+    configuration()
+
+    phases = {}
+    phases['request'] = await run_round(asgi_request(main.app, 'POST', f"/webhook/{name}") for name in repo_names(count))
+
+    started = time.perf_counter()
+    while any(queue.task and not queue.task.done() for queue in check_queue.queues.values()):
+        await asyncio.sleep(0.01)
+    drained = time.perf_counter() - started
+
+    phases['drain'] = summarize([drained], drained)
+    return phases
+
+
+async def scenario_dashboard(count, args):
+    import main
+    from config import configuration, scheduler
+    from functions import repo_check
+
+    scheduler.start(paused=True)
+    configuration()
+    await asyncio.gather(*(repo_check(name) for name in repo_names(count)), return_exceptions=True)
+
+    names = repo_names(count)
+    routes = {
+        'index': lambda: '/',
+        'repo_details': lambda: f"/repo/{random.choice(names)}",
+        'containers': lambda: '/containers',
+        'images': lambda: '/images',
+        'internal_pipeline': lambda: '/internal/pipeline',
+        'metrics': lambda: '/metrics',
+    }
+
+    phases = {}
+    for route, path in routes.items():
+        latencies = []
+        started = time.perf_counter()
+        for _ in range(args.repetitions):
+            latency, response = await timed(asgi_request(main.app, 'GET', path()))
+            if response['status'] != 200:
+                raise RuntimeError(f"{route} returned {response['status']}")
+            latencies.append(latency)
+        phases[route] = summarize(latencies, time.perf_counter() - started)
+
+    return phases
+
+
+def worker(args):
+    # paths have to point into the run directory before any autodock module reads them
+    sys.path.insert(0, REPO_DIR)
+    os.chdir(REPO_DIR)
+
+    import globals
+    globals.CONFIG_FILE_PATH = os.path.join(args.run_dir, 'config.yaml')
+    globals.REPO_DATA_PATH = os.path.join(args.run_dir, 'repo_data')
+    globals.REPO_DATA_FILE_PATH = os.path.join(globals.REPO_DATA_PATH, 'repo_data.json')
+    os.makedirs(globals.REPO_DATA_PATH, exist_ok=True)
+
+    write_config(globals.CONFIG_FILE_PATH, args.count)
+
+    async def run():
+        import metrics
+        from state_store import state_store
+
+        started = time.perf_counter()
+        phases = await WORKER_SCENARIOS[args.worker](args.count, args)
+        wall = time.perf_counter() - started
+        await state_store.close()
+
+        return {
+            'phases': phases,
+            'wall_seconds': round(wall, 3),
+            'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            'subprocesses_spawned': int(sum(metrics.subprocess_spawns.values.values())),
+        }
+
+    result = asyncio.run(run())
+    print(RESULT_PREFIX + json.dumps(result), flush=True)
+
+
+WORKER_SCENARIOS = {
+    'configuration': scenario_configuration,
+    'repo_check': scenario_repo_check,
+    'webhook': scenario_webhook,
+    'dashboard': scenario_dashboard,
+}
+
+##  fake docker daemon
+
+def fake_docker(args):
+    sys.path.insert(0, TOOLS_DIR)
+    from fake_docker_socket import FakeDockerDaemon
+
+    async def serve():
+        daemon = FakeDockerDaemon()
+        for name in repo_names(args.count):
+            daemon.add_image(f"{name}:v0")
+            daemon.add_container(name, image=f"{name}:v0")
+
+        server = await daemon.start(args.socket)
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(serve())
+
+
+def wait_for_socket(path, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.socket(socket.AF_UNIX) as client:
+                client.connect(path)
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"fake docker daemon did not start on {path}")
+
+##  parent
+
+def run_scenario(scenario, count, args):
+    with tempfile.TemporaryDirectory(prefix='autodock-bench-') as run_dir:
+        bin_dir = os.path.join(run_dir, 'bin')
+        fake_dir = os.path.join(run_dir, 'fake')
+        subprocess.run([sys.executable, os.path.join(TOOLS_DIR, 'fake_cli.py'), 'install', bin_dir], check=True)
+
+        env = os.environ | {
+            'PATH': bin_dir + os.pathsep + os.environ['PATH'],
+            'FAKE_CLI_DIR': fake_dir,
+            'FAKE_CLI_LATENCY': args.latency,
+            'FAKE_CLI_OUTPUT_LINES': str(args.output_lines),
+            'FAKE_CLI_FAIL_RATE': str(args.fail_rate),
+            'DOCKER_EVENTS': '0',
+            'GC_INTERVAL': '0',
+            'HISTORY_DB': os.environ.get('HISTORY_DB', '0'),
+            'CHECK_DEBOUNCE_SECONDS': os.environ.get('CHECK_DEBOUNCE_SECONDS', '0.1'),
+            # the rate limit would dominate the webhook scenario, it is not autodock's overhead
+            'SCHEDULE_MAX_CHECKS_PER_SECOND': os.environ.get('SCHEDULE_MAX_CHECKS_PER_SECOND', '0'),
+        }
+
+        daemon = None
+        if args.docker_backend == 'api':
+            docker_socket = os.path.join(run_dir, 'docker.sock')
+            daemon = subprocess.Popen([sys.executable, __file__, '--fake-docker', '--socket', docker_socket, '--count', str(count)])
+            wait_for_socket(docker_socket)
+            env |= {'DOCKER_HOST': f"unix://{docker_socket}", 'DOCKER_BACKEND': 'api'}
+        else:
+            env |= {'DOCKER_BACKEND': 'cli'}
+
+        try:
+            process = subprocess.run(
+                [sys.executable, __file__, '--worker', scenario, '--count', str(count), '--run-dir', run_dir,
+                 '--repetitions', str(args.repetitions)],
+                env=env, cwd=REPO_DIR, capture_output=True, text=True
+            )
+        finally:
+            if daemon:
+                daemon.terminate()
+                daemon.wait()
+
+        lines = [line for line in process.stdout.splitlines() if line.startswith(RESULT_PREFIX)]
+        if process.returncode != 0 or not lines:
+            raise RuntimeError(f"{scenario} with {count} repos failed:\n{process.stderr[-4000:]}")
+
+        result = json.loads(lines[-1].removeprefix(RESULT_PREFIX))
+
+        try:
+            with open(os.path.join(fake_dir, 'calls.log')) as file:
+                calls = Counter(file.read().splitlines())
+        except FileNotFoundError:
+            calls = Counter()
+
+        result['processes'] = sum(calls.values())
+        result['process_families'] = dict(calls.most_common())
+        return result
+
+
+def compare(results, baseline, tolerance):
+    """Relative change of every throughput and latency that is in both runs, regressions first."""
+    changes = []
+
+    for scenario, counts in results.items():
+        for count, result in counts.items():
+            previous = baseline.get(scenario, {}).get(count)
+            if not previous:
+                continue
+
+            for phase, summary in result['phases'].items():
+                old = previous['phases'].get(phase)
+                if not isinstance(summary, dict) or not isinstance(old, dict):
+                    continue
+
+                for metric in ('p50_ms', 'p99_ms', 'throughput_per_second'):
+                    if not summary.get(metric) or not old.get(metric):
+                        continue
+
+                    change = summary[metric] / old[metric] - 1
+                    worse = change < -tolerance if metric == 'throughput_per_second' else change > tolerance
+                    better = change > tolerance if metric == 'throughput_per_second' else change < -tolerance
+
+                    if worse or better:
+                        changes.append({
+                            'scenario': scenario, 'repos': count, 'phase': phase, 'metric': metric,
+                            'baseline': old[metric], 'current': summary[metric], 'change': round(change, 3),
+                            'regression': worse,
+                        })
+
+    return sorted(changes, key=lambda change: not change['regression'])
+
+
+def main(args):
+    results = {}
+
+    for scenario in args.scenarios:
+        results[scenario] = {}
+
+        for count in args.repos:
+            result = run_scenario(scenario, count, args)
+            results[scenario][str(count)] = result
+
+            for phase, summary in result['phases'].items():
+                if isinstance(summary, dict) and summary.get('count'):
+                    print(f"{scenario:>13} {count:>5} repos {phase:>17}: {summary['throughput_per_second'] or 0:>9.1f}/s"
+                          f"  p50 {summary['p50_ms']:>9.2f} ms  p99 {summary['p99_ms']:>9.2f} ms"
+                          + (f"  {summary['failed']} failed" if summary.get('failed') else ''))
+            print(f"{scenario:>13} {count:>5} repos {'':>17}  peak rss {result['peak_rss_mb']} MB, {result['processes']} processes")
+
+    output = {
+        'meta': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'commit': subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, capture_output=True, text=True).stdout.strip(),
+            'settings': {
+                'latency': args.latency, 'output_lines': args.output_lines, 'fail_rate': args.fail_rate,
+                'docker_backend': args.docker_backend, 'repetitions': args.repetitions,
+            },
+        },
+        'results': results,
+    }
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+
+        if baseline['meta']['settings'] != output['meta']['settings']:
+            print(f"baseline was run with different settings: {baseline['meta']['settings']}")
+
+        output['comparison'] = compare(results, baseline['results'], args.tolerance)
+        for change in output['comparison']:
+            label = 'REGRESSION' if change['regression'] else 'improved'
+            print(f"{label:>10}: {change['scenario']} {change['repos']} repos {change['phase']} {change['metric']} "
+                  f"{change['baseline']} -> {change['current']} ({change['change']:+.0%})")
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(output, file, indent=2)
+
+    return 1 if any(change['regression'] for change in output.get('comparison', [])) else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repos', type=lambda value: [int(n) for n in value.split(',')], default=[1, 10, 100, 500])
+    parser.add_argument('--scenarios', type=lambda value: value.split(','), default=list(SCENARIOS))
+    parser.add_argument('--latency', default='0', help="fake command latency, e.g. 0.05 or 'git ls-remote=0.2,*=0.01'")
+    parser.add_argument('--output-lines', type=int, default=20)
+    parser.add_argument('--fail-rate', type=float, default=0.0)
+    parser.add_argument('--docker-backend', choices=('api', 'cli'), default='api')
+    parser.add_argument('--repetitions', type=int, default=20, help="requests per dashboard route, config reloads")
+    parser.add_argument('--output', help="write results as JSON to this file")
+    parser.add_argument('--baseline', help="results JSON of an earlier run to compare with")
+    parser.add_argument('--tolerance', type=float, default=0.1)
+
+    # internal, used for the worker and fake daemon processes
+    parser.add_argument('--worker', choices=SCENARIOS, help=argparse.SUPPRESS)
+    parser.add_argument('--fake-docker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--count', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--run-dir', help=argparse.SUPPRESS)
+    parser.add_argument('--socket', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args)
+    elif args.fake_docker:
+        fake_docker(args)
+    else:
+        sys.exit(main(args))
@@ -0,0 +1,128 @@
+"""
+Compares the chunked poll_output reader with the previous readline/wait_for loop.
+
+    python tools/bench_poll_output.py [--lines 200000] [--concurrency 20] [--quiet-seconds 3]
+
+Two scenarios are measured for each implementation:
+  volume - concurrent producers writing as fast as possible (throughput)
+  quiet  - concurrent producers that stay silent for a while (idle wakeups)
+
+CPU time is the autodock side only (process_time of this process).
+"""
+import os
+import sys
+import time
+import json
+import shlex
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import subprocess_functions
+
+
+async def legacy_poll_output(cmd, cwd='/', callback=None):
+    process = await asyncio.create_subprocess_shell(
+        cmd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT,
+        cwd=cwd
+    )
+
+    try:
+        while True:
+            try:
+                line = await asyncio.wait_for(process.stdout.readline(), timeout=0.1)
+            except asyncio.TimeoutError:
+                if process.returncode is not None:
+                    break
+                continue
+
+            if not line:
+                break
+
+            line = line.decode().strip()
+            if callback:
+                callback(line)
+
+    except Exception as e:
+        print(f"Error reading output: {e}")
+    finally:
+        await process.wait()
+
+
+async def current_poll_output(cmd, cwd='/', callback=None):
+    await subprocess_functions.poll_output(cmd, cwd, callback=callback)
+
+
+def producer(lines, line_length, quiet_seconds):
+    script = (
+        "import sys, time\n"
+        f"time.sleep({quiet_seconds})\n"
+        f"line = 'x' * {line_length} + '\\n'\n"
+        f"sys.stdout.write(line * {lines})\n"
+    )
+    return f"{sys.executable} -c {shlex.quote(script)}"
+
+
+async def measure(implementation, cmd, concurrency):
+    received = 0
+
+    def callback(line):
+        nonlocal received
+        received += 1
+
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+
+    await asyncio.gather(*[implementation(cmd, callback=callback) for _ in range(concurrency)])
+
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+
+    return {
+        'wall_seconds': round(wall, 3),
+        'cpu_seconds': round(cpu, 3),
+        'lines': received,
+        'lines_per_second': round(received / wall) if wall else None,
+    }
+
+
+async def run(args):
+    scenarios = {
+        'volume': (producer(args.lines, args.line_length, 0), args.concurrency),
+        'quiet': (producer(10, args.line_length, args.quiet_seconds), args.concurrency),
+    }
+    implementations = {
+        'legacy': legacy_poll_output,
+        'current': current_poll_output,
+    }
+
+    results = {}
+    for scenario, (cmd, concurrency) in scenarios.items():
+        for name, implementation in implementations.items():
+            result = await measure(implementation, cmd, concurrency)
+            results[f"{scenario}/{name}"] = result
+            print(f"{scenario:>7} {name:>8}: {result}")
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lines', type=int, default=200_000)
+    parser.add_argument('--line-length', type=int, default=80)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--quiet-seconds', type=float, default=3)
+    parser.add_argument('--output', help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    # silence the SUBPROCESS prints so they do not count towards CPU time
+    subprocess_functions.print = lambda *a, **k: None
+
+    results = asyncio.run(run(args))
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
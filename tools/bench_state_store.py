@@ -0,0 +1,120 @@
+"""
+Cost of persisting repo_data after a mutation, by number of repos.
+
+    python tools/bench_state_store.py [--repos 1,10,100,500,1000] [--history 200] [--mutations 50]
+
+  legacy     - globals.write_json_file of the whole state (what every stage used to do)
+  journal    - state_store.save + flush, one journal record for the mutated repo
+  compaction - one snapshot of the whole state, encoded on the loop and written off it
+
+"loop ms" is the time the event loop is blocked, "total ms" includes the work done in threads.
+"""
+import os
+import sys
+import time
+import json
+import asyncio
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import globals
+import state_store
+
+
+def make_state(repos, history):
+    return {
+        f"repo-{i}": {
+            'stages': {'update': 'a' * 40, 'build': 'a' * 40, 'deploy': 'a' * 40},
+            'build_number': history,
+            'version_history': [f"repo-{i}:v{n}" for n in range(history)],
+            'builds': {
+                f"repo-{i}:v{n}": {'hash': 'a' * 40, 'builder': 'legacy', 'seconds': 12.5, 'steps': []}
+                for n in range(min(history, 20))
+            },
+        }
+        for i in range(repos)
+    }
+
+
+def legacy(directory, data, mutations):
+    path = os.path.join(directory, 'legacy.json')
+    loop_seconds = 0.0
+
+    for n in range(mutations):
+        data[f"repo-{n % len(data)}"]['build_number'] += 1
+
+        started = time.perf_counter()
+        globals.write_json_file(path, data)
+        loop_seconds += time.perf_counter() - started
+
+    return {'loop_ms': loop_seconds / mutations * 1000, 'total_ms': loop_seconds / mutations * 1000}
+
+
+async def journal(directory, data, mutations):
+    store = state_store.StateStore(os.path.join(directory, 'journal.json'), flush_delay=0, compact_records=10 ** 9, compact_interval=10 ** 9)
+    loop_seconds = 0.0
+    total_seconds = 0.0
+
+    for n in range(mutations):
+        name = f"repo-{n % len(data)}"
+        data[name]['build_number'] += 1
+
+        started = time.perf_counter()
+        store.dirty.add(name)
+        records = store.take_records()
+        loop_seconds += time.perf_counter() - started
+
+        await asyncio.to_thread(state_store.append_journal, store.journal_path(store.generation), records)
+        total_seconds += time.perf_counter() - started
+
+    return {'loop_ms': loop_seconds / mutations * 1000, 'total_ms': total_seconds / mutations * 1000}
+
+
+async def compaction(directory, data):
+    path = os.path.join(directory, 'snapshot.json')
+
+    started = time.perf_counter()
+    snapshot = state_store.encode_snapshot(data, 0)
+    loop_seconds = time.perf_counter() - started
+
+    await asyncio.to_thread(state_store.write_snapshot, path, snapshot)
+    total_seconds = time.perf_counter() - started
+
+    return {'loop_ms': loop_seconds * 1000, 'total_ms': total_seconds * 1000, 'snapshot_bytes': len(snapshot)}
+
+
+async def run(args):
+    results = {}
+
+    for repos in args.repos:
+        data = make_state(repos, args.history)
+        globals.repo_data = data
+
+        with tempfile.TemporaryDirectory() as directory:
+            results[repos] = {
+                'legacy': legacy(directory, data, args.mutations),
+                'journal': await journal(directory, data, args.mutations),
+                'compaction': await compaction(directory, data),
+            }
+
+        for method, result in results[repos].items():
+            print(f"{repos:>6} repos {method:>10}: loop {result['loop_ms']:9.3f} ms  total {result['total_ms']:9.3f} ms")
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repos', type=lambda value: [int(n) for n in value.split(',')], default=[1, 10, 100, 500, 1000])
+    parser.add_argument('--history', type=int, default=200, help="version_history length per repo")
+    parser.add_argument('--mutations', type=int, default=50)
+    parser.add_argument('--output', help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
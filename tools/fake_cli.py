@@ -0,0 +1,256 @@
+"""
+Stand-in for the `git` and `docker` executables, used by tools/bench_autodock.py.
+
+    python tools/fake_cli.py install /tmp/fake-bin     # writes git and docker wrappers
+    PATH=/tmp/fake-bin:$PATH FAKE_CLI_DIR=/tmp/fake-state python main.py
+
+Behaviour is configured through the environment:
+
+  FAKE_CLI_DIR           state directory (remote generation, containers, images, call log)
+  FAKE_CLI_LATENCY       seconds per call, either one number or per family with a default:
+                         "git ls-remote=0.2,docker build=1,*=0.01"
+  FAKE_CLI_OUTPUT_LINES  progress lines printed by clone, pull, build and run (default 20)
+  FAKE_CLI_FAIL_RATE     probability that clone, pull, build or run fails (default 0)
+
+Remote heads are derived from the url, the branch and the number in FAKE_CLI_DIR/generation,
+so bumping the generation looks like a new commit on every remote.
+"""
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+from datetime import datetime
+
+
+MUTATING = {'git clone', 'git fetch', 'git pull', 'docker build', 'docker buildx', 'docker run'}
+
+
+def state_dir():
+    path = os.environ.get('FAKE_CLI_DIR', '/tmp/fake-cli')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def state_path(*parts):
+    path = os.path.join(state_dir(), *parts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+def generation():
+    try:
+        with open(state_path('generation')) as file:
+            return int(file.read() or 0)
+    except FileNotFoundError:
+        return 0
+
+
+def digest(*parts):
+    return hashlib.sha1('|'.join(str(part) for part in parts).encode()).hexdigest()
+
+
+def family(program, args):
+    skip = False
+    for arg in args:
+        if skip:
+            skip = False
+        elif arg in ('-C', '-c'):
+            skip = True
+        elif not arg.startswith('-'):
+            return f"{program} {arg}"
+    return program
+
+
+def latency(name):
+    setting = os.environ.get('FAKE_CLI_LATENCY', '0')
+    if '=' not in setting:
+        return float(setting)
+
+    values = dict(item.split('=', 1) for item in setting.split(','))
+    return float(values.get(name, values.get('*', 0)))
+
+
+def record_call(name):
+    # one line per process, appends of this size are atomic
+    with open(state_path('calls.log'), 'a') as file:
+        file.write(name + '\n')
+
+
+def positional(args, skip_values=()):
+    result = []
+    skip = False
+    for arg in args:
+        if skip:
+            skip = False
+        elif arg in skip_values:
+            skip = True
+        elif not arg.startswith('-'):
+            result.append(arg)
+    return result
+
+
+def option(args, names):
+    for i, arg in enumerate(args):
+        if arg in names and i + 1 < len(args):
+            return args[i + 1]
+        for name in names:
+            if arg.startswith(name + '='):
+                return arg.split('=', 1)[1]
+    return None
+
+
+def progress(prefix, lines):
+    for i in range(1, lines + 1):
+        print(f"{prefix} {i * 100 // lines}% ({i}/{lines})", flush=False)
+
+##  git
+
+def git(args):
+    if args[:1] == ['-C']:
+        args = args[2:]
+
+    command, args = args[0], args[1:]
+    lines = int(os.environ.get('FAKE_CLI_OUTPUT_LINES', 20))
+
+    if command == 'ls-remote':
+        url, *refs = positional(args)
+        for ref in refs:
+            print(f"{digest(url, ref, generation())}\t{ref}")
+
+    elif command == 'clone':
+        url, target = positional(args, ('--branch', '--reference-if-able', '--depth', '--filter'))[-2:]
+        os.makedirs(os.path.join(target, '.git'), exist_ok=True)
+        with open(os.path.join(target, 'Dockerfile'), 'w') as file:
+            file.write("FROM scratch\n")
+        progress("Receiving objects:", lines)
+        print("Receiving objects: 100% (20/20), 1.00 MiB | 10.00 MiB/s, done.")
+
+    elif command in ('fetch', 'pull', 'reset'):
+        progress("Receiving objects:", lines)
+
+    elif command == 'ls-tree':
+        # one file changes with every commit, the rest of the tree is stable
+        commit = positional(args)[-1]
+        print(f"100644 blob {digest('Dockerfile')}\tDockerfile")
+        print(f"100644 blob {digest('src', commit)}\tsrc/main.py")
+        for i in range(lines):
+            print(f"100644 blob {digest('static', i)}\tstatic/file-{i}.txt")
+
+    elif command == 'diff':
+        print("src/main.py")
+
+##  docker
+
+def container_file(name):
+    return state_path('containers', name.replace('/', '_'))
+
+
+def image_file(tag):
+    return state_path('images', tag.replace('/', '_'))
+
+
+def docker(args):
+    command, args = args[0], args[1:]
+    lines = int(os.environ.get('FAKE_CLI_OUTPUT_LINES', 20))
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S +0000 UTC')
+
+    if command == 'buildx':
+        command, args = args[0], args[1:]
+
+    if command == 'build':
+        for i in range(1, lines + 1):
+            print(f"Step {i}/{lines} : RUN make step-{i}")
+        tags = [args[i + 1] for i, arg in enumerate(args) if arg == '-t']
+        for tag in tags:
+            with open(image_file(tag), 'w') as file:
+                file.write(now)
+        print(f"Successfully built {digest(*tags)[:12]}")
+
+    elif command == 'run':
+        name = option(args, ('--name',))
+        image = positional(args, ('--name', '-p', '-e', '-v', '--network'))[-1]
+        host_port, _, container_port = (option(args, ('-p',)) or '8080:8080').rpartition(':')
+        with open(container_file(name), 'w') as file:
+            json.dump({'image': image, 'created': now, 'ports': {f"{container_port}/tcp": [{'HostIp': '0.0.0.0', 'HostPort': host_port}]}}, file)
+        progress("Starting", lines)
+        print(digest(name, time.time()))
+
+    elif command == 'rm':
+        for name in positional(args):
+            try:
+                os.remove(container_file(name))
+                print(name)
+            except FileNotFoundError:
+                print(f"Error: No such container: {name}", file=sys.stderr)
+                return 1
+
+    elif command == 'ps':
+        for name in sorted(os.listdir(state_path('containers', ''))):
+            with open(container_file(name)) as file:
+                container = json.load(file)
+            ports = ', '.join(f"0.0.0.0:{binding[0]['HostPort']}->{port}" for port, binding in container['ports'].items())
+            print(f"{digest(name)};{name};running;{container['created']};{ports};{container['image']}")
+
+    elif command == 'image' and args[:1] == ['ls']:
+        for tag in sorted(os.listdir(state_path('images', ''))):
+            repository, _, version = tag.rpartition(':')
+            print(f"sha256:{digest(tag)};{repository};{version};{now};100MB")
+
+    elif command == 'inspect':
+        output = []
+        for name in positional(args):
+            try:
+                with open(container_file(name)) as file:
+                    container = json.load(file)
+            except FileNotFoundError:
+                continue
+            output.append({'Id': digest(name), 'Name': f"/{name}", 'Created': container['created'],
+                           'State': {'Status': 'running', 'Running': True}, 'Config': {'Image': container['image']},
+                           'NetworkSettings': {'Ports': container['ports']}})
+        print(json.dumps(output))
+        return 0 if output else 1
+
+    elif command == 'logs':
+        for i in range(lines):
+            print(f"log line {i}")
+
+    return 0
+
+
+def install(directory):
+    os.makedirs(directory, exist_ok=True)
+    script = os.path.abspath(__file__)
+
+    for program in ('git', 'docker'):
+        path = os.path.join(directory, program)
+        with open(path, 'w') as file:
+            file.write(f"#!/bin/sh\nexec {sys.executable} {script} {program} \"$@\"\n")
+        os.chmod(path, 0o755)
+
+
+def main(argv):
+    program, args = argv[0], argv[1:]
+
+    if program == 'install':
+        install(args[0])
+        return 0
+
+    name = family(program, args)
+    record_call(name)
+
+    time.sleep(latency(name))
+
+    if name in MUTATING and random.random() < float(os.environ.get('FAKE_CLI_FAIL_RATE', 0)):
+        print(f"fatal: simulated failure of {name}", file=sys.stderr)
+        return 1
+
+    if not args:
+        return 0
+
+    return (git if program == 'git' else docker)(args) or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
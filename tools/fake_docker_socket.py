@@ -0,0 +1,349 @@
+"""
+Minimal in-memory Docker Engine API served over a unix socket.
+
+Used to exercise docker_api/docker_functions without a docker daemon:
+
+    python tools/fake_docker_socket.py /tmp/docker.sock
+    DOCKER_HOST=unix:///tmp/docker.sock python main.py
+"""
+import re
+import sys
+import json
+import time
+import asyncio
+import hashlib
+from urllib.parse import urlsplit, parse_qs, unquote
+
+
+def fake_id(seed):
+    return hashlib.sha256(seed.encode()).hexdigest()
+
+
+class FakeDockerDaemon:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.containers = {}
+        self.images = {}
+        self.logs = {}
+        self.build_cache = 0
+
+        self.subscribers = set()
+        self.log_subscribers = {}
+
+        self.connections = 0
+        self.requests = 0
+
+    def write_log(self, container_id, line):
+        self.logs[container_id].append(line)
+        for queue in self.log_subscribers.get(container_id, set()):
+            queue.put_nowait(line)
+
+    def emit(self, event_type, action, actor_id, attributes=None):
+        event = {
+            'Type': event_type,
+            'Action': action,
+            'Actor': {'ID': actor_id, 'Attributes': attributes or {}},
+            'time': int(time.time()),
+        }
+        for queue in self.subscribers:
+            queue.put_nowait(event)
+
+    ##  state
+
+    def add_image(self, repo_tag, size=100_000_000):
+        image_id = f"sha256:{fake_id(repo_tag)}"
+        image = self.images.setdefault(image_id, {
+            'Id': image_id,
+            'RepoTags': [],
+            'Created': int(time.time()),
+            'Size': size,
+        })
+        image['RepoTags'].append(repo_tag)
+
+        return image_id
+
+    def add_container(self, name, image='fake:latest', status='running', port=8080, host_port=None):
+        container_id = fake_id(name)
+        self.containers[container_id] = {
+            'Id': container_id,
+            'Name': f"/{name}",
+            'Created': time.strftime("%Y-%m-%dT%H:%M:%S.000000000Z", time.gmtime()),
+            'Image': image,
+            'State': {
+                'Status': status,
+                'Running': status == 'running',
+                'StartedAt': time.strftime("%Y-%m-%dT%H:%M:%S.000000000Z", time.gmtime()),
+            },
+            'Config': {'Tty': False, 'Image': image},
+            'NetworkSettings': {
+                'Ports': {
+                    f"{port}/tcp": [{'HostIp': '0.0.0.0', 'HostPort': str(host_port or port)}]
+                }
+            },
+        }
+        self.logs[container_id] = []
+
+        return container_id
+
+    def find_container(self, ref):
+        for container_id, container in self.containers.items():
+            if ref in (container_id, container_id[:12], container['Name'][1:]):
+                return container
+        return None
+
+    def find_image(self, ref):
+        for image_id, image in self.images.items():
+            if ref in (image_id, image_id[7:], image_id[7:19]) or ref in image['RepoTags']:
+                return image
+        return None
+
+    ##  routes
+
+    def route(self, method, path, query):
+        path = re.sub(r'^/v[0-9.]+', '', path)
+
+        if path == '/_ping':
+            return 200, 'OK'
+
+        if method == 'GET' and path == '/containers/json':
+            names = json.loads(query.get('filters', '{}')).get('name')
+            return 200, [self.container_summary(c) for c in self.containers.values()
+                         if (query.get('all') or c['State']['Running'])
+                         and (not names or any(re.search(name, c['Name']) for name in names))]
+
+        if method == 'GET' and path == '/images/json':
+            return 200, list(self.images.values())
+
+        if method == 'GET' and path == '/system/df':
+            return 200, {
+                'LayersSize': sum(image['Size'] for image in self.images.values()),
+                'BuildCache': [{'Size': self.build_cache}],
+            }
+
+        if method == 'POST' and path == '/images/prune':
+            return 200, {'ImagesDeleted': None, 'SpaceReclaimed': 0}
+
+        if method == 'POST' and path == '/build/prune':
+            reclaimed = max(self.build_cache - int(query.get('keep-storage', 0)), 0)
+            self.build_cache -= reclaimed
+            return 200, {'CachesDeleted': None, 'SpaceReclaimed': reclaimed}
+
+        match = re.fullmatch(r'/containers/([^/]+)(?:/(\w+))?', path)
+        if match:
+            container = self.find_container(unquote(match.group(1)))
+            action = match.group(2)
+
+            if not container:
+                return 404, {'message': f"No such container: {unquote(match.group(1))}"}
+
+            if method == 'GET' and action == 'json':
+                return 200, container
+            if method == 'GET' and action == 'logs':
+                return 200, self.container_logs(container, query)
+            if method == 'DELETE' and not action:
+                if container['State']['Running'] and not query.get('force'):
+                    return 409, {'message': 'You cannot remove a running container'}
+                del self.containers[container['Id']]
+                return 204, None
+            if method == 'POST' and action:
+                return self.container_action(container, action)
+
+        match = re.fullmatch(r'/images/(.+)', path)
+        if match and method == 'DELETE':
+            image = self.find_image(unquote(match.group(1)))
+            if not image:
+                return 404, {'message': f"No such image: {unquote(match.group(1))}"}
+            del self.images[image['Id']]
+            return 200, [{'Deleted': image['Id']}]
+
+        return 404, {'message': 'page not found'}
+
+    def container_summary(self, container):
+        ports = []
+        for private, bindings in container['NetworkSettings']['Ports'].items():
+            port, port_type = private.split('/')
+            for binding in bindings or []:
+                ports.append({
+                    'IP': binding['HostIp'],
+                    'PrivatePort': int(port),
+                    'PublicPort': int(binding['HostPort']),
+                    'Type': port_type,
+                })
+
+        return {
+            'Id': container['Id'],
+            'Names': [container['Name']],
+            'Image': container['Image'],
+            'Created': int(time.time()),
+            'State': container['State']['Status'],
+            'Ports': ports,
+        }
+
+    def container_logs(self, container, query):
+        lines = self.logs[container['Id']]
+        tail = query.get('tail', 'all')
+        if tail != 'all':
+            lines = lines[-int(tail):] if int(tail) else []
+
+        frames = []
+        for line in lines:
+            payload = f"{line}\n".encode()
+            frames.append(b'\x01\x00\x00\x00' + len(payload).to_bytes(4, 'big') + payload)
+
+        return b''.join(frames)
+
+    def container_action(self, container, action):
+        state = container['State']
+        status = {
+            'start': 'running',
+            'restart': 'running',
+            'unpause': 'running',
+            'stop': 'exited',
+            'kill': 'exited',
+            'pause': 'paused',
+        }.get(action)
+
+        if not status:
+            return 404, {'message': 'page not found'}
+        if action == 'start' and state['Running']:
+            return 304, None
+
+        state['Status'] = status
+        state['Running'] = status == 'running'
+        self.emit('container', action if action != 'kill' else 'die', container['Id'], {'name': container['Name'][1:]})
+        return 204, None
+
+    ##  http
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+
+        try:
+            while True:
+                try:
+                    request_line = await reader.readuntil(b"\r\n")
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+
+                method, target, _ = request_line.decode().split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readuntil(b"\r\n")
+                    if line == b"\r\n":
+                        break
+                    key, _, value = line.decode().partition(':')
+                    headers[key.strip().lower()] = value.strip()
+
+                if int(headers.get('content-length', 0)):
+                    await reader.readexactly(int(headers['content-length']))
+
+                self.requests += 1
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+
+                url = urlsplit(target)
+                query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+
+                if re.sub(r'^/v[0-9.]+', '', url.path) == '/events':
+                    await self.stream_events(writer)
+                    break
+
+                if query.get('follow') and url.path.endswith('/logs'):
+                    await self.stream_logs(writer, url.path.split('/')[-2], query)
+                    break
+
+                status, body = self.route(method, url.path, query)
+
+                writer.write(self.encode_response(status, body))
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def stream_events(self, writer):
+        queue = asyncio.Queue()
+        self.subscribers.add(queue)
+
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nTransfer-Encoding: chunked\r\n\r\n")
+        try:
+            while True:
+                payload = json.dumps(await queue.get()).encode() + b"\n"
+                writer.write(f"{len(payload):x}\r\n".encode() + payload + b"\r\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.subscribers.discard(queue)
+
+    async def stream_logs(self, writer, ref, query):
+        container = self.find_container(unquote(ref))
+        if not container:
+            writer.write(self.encode_response(404, {'message': f"No such container: {ref}"}))
+            return
+
+        queue = asyncio.Queue()
+        self.log_subscribers.setdefault(container['Id'], set()).add(queue)
+
+        def chunk(payload):
+            return f"{len(payload):x}\r\n".encode() + payload + b"\r\n"
+
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/vnd.docker.multiplexed-stream\r\nTransfer-Encoding: chunked\r\n\r\n")
+        backlog = self.container_logs(container, query)
+        if backlog:
+            writer.write(chunk(backlog))
+
+        try:
+            while True:
+                payload = f"{await queue.get()}\n".encode()
+                writer.write(chunk(b'\x01\x00\x00\x00' + len(payload).to_bytes(4, 'big') + payload))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.log_subscribers[container['Id']].discard(queue)
+
+    def encode_response(self, status, body):
+        if body is None:
+            payload, content_type = b'', 'application/json'
+        elif isinstance(body, bytes):
+            payload, content_type = body, 'application/vnd.docker.multiplexed-stream'
+        elif isinstance(body, str):
+            payload, content_type = body.encode(), 'text/plain'
+        else:
+            payload, content_type = json.dumps(body).encode(), 'application/json'
+
+        head = f"HTTP/1.1 {status} Fake\r\nContent-Type: {content_type}\r\n"
+
+        # large bodies are sent chunked like the real daemon does
+        if len(payload) > 4096:
+            chunks = [payload[i:i + 4096] for i in range(0, len(payload), 4096)]
+            encoded = b''.join(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n" for chunk in chunks)
+            return (head + "Transfer-Encoding: chunked\r\n\r\n").encode() + encoded + b"0\r\n\r\n"
+
+        if status in (204, 304):
+            return (head + "\r\n").encode()
+
+        return (head + f"Content-Length: {len(payload)}\r\n\r\n").encode() + payload
+
+    async def start(self, socket_path):
+        self.server = await asyncio.start_unix_server(self.handle, socket_path)
+        return self.server
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+
+async def serve(socket_path):
+    daemon = FakeDockerDaemon()
+    daemon.add_image('example:v0')
+    daemon.add_container('example', image='example:v0')
+
+    server = await daemon.start(socket_path)
+    print(f"FAKE DOCKER: listening on {socket_path}")
+
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    asyncio.run(serve(sys.argv[1] if len(sys.argv) > 1 else '/tmp/docker.sock'))